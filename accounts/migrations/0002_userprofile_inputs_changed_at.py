@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='inputs_changed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -11,6 +11,9 @@ class UserProfile(models.Model):
     bio = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Last change to anything "For You" recommendations are computed from;
+    # set by recommendations/signals.py, never by a plain save
+    inputs_changed_at = models.DateTimeField(null=True, blank=True, db_index=True)
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
@@ -1,14 +1,17 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.db import OperationalError
-from .models import UserProfile
+from playlists.fragments import fragment_cache
+from .models import UserBadge, UserProfile
 
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Automatically create UserProfile when a User is created"""
     if created:
+        # A reused user id must not pick up an old user's cached fragments
+        fragment_cache.bump('user', instance.pk)
         try:
             UserProfile.objects.get_or_create(user=instance)
         except OperationalError:
@@ -23,3 +26,9 @@ def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'profile'):
         instance.profile.save()
 
+
+@receiver(post_save, sender=UserBadge)
+@receiver(post_delete, sender=UserBadge)
+def user_badge_saved(sender, instance, **kwargs):
+    """Badges show on the profile page"""
+    fragment_cache.bump('user', instance.user_id)
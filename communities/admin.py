@@ -8,4 +8,12 @@ class CommunityAdmin(admin.ModelAdmin):
     list_filter = ['is_public', 'genre', 'created_at']
     search_fields = ['name', 'description', 'genre']
     filter_horizontal = ['members']
+    list_select_related = ['created_by']
+    readonly_fields = ['member_count', 'message_count']
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Members edited here bypass the join/leave views
+        community = form.instance
+        Community.objects.filter(id=community.id).update(member_count=community.members.count())
 
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Community = apps.get_model('communities', 'Community')
+    CommunityMessage = apps.get_model('communities', 'CommunityMessage')
+    members = Community.members.through.objects.filter(community=OuterRef('pk')).order_by().values('community')
+    messages = CommunityMessage.objects.filter(community=OuterRef('pk')).order_by().values('community')
+    Community.objects.update(
+        member_count=Coalesce(Subquery(members.annotate(n=Count('id')).values('n')), 0),
+        message_count=Coalesce(Subquery(messages.annotate(n=Count('id')).values('n')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communities', '0003_alter_musicmatch_unique_together_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='community',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='community',
+            name='message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='community',
+            index=models.Index(fields=['-member_count'], name='community_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
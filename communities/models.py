@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 
 
@@ -12,12 +13,24 @@ class Community(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=True)
+    # Stored counters, changed alongside members and messages (repair_counters recomputes them)
+    member_count = models.IntegerField(default=0)
+    message_count = models.IntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-member_count'], name='community_popular_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
-    def member_count(self):
-        return self.members.count()
+    def adjust_counters(self, members=0, messages=0):
+        """Add to the stored counters in the database, safe against concurrent writers"""
+        Community.objects.filter(id=self.id).update(
+            member_count=F('member_count') + members,
+            message_count=F('message_count') + messages,
+        )
 
 
 class CommunityMessage(models.Model):
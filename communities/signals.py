@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from playlists.fragments import fragment_cache
+from .models import Community
+
+
+@receiver(post_save, sender=Community)
+@receiver(post_delete, sender=Community)
+def community_saved(sender, instance, **kwargs):
+    fragment_cache.bump('community', instance.pk)
@@ -0,0 +1,160 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from playlists.models import Playlist, PlaylistSong, Song
+from .models import Community, CommunityMessage
+from .views import community_detail_view
+
+
+# The admin pages need static files; skip the production manifest in tests
+PLAIN_STATIC_FILES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Fragment tests get a cache of their own, so nothing carries over between runs
+FRAGMENT_TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragment-tests'},
+}
+
+
+# Query counts below are for pages rendered without cached fragments
+@override_settings(STORAGES=PLAIN_STATIC_FILES, FRAGMENT_CACHE_TIMEOUT=0)
+class CommunityCountQueryTests(TestCase):
+    """Pages listing communities run the same number of queries for any number of rows"""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('member', password='pw')
+        self.client.force_login(self.user)
+        self.community = Community.objects.create(name="Jazz Club", description="d", created_by=self.user)
+        self.community.members.add(self.user)
+
+    def add_rows(self, count):
+        for i in range(count):
+            n = Community.objects.count()
+            other = User.objects.create_user(f"user{n}")
+            community = Community.objects.create(name=f"Community {n}", description="d", created_by=other)
+            community.members.add(self.user, other)
+            self.community.members.add(other)
+            playlist = Playlist.objects.create(owner=other, name=f"Playlist {n}", community=self.community)
+            song = Song.objects.create(spotify_id=f"song-{n}", name="Song", artist="Artist")
+            PlaylistSong.objects.create(playlist=playlist, song=song)
+        call_command('repair_counters', stdout=StringIO())
+
+    def test_explore(self):
+        for count in (1, 5):
+            self.add_rows(count)
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('explore'))
+            self.assertContains(response, "2 members")
+
+    def test_detail(self):
+        for count in (1, 5):
+            self.add_rows(count)
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('community_detail', args=[self.community.id]))
+            self.assertContains(response, "1 songs")
+
+    def test_admin_changelist(self):
+        for count in (1, 5):
+            self.add_rows(count)
+            with self.assertNumQueries(6):
+                response = self.client.get(reverse('admin:communities_community_changelist'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_explore_sorted_by_members(self):
+        self.add_rows(2)
+        response = self.client.get(reverse('explore'), {'sort': 'popular'})
+        self.assertEqual(list(response.context['communities'])[0], self.community)
+
+
+class CommunityCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('member', password='pw')
+        self.client.force_login(self.user)
+        self.client.post(reverse('create_community'), {'name': "Jazz Club", 'description': "d"})
+        self.community = Community.objects.get()
+
+    def counters(self):
+        self.community.refresh_from_db()
+        return self.community.member_count, self.community.message_count
+
+    def test_create_counts_creator(self):
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_join_leave_and_message(self):
+        other = User.objects.create_user('other')
+        self.client.force_login(other)
+        self.client.get(reverse('join_community', args=[self.community.id]))
+        self.client.get(reverse('join_community', args=[self.community.id]))  # Already a member
+        self.client.post(reverse('send_message', args=[self.community.id]), {'message': "hi"})
+        self.client.post(reverse('send_message', args=[self.community.id]), {'message': "  "})
+        self.assertEqual(self.counters(), (2, 1))
+
+        self.client.get(reverse('leave_community', args=[self.community.id]))
+        self.client.get(reverse('leave_community', args=[self.community.id]))
+        self.assertEqual(self.counters(), (1, 1))
+
+
+@override_settings(CACHES=FRAGMENT_TEST_CACHES)
+class CommunityFragmentTests(TestCase):
+    """The community's playlist list is cached until a playlist on it changes"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member', password='pw')
+        self.client.force_login(self.user)
+        self.community = Community.objects.create(name="Jazz Club", description="d", created_by=self.user)
+        self.community.members.add(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Late Night")
+        self.url = reverse('community_detail', args=[self.community.id])
+
+    def test_playlist_changes_invalidate(self):
+        self.assertNotContains(self.client.get(self.url), "Late Night")
+        self.client.post(reverse('share_playlist_to_community', args=[self.playlist.id]), {'community_id': self.community.id})
+        self.assertContains(self.client.get(self.url), "0 songs")
+
+        self.client.post(reverse('add_song_to_playlist', args=[self.playlist.id]), {
+            'spotify_id': 'a', 'name': "Song", 'artist': "Artist",
+        })
+        self.assertContains(self.client.get(self.url), "1 songs")
+
+        self.playlist.refresh_from_db()
+        self.playlist.community = None
+        self.playlist.save()
+        self.assertNotContains(self.client.get(self.url), "Late Night")
+
+
+class CommunityConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('member', password='pw')
+        self.community = Community.objects.create(name="Jazz Club", description="d", created_by=self.user)
+        self.community.members.add(self.user)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get('/', **headers)
+        request.user = self.user
+        return community_detail_view(request, self.community.id)
+
+    def test_not_modified_costs_one_query(self):
+        etag = self.get()['ETag']
+        with self.assertNumQueries(1):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate(self):
+        etag = self.get()['ETag']
+        CommunityMessage.objects.create(community=self.community, user=self.user, message="hi")
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.get()['ETag']
+        playlist = Playlist.objects.create(owner=self.user, name="Shared", community=self.community)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.get()['ETag']
+        PlaylistSong.objects.create(playlist=playlist, song=Song.objects.create(spotify_id='a', name="Song", artist="Artist"))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
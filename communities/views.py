@@ -2,11 +2,23 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q, Subquery
 from django.utils import timezone
+from playlists.conditional import Validator
+from playlists.models import Playlist
 from .models import Community, CommunityMessage
 
 
+# ?sort= options for the explore page
+COMMUNITY_SORTS = {
+    'popular': '-member_count',
+    'active': '-message_count',
+    'newest': '-created_at',
+    'name': 'name',
+}
+
+
 @login_required
 def create_community_view(request):
     """Create a new community"""
@@ -17,14 +29,16 @@ def create_community_view(request):
         is_public = request.POST.get('is_public') == 'on'
         
         if name and description:
-            community = Community.objects.create(
-                name=name,
-                description=description,
-                genre=genre,
-                created_by=request.user,
-                is_public=is_public
-            )
-            community.members.add(request.user)
+            with transaction.atomic():
+                community = Community.objects.create(
+                    name=name,
+                    description=description,
+                    genre=genre,
+                    created_by=request.user,
+                    is_public=is_public,
+                    member_count=1,
+                )
+                community.members.add(request.user)
             messages.success(request, f'Community "{name}" created successfully!')
             return redirect('community_detail', community_id=community.id)
         else:
@@ -52,10 +66,17 @@ def explore_view(request):
             description__icontains=search_query
         )
     
+    # Sorts read the stored counters, so no aggregation is needed
+    sort = request.GET.get('sort', 'popular')
+    if sort not in COMMUNITY_SORTS:
+        sort = 'popular'
+    communities = communities.order_by(COMMUNITY_SORTS[sort], '-id')
+    
     context = {
         'communities': communities,
         'genre': genre,
         'search_query': search_query,
+        'sort': sort,
     }
     return render(request, 'communities/explore.html', context)
 
@@ -63,16 +84,41 @@ def explore_view(request):
 @login_required
 def community_detail_view(request, community_id):
     """Community detail page with chat"""
-    community = get_object_or_404(Community, id=community_id)
-    is_member = request.user in community.members.all()
+    # Everything the page's validator needs comes with the community in one query
+    shared = Playlist.objects.filter(community=OuterRef('pk')).order_by().values('community')
+    community = get_object_or_404(
+        Community.objects.select_related('created_by').annotate(
+            viewer_is_member=Exists(Community.members.through.objects.filter(community=OuterRef('pk'), user_id=request.user.id)),
+            last_message_id=Subquery(
+                CommunityMessage.objects.filter(community=OuterRef('pk')).order_by('-id').values('id')[:1]
+            ),
+            playlist_total=Subquery(shared.annotate(n=Count('id')).values('n')),
+            playlists_updated=Subquery(shared.annotate(last=Max('updated_at')).values('last')),
+        ),
+        id=community_id,
+    )
+    is_member = community.viewer_is_member
     
     # Only members can see the community details
     if not is_member and not community.is_public:
         messages.error(request, "You must be a member to view this community.")
         return redirect('explore')
     
+    # Song changes bump their playlist's updated_at, which playlists_updated picks up
+    validator = Validator(
+        request,
+        [
+            community.updated_at, community.member_count, community.message_count, community.last_message_id,
+            community.playlist_total, community.playlists_updated, is_member,
+        ],
+        max(filter(None, [community.updated_at, community.playlists_updated])),
+    )
+    not_modified = validator.not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    
     # Get community data
-    playlists = community.playlists.all()
+    playlists = community.playlists.select_related('owner')
     
     # Get recent chat messages (last 50)
     messages_list = community.messages.select_related('user').all()[:50]
@@ -83,7 +129,7 @@ def community_detail_view(request, community_id):
         'playlists': playlists,
         'messages_list': messages_list,
     }
-    return render(request, 'communities/detail.html', context)
+    return validator.stamp(render(request, 'communities/detail.html', context))
 
 
 @login_required
@@ -99,11 +145,13 @@ def send_message_view(request, community_id):
         
         message_text = request.POST.get('message', '').strip()
         if message_text:
-            CommunityMessage.objects.create(
-                community=community,
-                user=request.user,
-                message=message_text
-            )
+            with transaction.atomic():
+                CommunityMessage.objects.create(
+                    community=community,
+                    user=request.user,
+                    message=message_text
+                )
+                community.adjust_counters(messages=1)
         
         return redirect('community_detail', community_id=community_id)
     
@@ -113,9 +161,14 @@ def send_message_view(request, community_id):
 @login_required
 def join_community_view(request, community_id):
     """Join a community"""
-    community = get_object_or_404(Community, id=community_id)
-    if request.user not in community.members.all():
-        community.members.add(request.user)
+    with transaction.atomic():
+        # Lock the row so two joins by the same user can't both count
+        community = get_object_or_404(Community.objects.select_for_update(), id=community_id)
+        joined = not community.members.filter(id=request.user.id).exists()
+        if joined:
+            community.members.add(request.user)
+            community.adjust_counters(members=1)
+    if joined:
         messages.success(request, f'You joined {community.name}!')
     else:
         messages.info(request, f'You are already a member of {community.name}.')
@@ -125,9 +178,13 @@ def join_community_view(request, community_id):
 @login_required
 def leave_community_view(request, community_id):
     """Leave a community"""
-    community = get_object_or_404(Community, id=community_id)
-    if request.user in community.members.all():
-        community.members.remove(request.user)
+    with transaction.atomic():
+        community = get_object_or_404(Community.objects.select_for_update(), id=community_id)
+        left = community.members.filter(id=request.user.id).exists()
+        if left:
+            community.members.remove(request.user)
+            community.adjust_counters(members=-1)
+    if left:
         messages.success(request, f'You left {community.name}.')
     else:
         messages.info(request, f'You are not a member of {community.name}.')
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "musicmatch.settings")
 
 application = get_asgi_application()
+
+# Without nginx in front, serve collected static files from here
+if os.environ.get("SKIP_NGINX", "").lower() == "true":
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
@@ -105,6 +105,26 @@ if os.environ.get("USE_SQLITE", "False") == "True":
     }
 
 
+# Cache
+# Shared between all gunicorn workers so that things like the Spotify access
+# token are fetched once per host rather than once per process.
+# Set REDIS_URL to share the cache between hosts as well.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("CACHE_DIR", "/tmp/musicmatch_cache"),
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -161,3 +181,93 @@ LOGOUT_REDIRECT_URL = '/'
 # Get credentials from https://developer.spotify.com/dashboard
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', '')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', '')
+# Point these at a local stub (python manage.py spotify_stub) to run offline
+SPOTIFY_TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+SPOTIFY_API_BASE = os.environ.get('SPOTIFY_API_BASE', 'https://api.spotify.com/v1')
+
+# Refresh the client-credentials token this many seconds before it expires
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.environ.get('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+
+# Keep-alive connections per worker to each Spotify host, and retries on 5xx
+SPOTIFY_POOL_SIZE = int(os.environ.get('SPOTIFY_POOL_SIZE', '10'))
+SPOTIFY_HTTP_RETRIES = int(os.environ.get('SPOTIFY_HTTP_RETRIES', '2'))
+
+# Per-worker cache of Spotify search results: fresh for TTL seconds, then served
+# stale for up to STALE_TTL more while one request refreshes it in the background
+SPOTIFY_CACHE_TTL = int(os.environ.get('SPOTIFY_CACHE_TTL', '600'))
+SPOTIFY_CACHE_STALE_TTL = int(os.environ.get('SPOTIFY_CACHE_STALE_TTL', '3600'))
+SPOTIFY_CACHE_MAX_BYTES = int(os.environ.get('SPOTIFY_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Genre pages are rendered from warm_genre_pages snapshots younger than this
+SPOTIFY_SNAPSHOT_MAX_AGE = int(os.environ.get('SPOTIFY_SNAPSHOT_MAX_AGE', str(6 * 60 * 60)))
+
+# Spotify requests per second per worker (token bucket), and how long an
+# interactive request may wait for a slot before the user is told to retry
+SPOTIFY_RATE_LIMIT = float(os.environ.get('SPOTIFY_RATE_LIMIT', '10'))
+SPOTIFY_RATE_BURST = int(os.environ.get('SPOTIFY_RATE_BURST', '20'))
+SPOTIFY_THROTTLE_MAX_WAIT = float(os.environ.get('SPOTIFY_THROTTLE_MAX_WAIT', '2'))
+
+# Timeouts in seconds for each Spotify endpoint. A circuit opens for COOLDOWN
+# seconds once at least MIN_CALLS calls were made in the last WINDOW seconds
+# and FAILURE_RATE of them failed; pages then serve cached results instead
+SPOTIFY_LATENCY_BUDGETS = {
+    'token': 3.0,
+    'search': 2.5,
+    'tracks': 2.0,
+    'default': 3.0,
+}
+SPOTIFY_BREAKER_FAILURE_RATE = float(os.environ.get('SPOTIFY_BREAKER_FAILURE_RATE', '0.5'))
+SPOTIFY_BREAKER_MIN_CALLS = int(os.environ.get('SPOTIFY_BREAKER_MIN_CALLS', '5'))
+SPOTIFY_BREAKER_WINDOW = int(os.environ.get('SPOTIFY_BREAKER_WINDOW', '30'))
+SPOTIFY_BREAKER_COOLDOWN = int(os.environ.get('SPOTIFY_BREAKER_COOLDOWN', '30'))
+
+# Serve the Spotify-backed pages from the async views (set by start.sh when ASGI=True)
+SPOTIFY_ASYNC_VIEWS = os.environ.get('SPOTIFY_ASYNC_VIEWS', os.environ.get('ASGI', 'False')) == 'True'
+if os.environ.get('ASGI', 'False') == 'True':
+    # WhiteNoise's middleware is sync-only and would run every async view on a
+    # single thread; nginx (or asgi.py in SKIP_NGINX mode) serves /static/ instead
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
+# The recommendations page takes up to RECOMMENDATION_MAX_GENRES genres at
+# once (?genre=jazz,soul) and searches them concurrently on a pool of
+# SPOTIFY_FANOUT_WORKERS threads, showing RECOMMENDATION_PAGE_SIZE tracks
+RECOMMENDATION_MAX_GENRES = int(os.environ.get('RECOMMENDATION_MAX_GENRES', '5'))
+RECOMMENDATION_PAGE_SIZE = int(os.environ.get('RECOMMENDATION_PAGE_SIZE', '60'))
+SPOTIFY_FANOUT_WORKERS = int(os.environ.get('SPOTIFY_FANOUT_WORKERS', '8'))
+
+# Tracks seen in Spotify results are upserted into playlists.Song on a
+# background thread; set to False to write them inline (tests, commands)
+SONG_CATALOG_ASYNC = os.environ.get('SONG_CATALOG_ASYNC', 'True') == 'True'
+
+# Song searches are answered from the local catalog when it has at least this
+# many matches, and only go to Spotify otherwise
+LOCAL_SEARCH_MIN_HITS = int(os.environ.get('LOCAL_SEARCH_MIN_HITS', '10'))
+
+# Most tracks one bulk add-songs request (or moves one reorder request) may carry
+PLAYLIST_BULK_ADD_MAX = int(os.environ.get('PLAYLIST_BULK_ADD_MAX', '1000'))
+
+# Songs per page on the playlist page; "Load more" fetches the next page by cursor
+PLAYLIST_PAGE_SIZE = int(os.environ.get('PLAYLIST_PAGE_SIZE', '100'))
+
+# Rows read per query by playlist exports, and songs written per batch by imports
+PLAYLIST_TRANSFER_BATCH_SIZE = int(os.environ.get('PLAYLIST_TRANSFER_BATCH_SIZE', '2000'))
+
+# Seconds a cached playlist/community/profile fragment lives. Changes already
+# invalidate them through version keys (playlists/fragments.py); the timeout
+# only bounds relative times and song details edited elsewhere. 0 disables.
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', '600'))
+
+# Audio-feature index behind "similar songs". build_feature_index writes a
+# snapshot to FEATURE_INDEX_PATH that workers memory-map at startup; songs
+# added or edited later are picked up at most every FEATURE_INDEX_REFRESH_SECONDS
+FEATURE_INDEX_PATH = os.environ.get('FEATURE_INDEX_PATH', os.path.join(BASE_DIR, 'feature_index'))
+FEATURE_INDEX_REFRESH_SECONDS = int(os.environ.get('FEATURE_INDEX_REFRESH_SECONDS', '60'))
+# 'cosine' or 'euclidean'
+FEATURE_INDEX_METRIC = os.environ.get('FEATURE_INDEX_METRIC', 'cosine')
+
+# Recommendation impressions and likes/skips are queued per worker and
+# written in batches of FEEDBACK_FLUSH_SIZE, or FEEDBACK_FLUSH_INTERVAL
+# seconds after the first event; set FEEDBACK_BUFFERED=False to write inline
+FEEDBACK_BUFFERED = os.environ.get('FEEDBACK_BUFFERED', 'True') == 'True'
+FEEDBACK_FLUSH_SIZE = int(os.environ.get('FEEDBACK_FLUSH_SIZE', '500'))
+FEEDBACK_FLUSH_INTERVAL = float(os.environ.get('FEEDBACK_FLUSH_INTERVAL', '5'))
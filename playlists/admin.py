@@ -15,6 +15,8 @@ class PlaylistAdmin(admin.ModelAdmin):
     list_filter = ['is_public', 'is_collaborative', 'created_at']
     search_fields = ['name', 'description', 'owner__username']
     filter_horizontal = ['collaborators']
+    list_select_related = ['owner', 'community']
+    readonly_fields = ['song_count', 'total_duration_ms']
 
 
 @admin.register(PlaylistSong)
@@ -0,0 +1,221 @@
+"""Local catalog of every Spotify track the app has seen.
+
+Search, recommendation and similar-song results are upserted into ``Song``
+so later requests can be answered without Spotify. Ingestion runs on a
+background thread per worker process, so it never adds to page latency.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from recommendations.tracks import Track
+
+from .fragments import playlist_changed
+from .models import PlaylistSong, Song
+from .ordering import append_orders, lock_playlist
+
+logger = logging.getLogger(__name__)
+
+# Song columns refreshed when a track is seen again
+UPDATE_FIELDS = ['name', 'artist', 'album', 'duration_ms', 'spotify_url', 'image_url']
+
+
+def song_from_track(track, genre=''):
+    """Unsaved Song for a ``Track``"""
+    return Song(
+        spotify_id=track.id,
+        name=(track.name or '')[:255],
+        artist=track.artist[:255],
+        album=(track.album or '')[:255],
+        genre=genre[:100],
+        duration_ms=track.duration_ms or 0,
+        spotify_url=(track.spotify_url or '')[:200],
+        image_url=(track.image_url or '')[:200],
+    )
+
+
+def song_from_fields(fields):
+    """Unsaved Song from a dict of track fields (bulk add, imports), or None without spotify_id, name and artist"""
+    if not isinstance(fields, dict) or not all(str(fields.get(key) or '').strip() for key in ('spotify_id', 'name', 'artist')):
+        return None
+    duration_ms = str(fields.get('duration_ms') or '')
+    return Song(
+        spotify_id=str(fields['spotify_id'])[:255],
+        name=str(fields['name'])[:255],
+        artist=str(fields['artist'])[:255],
+        album=str(fields.get('album') or '')[:255],
+        duration_ms=int(duration_ms) if duration_ms.isdigit() else 0,
+        image_url=str(fields.get('image_url') or '')[:200],
+        spotify_url=str(fields.get('spotify_url') or '')[:200],
+    )
+
+
+def track_from_song(song):
+    """``Track`` for a stored Song.
+
+    ``Song.artist`` holds the names already joined, and a name can itself
+    contain ', ' ("Tyler, The Creator"), so it stays one artist.
+    """
+    return Track(
+        id=song.spotify_id,
+        name=song.name,
+        artists=[song.artist] if song.artist else [],
+        album=song.album,
+        image_url=song.image_url,
+        duration_ms=song.duration_ms,
+        spotify_url=song.spotify_url,
+    )
+
+
+def upsert_songs(songs, batch_size=500):
+    """Insert or update ``songs`` (unsaved Song objects) keyed on spotify_id.
+
+    Duplicates within the call are collapsed, last one wins. A genre is only
+    filled in where the stored song has none. Returns the number of distinct
+    songs written.
+    """
+    by_id = {}
+    for song in songs:
+        if song.spotify_id:
+            by_id[song.spotify_id] = song
+    if not by_id:
+        return 0
+
+    Song.objects.bulk_create(
+        by_id.values(),
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['spotify_id'],
+        update_fields=UPDATE_FIELDS,
+    )
+
+    by_genre = {}
+    for song in by_id.values():
+        if song.genre:
+            by_genre.setdefault(song.genre, []).append(song.spotify_id)
+    for genre, ids in by_genre.items():
+        for start in range(0, len(ids), batch_size):
+            Song.objects.filter(spotify_id__in=ids[start:start + batch_size], genre='').update(genre=genre)
+    return len(by_id)
+
+
+def append_songs(playlist, songs, added_by=None, batch_size=500):
+    """Append ``songs`` (unsaved Song objects) to ``playlist`` in one transaction.
+
+    Songs not yet in the catalog are inserted with one ``bulk_create``.
+    Stored songs keep their data. Songs already in the playlist, and
+    repeats within ``songs``, are skipped. The new rows get consecutive
+    order keys after the playlist's last one. Returns (added, skipped).
+    bulk_create sends no signals, so the cached fragments are invalidated
+    and the owner is marked for the next precompute run here.
+    """
+    from recommendations.precompute import mark_inputs_changed  # avoids an import cycle
+
+    by_id = {}
+    for song in songs:
+        if song.spotify_id:
+            by_id.setdefault(song.spotify_id, song)
+
+    with transaction.atomic():
+        Song.objects.bulk_create(by_id.values(), batch_size=batch_size, ignore_conflicts=True)
+        stored = {
+            spotify_id: (song_id, duration_ms)
+            for song_id, spotify_id, duration_ms in Song.objects.filter(spotify_id__in=list(by_id))
+            .values_list('id', 'spotify_id', 'duration_ms')
+        }
+        # Lock the playlist so concurrent appends get distinct order values
+        lock_playlist(playlist.id)
+        present = set(
+            PlaylistSong.objects.filter(playlist=playlist, song_id__in=[song_id for song_id, _ in stored.values()])
+            .values_list('song_id', flat=True)
+        )
+        new = [stored[spotify_id] for spotify_id in by_id if stored[spotify_id][0] not in present]
+        orders = append_orders(playlist.id, len(new))
+        PlaylistSong.objects.bulk_create(
+            [
+                PlaylistSong(playlist=playlist, song_id=song_id, added_by=added_by, order=order)
+                for (song_id, _), order in zip(new, orders)
+            ],
+            batch_size=batch_size,
+        )
+        if new:
+            playlist.adjust_counters(songs=len(new), duration_ms=sum(duration_ms for _, duration_ms in new))
+            # bulk_create sends no signals
+            playlist_changed(playlist.id)
+            mark_inputs_changed([playlist.owner_id])
+    return len(new), len(songs) - len(new)
+
+
+class CatalogIngestor:
+    """Queue of tracks drained into ``Song`` by a daemon thread.
+
+    Tracks are written once ``batch_size`` are waiting or ``flush_interval``
+    seconds after the first one arrived, whichever comes first.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=2.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'written': 0, 'batches': 0, 'errors': 0}
+
+    def enqueue(self, tracks, genre=''):
+        songs = [song_from_track(t, genre) for t in tracks if t and t.id]
+        if not songs:
+            return
+        self.stats['queued'] += len(songs)
+        if not getattr(settings, 'SONG_CATALOG_ASYNC', True):
+            self._write(songs)
+            return
+        for song in songs:
+            self._queue.put(song)
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='song-catalog', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                pass
+            close_old_connections()
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until everything queued so far is written"""
+        self._queue.join()
+
+    def _write(self, songs):
+        try:
+            self.stats['written'] += upsert_songs(songs, self.batch_size)
+            self.stats['batches'] += 1
+        except Exception:
+            self.stats['errors'] += 1
+            logger.exception("Song catalog upsert failed")
+
+    def metrics(self):
+        return dict(self.stats, pending=self._queue.qsize())
+
+
+ingestor = CatalogIngestor()
+
+
+def ingest_tracks(tracks, genre=''):
+    """Add Spotify tracks to the local catalog without blocking the caller"""
+    ingestor.enqueue(tracks, genre)
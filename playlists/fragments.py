@@ -0,0 +1,95 @@
+"""Template fragments cached per object version.
+
+A cached fragment's key includes the current version of the object it
+shows (a playlist, a community, a user). Saving or deleting anything the
+fragment renders replaces that version (see the ``signals`` modules), so
+the old entries are never read again and expire on their own. Nothing is
+ever deleted or flushed.
+
+Versions are nanosecond timestamps rather than counters, so a version lost
+from the cache, or an id reused after a database reset, can never match an
+old fragment.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Playlist
+
+
+def version_key(kind, pk):
+    return f"fragment-version:{kind}:{pk}"
+
+
+class FragmentCache:
+    """Versioned fragment lookups with per-fragment hit counters for this worker"""
+
+    def __init__(self):
+        self.stats = {}  # fragment name -> {'hits': n, 'misses': n}
+        self.bumps = 0
+
+    def version(self, kind, pk):
+        key = version_key(kind, pk)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, time.time_ns(), timeout=None)
+            version = cache.get(key)
+        return version
+
+    def bump(self, kind, pk):
+        """Give ``kind``/``pk`` a new version, now and again when the transaction commits.
+
+        The second write covers a reader that cached the old rows between the
+        first write and the commit.
+        """
+        def write():
+            cache.set(version_key(kind, pk), time.time_ns(), timeout=None)
+
+        write()
+        self.bumps += 1
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(write)
+
+    def get_or_render(self, name, kind, pk, vary_on, render):
+        """The cached HTML for fragment ``name`` of ``kind``/``pk``, calling ``render()`` on a miss"""
+        timeout = settings.FRAGMENT_CACHE_TIMEOUT
+        if not timeout or pk is None:
+            return render()
+        key = make_template_fragment_key(name, [kind, pk, self.version(kind, pk), *vary_on])
+        stats = self.stats.setdefault(name, {'hits': 0, 'misses': 0})
+        html = cache.get(key)
+        if html is not None:
+            stats['hits'] += 1
+            return html
+        stats['misses'] += 1
+        html = render()
+        cache.set(key, html, timeout)
+        return html
+
+    def metrics(self):
+        fragments = {}
+        for name, stats in self.stats.items():
+            lookups = stats['hits'] + stats['misses']
+            fragments[name] = dict(stats, hit_rate=round(stats['hits'] / lookups, 3) if lookups else None)
+        return {'fragments': fragments, 'bumps': self.bumps}
+
+
+fragment_cache = FragmentCache()
+
+
+def playlist_changed(playlist_id):
+    """Mark a playlist's songs as changed.
+
+    Bumps ``updated_at``, which the playlist and community pages validate
+    conditional GETs against, and the fragment versions of the playlist and
+    the community page listing it.
+    """
+    Playlist.objects.filter(id=playlist_id).update(updated_at=timezone.now())
+    community_id = Playlist.objects.filter(id=playlist_id).values_list('community_id', flat=True).first()
+    fragment_cache.bump('playlist', playlist_id)
+    if community_id is not None:
+        fragment_cache.bump('community', community_id)
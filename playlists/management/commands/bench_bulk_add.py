@@ -0,0 +1,83 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from playlists.models import Playlist
+from playlists.views import add_song_to_playlist, add_songs_to_playlist
+from recommendations.stub import fake_track
+from recommendations.tracks import Track
+
+
+class Rollback(Exception):
+    pass
+
+
+def track_fields(track):
+    return {
+        'spotify_id': track.id, 'name': track.name, 'artist': track.artist, 'album': track.album,
+        'duration_ms': track.duration_ms, 'image_url': track.image_url, 'spotify_url': track.spotify_url,
+    }
+
+
+class Command(BaseCommand):
+    help = "Time adding N tracks to a playlist one POST at a time against one bulk add-songs request"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tracks', type=int, default=1000, help='Tracks to add')
+
+    def handle(self, *args, **options):
+        count = options['tracks']
+        tracks = [track_fields(Track.from_spotify(fake_track(f"bulk{i:07d}"))) for i in range(count)]
+        factory = RequestFactory()
+
+        # Everything written here is rolled back at the end
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(f"bench-bulk-{time.monotonic_ns()}")
+
+                single = Playlist.objects.create(owner=user, name="One at a time")
+                self.run('single', count, lambda: [
+                    self.call(factory, add_song_to_playlist, user, single.id, data=track) for track in tracks
+                ])
+
+                # New songs, then the same songs again into a fresh playlist (all already in the catalog)
+                fresh = [dict(track, spotify_id=f"x{track['spotify_id']}") for track in tracks]
+                for label, batch in (('bulk', fresh), ('bulk-known', tracks)):
+                    playlist = Playlist.objects.create(owner=user, name=label)
+                    body = json.dumps({'tracks': batch})
+                    self.run(label, count, lambda: self.call(
+                        factory, add_songs_to_playlist, user, playlist.id,
+                        data=body, content_type='application/json',
+                    ))
+                    playlist.refresh_from_db()
+                    assert playlist.song_count == count, playlist.song_count
+                raise Rollback
+        except Rollback:
+            pass
+
+    def call(self, factory, view, user, playlist_id, **kwargs):
+        request = factory.post('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest', **kwargs)
+        request.user = user
+        response = view(request, playlist_id)
+        assert response.status_code == 200, response.content
+        return response
+
+    def run(self, label, count, action):
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            action()
+            elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label:>10}: {count} tracks in {elapsed * 1000:8.1f} ms "
+            f"({count / elapsed:9,.0f} tracks/s, {len(queries)} queries)"
+        )
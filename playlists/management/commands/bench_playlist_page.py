@@ -0,0 +1,73 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+
+from playlists.models import Playlist, PlaylistSong, Song
+from playlists.ordering import GAP
+from playlists.views import playlist_detail_view
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time the first page of the playlist page for playlists of growing length, with and without cached fragments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, action='append', dest='song_counts',
+                            help='Playlist length to test (repeatable); defaults to 100, 1000 and 10000')
+        parser.add_argument('--runs', type=int, default=20, help='Renders per playlist length')
+
+    def handle(self, *args, **options):
+        counts = options['song_counts'] or [100, 1000, 10000]
+
+        # Songs and playlists only exist for the run
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(f"bench-page-{time.monotonic_ns()}")
+                songs = Song.objects.bulk_create([
+                    Song(spotify_id=f"page{i:07d}", name=f"Song {i}", artist="Artist", album="Album")
+                    for i in range(max(counts))
+                ], batch_size=1000)
+                for count in counts:
+                    self.bench(user, songs[:count], options['runs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def bench(self, user, songs, runs):
+        playlist = Playlist.objects.create(owner=user, name=f"{len(songs)} songs", song_count=len(songs))
+        PlaylistSong.objects.bulk_create([
+            PlaylistSong(playlist=playlist, song=song, added_by=user, order=(i + 1) * GAP)
+            for i, song in enumerate(songs)
+        ], batch_size=1000)
+        request = RequestFactory().get('/')
+        request.user = user
+
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        # Uncached, then cached: the first cached render fills the fragment, the rest reuse it
+        for label, timeout in (('uncached', 0), ('cached', 600)):
+            samples, size = [], 0
+            with override_settings(FRAGMENT_CACHE_TIMEOUT=timeout):
+                playlist_detail_view(request, playlist.id)
+                for _ in range(runs):
+                    queries.clear()
+                    with connection.execute_wrapper(count_queries):
+                        start = time.perf_counter()
+                        response = playlist_detail_view(request, playlist.id)
+                        samples.append((time.perf_counter() - start) * 1000)
+                    size = len(response.content)
+            self.stdout.write(
+                f"{len(songs):>6} songs, {label:>8}: median {statistics.median(samples):7.2f} ms "
+                f"max {max(samples):7.2f} ms  {size / 1024:8.1f} KiB  {len(queries)} queries"
+            )
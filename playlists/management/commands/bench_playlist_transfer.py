@@ -0,0 +1,87 @@
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from playlists import transfer
+from playlists.models import Playlist, PlaylistSong, Song
+from playlists.ordering import GAP
+from playlists.views import export_playlist_view
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time an export and re-import of a long playlist in each format, with peak Python memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, action='append', dest='song_counts',
+                            help='Playlist length to test (repeatable); defaults to 10000 and 100000')
+        parser.add_argument('--format', action='append', dest='formats', choices=sorted(transfer.FORMATS),
+                            help='Format to test (repeatable); defaults to all')
+
+    def handle(self, *args, **options):
+        counts = options['song_counts'] or [10000, 100000]
+        formats = options['formats'] or sorted(transfer.FORMATS)
+
+        # Songs and playlists only exist for the run
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(f"bench-transfer-{time.monotonic_ns()}")
+                songs = Song.objects.bulk_create([
+                    Song(spotify_id=f"transfer{i:07d}", name=f"Song {i}", artist="Artist", album="Album",
+                         duration_ms=180000, spotify_url=f"https://open.spotify.com/track/transfer{i:07d}")
+                    for i in range(max(counts))
+                ], batch_size=2000)
+                for count in counts:
+                    playlist = Playlist.objects.create(owner=user, name=f"{count} songs", song_count=count)
+                    PlaylistSong.objects.bulk_create([
+                        PlaylistSong(playlist=playlist, song=song, added_by=user, order=(i + 1) * GAP)
+                        for i, song in enumerate(songs[:count])
+                    ], batch_size=2000)
+                    for fmt in formats:
+                        self.round_trip(user, playlist, fmt)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def round_trip(self, user, playlist, fmt):
+        request = RequestFactory().get('/')
+        request.user = user
+        with tempfile.TemporaryFile() as file:
+            def export():
+                for chunk in export_playlist_view(request, playlist.id, fmt).streaming_content:
+                    file.write(chunk)
+
+            export_ms, export_peak = self.measure(export)
+            size = file.tell()
+            file.seek(0)
+
+            copy = Playlist.objects.create(owner=user, name=f"{playlist.name} ({fmt})")
+            result = {}
+
+            def load():
+                result['added'], _ = transfer.import_playlist(copy, file, fmt, added_by=user)
+
+            import_ms, import_peak = self.measure(load)
+        assert result['added'] == playlist.song_count, result
+        self.stdout.write(
+            f"{playlist.song_count:>7} songs {fmt:>5}: {size / 2 ** 20:6.1f} MiB  "
+            f"export {export_ms:8.1f} ms peak {export_peak / 2 ** 20:5.1f} MiB  "
+            f"import {import_ms:8.1f} ms peak {import_peak / 2 ** 20:5.1f} MiB"
+        )
+
+    def measure(self, action):
+        tracemalloc.start()
+        start = time.perf_counter()
+        action()
+        elapsed = (time.perf_counter() - start) * 1000
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
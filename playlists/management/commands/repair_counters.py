@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from communities.models import Community, CommunityMessage
+from playlists.models import Playlist, PlaylistSong
+
+
+def playlist_counters():
+    rows = PlaylistSong.objects.filter(playlist=OuterRef('pk')).order_by().values('playlist')
+    return {
+        'song_count': Coalesce(Subquery(rows.annotate(n=Count('id')).values('n')), 0),
+        'total_duration_ms': Coalesce(Subquery(rows.annotate(n=Sum('song__duration_ms')).values('n')), 0),
+    }
+
+
+def community_counters():
+    members = Community.members.through.objects.filter(community=OuterRef('pk')).order_by().values('community')
+    messages = CommunityMessage.objects.filter(community=OuterRef('pk')).order_by().values('community')
+    return {
+        'member_count': Coalesce(Subquery(members.annotate(n=Count('id')).values('n')), 0),
+        'message_count': Coalesce(Subquery(messages.annotate(n=Count('id')).values('n')), 0),
+    }
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored song, duration, member and message counters from the underlying rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report rows whose counters are off')
+
+    def handle(self, *args, **options):
+        for label, model, counters in (
+            ('playlists', Playlist, playlist_counters()),
+            ('communities', Community, community_counters()),
+        ):
+            actual = {f'actual_{name}': expression for name, expression in counters.items()}
+            drifted = model.objects.annotate(**actual).filter(
+                Q(*[~Q(**{name: F(f'actual_{name}')}) for name in counters], _connector=Q.OR)
+            )
+            count = drifted.count()
+            if not options['dry_run'] and count:
+                # One UPDATE per table, touching only the rows that are off
+                with transaction.atomic():
+                    count = model.objects.filter(pk__in=drifted.values('pk')).update(**counters)
+            verb = 'off' if options['dry_run'] else 'repaired'
+            self.stdout.write(f"{label}: {count} {verb}")
@@ -0,0 +1,79 @@
+# Full-text search over the Song catalog: a generated tsvector column with a
+# GIN index on PostgreSQL, an external-content FTS5 table on SQLite.
+
+from django.db import migrations
+
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE playlists_song ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple'::regconfig, coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(artist, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(album, '')), 'B') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(genre, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX playlists_song_search_idx ON playlists_song USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS playlists_song_search_idx",
+    "ALTER TABLE playlists_song DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE playlists_song_fts USING fts5(
+        name, artist, album, genre,
+        content='playlists_song', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER playlists_song_fts_ai AFTER INSERT ON playlists_song BEGIN
+        INSERT INTO playlists_song_fts(rowid, name, artist, album, genre)
+        VALUES (new.id, new.name, new.artist, new.album, new.genre);
+    END
+    """,
+    """
+    CREATE TRIGGER playlists_song_fts_ad AFTER DELETE ON playlists_song BEGIN
+        INSERT INTO playlists_song_fts(playlists_song_fts, rowid, name, artist, album, genre)
+        VALUES ('delete', old.id, old.name, old.artist, old.album, old.genre);
+    END
+    """,
+    """
+    CREATE TRIGGER playlists_song_fts_au AFTER UPDATE ON playlists_song BEGIN
+        INSERT INTO playlists_song_fts(playlists_song_fts, rowid, name, artist, album, genre)
+        VALUES ('delete', old.id, old.name, old.artist, old.album, old.genre);
+        INSERT INTO playlists_song_fts(rowid, name, artist, album, genre)
+        VALUES (new.id, new.name, new.artist, new.album, new.genre);
+    END
+    """,
+    "INSERT INTO playlists_song_fts(playlists_song_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS playlists_song_fts_au",
+    "DROP TRIGGER IF EXISTS playlists_song_fts_ad",
+    "DROP TRIGGER IF EXISTS playlists_song_fts_ai",
+    "DROP TABLE IF EXISTS playlists_song_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
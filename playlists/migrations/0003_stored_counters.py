@@ -0,0 +1,36 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:57
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Playlist = apps.get_model('playlists', 'Playlist')
+    PlaylistSong = apps.get_model('playlists', 'PlaylistSong')
+    rows = PlaylistSong.objects.filter(playlist=OuterRef('pk')).order_by().values('playlist')
+    Playlist.objects.update(
+        song_count=Coalesce(Subquery(rows.annotate(n=Count('id')).values('n')), 0),
+        total_duration_ms=Coalesce(Subquery(rows.annotate(n=Sum('song__duration_ms')).values('n')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0002_song_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='song_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='total_duration_ms',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+GAP = 1024
+
+
+def respace_orders(apps, schema_editor):
+    """Renumber every playlist GAP apart, keeping the order songs are shown in"""
+    PlaylistSong = apps.get_model('playlists', 'PlaylistSong')
+    rows = PlaylistSong.objects.order_by('playlist_id', 'order', 'added_at', 'id').only('id', 'playlist_id', 'order')
+    batch, playlist_id, position = [], None, 0
+    for row in rows.iterator(chunk_size=2000):
+        if row.playlist_id != playlist_id:
+            playlist_id, position = row.playlist_id, 0
+        position += 1
+        row.order = position * GAP
+        batch.append(row)
+        if len(batch) >= 2000:
+            PlaylistSong.objects.bulk_update(batch, ['order'], batch_size=500)
+            batch = []
+    PlaylistSong.objects.bulk_update(batch, ['order'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0003_stored_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='playlistsong',
+            name='order',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='playlistsong',
+            index=models.Index(fields=['playlist', 'order'], name='playlistsong_order_idx'),
+        ),
+        migrations.RunPython(respace_orders, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 from communities.models import Community
 
@@ -40,12 +41,23 @@ class Playlist(models.Model):
     collaborators = models.ManyToManyField(User, related_name='collaborated_playlists', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Stored counters, changed alongside PlaylistSong rows (repair_counters recomputes them)
+    song_count = models.IntegerField(default=0)
+    total_duration_ms = models.BigIntegerField(default=0)
     
     def __str__(self):
         return self.name
     
-    def song_count(self):
-        return self.songs.count()
+    @property
+    def total_minutes(self):
+        return self.total_duration_ms // 60000
+    
+    def adjust_counters(self, songs=0, duration_ms=0):
+        """Add to the stored counters in the database, safe against concurrent writers"""
+        Playlist.objects.filter(id=self.id).update(
+            song_count=F('song_count') + songs,
+            total_duration_ms=F('total_duration_ms') + duration_ms,
+        )
 
 
 class PlaylistSong(models.Model):
@@ -54,11 +66,14 @@ class PlaylistSong(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
     added_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     added_at = models.DateTimeField(auto_now_add=True)
-    order = models.IntegerField(default=0)
+    order = models.BigIntegerField(default=0)  # Sparse key; see playlists/ordering.py
     
     class Meta:
         ordering = ['order', 'added_at']
         unique_together = ['playlist', 'song']
+        indexes = [
+            models.Index(fields=['playlist', 'order'], name='playlistsong_order_idx'),
+        ]
     
     def __str__(self):
         return f"{self.song.name} in {self.playlist.name}"
@@ -0,0 +1,181 @@
+"""Sparse ordering keys for PlaylistSong.
+
+Keys are spaced ``GAP`` apart. Appending, moving or inserting a song
+between two others writes only that song's row: it takes the midpoint of
+its new neighbours' keys. When two neighbours end up adjacent, with no
+integer left between them, ``rebalance`` renumbers the playlist ``GAP``
+apart again. That is the only operation that touches every row.
+
+Callers run inside a transaction and call ``lock_playlist`` first, so
+concurrent writers to one playlist never pick the same key.
+"""
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+from .models import Playlist, PlaylistSong
+
+GAP = 1024
+
+
+def lock_playlist(playlist_id):
+    """Hold the playlist row lock until the surrounding transaction ends"""
+    Playlist.objects.select_for_update().filter(id=playlist_id).exists()
+
+
+def append_orders(playlist_id, count=1):
+    """Keys for ``count`` rows added after the playlist's current last one"""
+    last = PlaylistSong.objects.filter(playlist_id=playlist_id).aggregate(last=Max('order'))['last']
+    start = GAP if last is None else last + GAP
+    return [start + i * GAP for i in range(count)]
+
+
+def order_after(playlist_id, after_song_id=None, exclude_id=None):
+    """Key for a row placed right after ``after_song_id`` (None: first).
+
+    ``exclude_id`` is the PlaylistSong being moved, which is not its own
+    neighbour. Returns None when there is no room between the neighbours.
+    Raises PlaylistSong.DoesNotExist if ``after_song_id`` is not in the playlist.
+    """
+    rows = PlaylistSong.objects.filter(playlist_id=playlist_id)
+    if exclude_id is not None:
+        rows = rows.exclude(id=exclude_id)
+    keys = rows.order_by('order').values_list('order', flat=True)
+    if after_song_id is None:
+        following = keys.first()
+        return GAP if following is None else following - GAP
+
+    before = rows.filter(song_id=after_song_id).values_list('order', flat=True).get()
+    following = keys.filter(order__gt=before).first()
+    if following is None:
+        return before + GAP
+    if following - before < 2:
+        return None
+    return (before + following) // 2
+
+
+def rebalance(playlist_id):
+    """Renumber the playlist's keys ``GAP`` apart, keeping the current order"""
+    rows = list(
+        PlaylistSong.objects.filter(playlist_id=playlist_id)
+        .order_by('order', 'added_at', 'id').only('id', 'order')
+    )
+    for position, row in enumerate(rows, start=1):
+        row.order = position * GAP
+    PlaylistSong.objects.bulk_update(rows, ['order'], batch_size=500)
+    return len(rows)
+
+
+def place_after(playlist_id, after_song_id=None, exclude_id=None):
+    """(key, rebalanced) for a row right after ``after_song_id`` (None: first).
+
+    If there is no room between the neighbours the playlist is rebalanced
+    first, and ``rebalanced`` is True.
+    """
+    key = order_after(playlist_id, after_song_id, exclude_id)
+    if key is not None:
+        return key, False
+    rebalance(playlist_id)
+    return order_after(playlist_id, after_song_id, exclude_id), True
+
+
+def move(playlist_id, song_id, after_song_id=None):
+    """Place ``song_id`` right after ``after_song_id`` (None: first).
+
+    Writes one row unless the keys ran out. Returns True if the playlist
+    had to be rebalanced.
+    """
+    row = PlaylistSong.objects.only('id').get(playlist_id=playlist_id, song_id=song_id)
+    if after_song_id == song_id:
+        return False
+    key, rebalanced = place_after(playlist_id, after_song_id, exclude_id=row.id)
+    PlaylistSong.objects.filter(id=row.id).update(order=key)
+    return rebalanced
+
+
+# Columns the playlist page renders for each row
+SONG_ROW_FIELDS = (
+    'id', 'order', 'song', 'added_by',
+    'song__name', 'song__artist', 'song__album', 'song__image_url', 'song__spotify_url',
+    'added_by__username',
+)
+
+
+def parse_cursor(value):
+    """(order, id) from a cursor string, or None for the first page"""
+    try:
+        order, row_id = value.split('_')
+        return int(order), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_cursor(after):
+    """Cursor string for (order, id), or '' for the first page"""
+    return '' if after is None else f"{after[0]}_{after[1]}"
+
+
+def song_page(playlist_id, after=None, size=100):
+    """One page of the playlist's rows in order, and the cursor for the next page.
+
+    Pages are keyed on (order, id) instead of an offset, so each page is a
+    range read off the (playlist, order) index and costs the same however far
+    into the playlist it starts. The cursor is None on the last page.
+    """
+    rows = (
+        PlaylistSong.objects.filter(playlist_id=playlist_id)
+        .select_related('song', 'added_by').only(*SONG_ROW_FIELDS)
+        .order_by('order', 'id')
+    )
+    if after is not None:
+        order, row_id = after
+        rows = rows.filter(Q(order__gt=order) | Q(order=order, id__gt=row_id))
+    rows = list(rows[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, format_cursor((rows[-1].order, rows[-1].id))
+
+
+def prev_song_id(playlist_id, after):
+    """Song id of the row at or before the ``after`` cursor, or None on the first page"""
+    if after is None:
+        return None
+    order, row_id = after
+    return (
+        PlaylistSong.objects.filter(playlist_id=playlist_id)
+        .filter(Q(order__lt=order) | Q(order=order, id__lte=row_id))
+        .order_by('-order', '-id').values_list('song_id', flat=True).first()
+    )
+
+
+class SongPage:
+    """``song_page`` read on first use, so a cached fragment skips the query.
+
+    ``start`` is the position of the first row, for numbering.
+    """
+
+    def __init__(self, playlist_id, after=None, size=100, start=0):
+        self.playlist_id = playlist_id
+        self.after = after
+        self.size = size
+        self.start = start
+
+    @cached_property
+    def _page(self):
+        return song_page(self.playlist_id, self.after, self.size)
+
+    @property
+    def rows(self):
+        return self._page[0]
+
+    @property
+    def next_cursor(self):
+        return self._page[1]
+
+    @property
+    def next_start(self):
+        return self.start + len(self.rows)
+
+    @cached_property
+    def prev_song_id(self):
+        return prev_song_id(self.playlist_id, self.after)
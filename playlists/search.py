@@ -0,0 +1,76 @@
+"""Full-text search over the local Song catalog.
+
+Uses the ``search_vector`` column on PostgreSQL and the ``playlists_song_fts``
+FTS5 table on SQLite, both created by migration 0002. Other databases fall
+back to unranked ``icontains`` matching.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Song
+
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _fts5_query(query):
+    """Quote every word for FTS5 and let the last one match as a prefix"""
+    words = _WORD_RE.findall(query)
+    if not words:
+        return ''
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _postgres_ids(query, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT id FROM playlists_song, websearch_to_tsquery('simple', %s) query
+            WHERE search_vector @@ query
+            ORDER BY ts_rank_cd(search_vector, query) DESC, id
+            LIMIT %s
+            """,
+            [query, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_ids(query, limit):
+    match = _fts5_query(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        # Column weights: name, artist, album, genre
+        cursor.execute(
+            """
+            SELECT rowid FROM playlists_song_fts
+            WHERE playlists_song_fts MATCH %s
+            ORDER BY bm25(playlists_song_fts, 10.0, 10.0, 4.0, 1.0)
+            LIMIT %s
+            """,
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_songs(query, limit=20):
+    """Best matching songs for a free-text query, most relevant first"""
+    query = ' '.join(query.split())
+    if not query:
+        return []
+
+    if connection.vendor == 'postgresql':
+        ids = _postgres_ids(query, limit)
+    elif connection.vendor == 'sqlite':
+        ids = _sqlite_ids(query, limit)
+    else:
+        return list(Song.objects.filter(
+            Q(name__icontains=query) | Q(artist__icontains=query) | Q(album__icontains=query)
+        )[:limit])
+
+    songs = Song.objects.in_bulk(ids)
+    return [songs[i] for i in ids if i in songs]
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .fragments import fragment_cache, playlist_changed
+from .models import Playlist, PlaylistSong
+
+
+@receiver(pre_save, sender=Playlist)
+def playlist_moving(sender, instance, update_fields=None, **kwargs):
+    """A playlist leaving a community drops off that community's page"""
+    if instance.pk is None or (update_fields is not None and 'community' not in update_fields):
+        return
+    old = Playlist.objects.filter(pk=instance.pk).values_list('community_id', flat=True).first()
+    if old is not None and old != instance.community_id:
+        fragment_cache.bump('community', old)
+
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def playlist_saved(sender, instance, **kwargs):
+    fragment_cache.bump('playlist', instance.pk)
+    if instance.community_id is not None:
+        fragment_cache.bump('community', instance.community_id)
+
+
+@receiver(post_save, sender=PlaylistSong)
+@receiver(post_delete, sender=PlaylistSong)
+def playlist_song_saved(sender, instance, origin=None, **kwargs):
+    # Rows deleted along with their playlist are covered by the playlist's own signal
+    if isinstance(origin, Playlist):
+        return
+    playlist_changed(instance.playlist_id)
@@ -0,0 +1,47 @@
+from django import template
+
+from playlists.fragments import fragment_cache
+
+register = template.Library()
+
+
+class VersionedCacheNode(template.Node):
+    def __init__(self, nodelist, name, kind, pk, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.kind = kind
+        self.pk = pk
+        self.vary_on = vary_on
+
+    def render(self, context):
+        return fragment_cache.get_or_render(
+            self.name.resolve(context),
+            self.kind.resolve(context),
+            self.pk.resolve(context),
+            [var.resolve(context) for var in self.vary_on],
+            lambda: self.nodelist.render(context),
+        )
+
+
+@register.tag('versioned_cache')
+def do_versioned_cache(parser, token):
+    """Cache the enclosed fragment until the object it shows changes.
+
+    Usage::
+
+        {% load fragment_cache %}
+        {% versioned_cache "playlist_songs" "playlist" playlist.id can_edit %}
+            ...
+        {% endversioned_cache %}
+
+    The fragment name, then the kind and id of the object whose version keys
+    the fragment (see playlists/fragments.py), then any values the fragment
+    also varies on.
+    """
+    nodelist = parser.parse(('endversioned_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 4:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name, an object kind and an object id")
+    name, kind, pk, *vary_on = [parser.compile_filter(bit) for bit in bits[1:]]
+    return VersionedCacheNode(nodelist, name, kind, pk, vary_on)
@@ -0,0 +1,589 @@
+import json
+import re
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import Badge, UserBadge, UserProfile
+from communities.models import Community
+from .catalog import append_songs
+from .fragments import fragment_cache, playlist_changed
+from .models import Playlist, PlaylistSong, Song
+from .ordering import GAP, move
+from .views import playlist_detail_view
+
+
+# The admin pages need static files; skip the production manifest in tests
+PLAIN_STATIC_FILES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Fragment tests get a cache of their own, so nothing carries over between runs
+FRAGMENT_TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragment-tests'},
+}
+
+
+# Query counts below are for pages rendered without cached fragments
+@override_settings(STORAGES=PLAIN_STATIC_FILES, FRAGMENT_CACHE_TIMEOUT=0)
+class PlaylistCountQueryTests(TestCase):
+    """Pages listing playlists run the same number of queries for any number of rows"""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('owner', password='pw')
+        self.client.force_login(self.user)
+
+    def add_playlists(self, count):
+        for i in range(count):
+            n = Playlist.objects.count()
+            community = Community.objects.create(name=f"Community {n}", description="d", created_by=self.user)
+            community.members.add(self.user)
+            playlist = Playlist.objects.create(owner=self.user, name=f"Playlist {n}", community=community)
+            for j in range(3):
+                song = Song.objects.create(spotify_id=f"song-{n}-{j}", name="Song", artist="Artist")
+                PlaylistSong.objects.create(playlist=playlist, song=song, order=j)
+        call_command('repair_counters', stdout=StringIO())
+
+    def assertConstantQueries(self, url, num):
+        for count in (1, 5):
+            self.add_playlists(count)
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "3 songs")
+
+    def test_home(self):
+        self.assertConstantQueries(reverse('home'), 5)
+
+    def test_my_playlists(self):
+        self.assertConstantQueries(reverse('my_playlists'), 3)
+
+    def test_profile(self):
+        self.assertConstantQueries(reverse('profile'), 5)
+
+    def test_admin_changelist(self):
+        for count in (1, 5):
+            self.add_playlists(count)
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('admin:playlists_playlist_changelist'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_sorted_by_counters(self):
+        self.add_playlists(2)
+        small = Playlist.objects.create(owner=self.user, name="Small")
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('my_playlists'), {'sort': 'size'})
+        self.assertEqual(list(response.context['playlists'])[-1], small)
+
+
+class PlaylistCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Mix")
+
+    def add(self, spotify_id, duration_ms):
+        return self.client.post(reverse('add_song_to_playlist', args=[self.playlist.id]), {
+            'spotify_id': spotify_id, 'name': spotify_id, 'artist': "Artist", 'duration_ms': duration_ms,
+        })
+
+    def test_add_and_remove_keep_counters(self):
+        self.add('a', 1000)
+        self.add('b', 2500)
+        self.add('a', 1000)  # Already there; not counted twice
+        self.playlist.refresh_from_db()
+        self.assertEqual((self.playlist.song_count, self.playlist.total_duration_ms), (2, 3500))
+
+        song = Song.objects.get(spotify_id='a')
+        self.client.post(reverse('remove_song_from_playlist', args=[self.playlist.id, song.id]))
+        self.client.post(reverse('remove_song_from_playlist', args=[self.playlist.id, song.id]))
+        self.playlist.refresh_from_db()
+        self.assertEqual((self.playlist.song_count, self.playlist.total_duration_ms), (1, 2500))
+
+    def add_ajax(self, spotify_id):
+        response = self.client.post(reverse('add_song_to_playlist', args=[self.playlist.id]), {
+            'spotify_id': spotify_id, 'name': spotify_id, 'artist': "Artist", 'duration_ms': 1000,
+        }, headers={'x-requested-with': 'XMLHttpRequest'})
+        return response.json()['status']
+
+    def test_add_racing_another_add_of_the_same_song(self):
+        song = Song.objects.create(spotify_id='a', name='a', artist="Artist", duration_ms=1000)
+
+        def other_request_adds_it(playlist_id):
+            # The other request commits while this one waits for the lock
+            PlaylistSong.objects.create(playlist=self.playlist, song=song, added_by=self.user, order=GAP)
+            self.playlist.adjust_counters(songs=1, duration_ms=1000)
+
+        with mock.patch('playlists.views.lock_playlist', side_effect=other_request_adds_it):
+            self.assertEqual(self.add_ajax('a'), 'exists')
+        self.playlist.refresh_from_db()
+        self.assertEqual((self.playlist.song_count, self.playlist.total_duration_ms), (1, 1000))
+
+    def test_add_losing_the_insert_race_reports_exists(self):
+        # Without row locks (SQLite) the unique constraint is the last line
+        with mock.patch.object(PlaylistSong.objects, 'create', side_effect=IntegrityError):
+            self.assertEqual(self.add_ajax('a'), 'exists')
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.song_count, 0)
+
+    def test_repair_counters(self):
+        self.add('a', 1000)
+        Playlist.objects.update(song_count=7, total_duration_ms=0)
+        out = StringIO()
+        call_command('repair_counters', stdout=out)
+        self.assertIn("playlists: 1 repaired", out.getvalue())
+        self.playlist.refresh_from_db()
+        self.assertEqual((self.playlist.song_count, self.playlist.total_duration_ms), (1, 1000))
+
+
+class BulkAddTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Mix")
+
+    def post(self, tracks, playlist=None):
+        return self.client.post(
+            reverse('add_songs_to_playlist', args=[(playlist or self.playlist).id]),
+            json.dumps({'tracks': tracks}), content_type='application/json',
+        )
+
+    def tracks(self, *ids):
+        return [{'spotify_id': i, 'name': f"Song {i}", 'artist': "Artist", 'duration_ms': 1000} for i in ids]
+
+    def test_appends_in_one_batch(self):
+        self.post(self.tracks('a'))
+        Song.objects.create(spotify_id='b', name="Stored name", artist="Stored artist", duration_ms=2000)
+
+        with self.assertNumQueries(16):
+            response = self.post(self.tracks('a', 'b', 'c', 'c', 'd'))
+        self.assertEqual(response.json()['added'], 3)
+        self.assertEqual(response.json()['skipped'], 2)
+
+        rows = list(PlaylistSong.objects.filter(playlist=self.playlist).values_list('song__spotify_id', 'order'))
+        self.assertEqual(rows, [('a', GAP), ('b', 2 * GAP), ('c', 3 * GAP), ('d', 4 * GAP)])
+        self.assertEqual(Song.objects.get(spotify_id='b').name, "Stored name")
+        self.playlist.refresh_from_db()
+        self.assertEqual((self.playlist.song_count, self.playlist.total_duration_ms), (4, 5000))
+
+    def test_marks_the_owner_for_precompute(self):
+        self.post(self.tracks('a'))
+        self.assertIsNotNone(UserProfile.objects.get(user=self.user).inputs_changed_at)
+
+    def test_rejects_bad_requests(self):
+        other = Playlist.objects.create(owner=User.objects.create_user('other'), name="Theirs")
+        self.assertEqual(self.post(self.tracks('a'), playlist=other).status_code, 403)
+        self.assertEqual(self.post([{'spotify_id': 'a'}]).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        with self.settings(PLAYLIST_BULK_ADD_MAX=2):
+            self.assertEqual(self.post(self.tracks('a', 'b', 'c')).status_code, 400)
+        self.assertFalse(PlaylistSong.objects.exists())
+
+
+class OrderingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Mix")
+        self.songs = {}
+        for spotify_id in 'abcd':
+            self.client.post(reverse('add_song_to_playlist', args=[self.playlist.id]), {
+                'spotify_id': spotify_id, 'name': spotify_id, 'artist': "Artist",
+            })
+            self.songs[spotify_id] = Song.objects.get(spotify_id=spotify_id).id
+
+    def order(self):
+        return ''.join(PlaylistSong.objects.filter(playlist=self.playlist).values_list('song__spotify_id', flat=True))
+
+    def keys(self):
+        return list(PlaylistSong.objects.filter(playlist=self.playlist).values_list('order', flat=True))
+
+    def reorder(self, moves, playlist=None):
+        return self.client.post(
+            reverse('reorder_playlist', args=[(playlist or self.playlist).id]),
+            json.dumps({'moves': moves}), content_type='application/json',
+        )
+
+    def test_appends_leave_gaps(self):
+        self.assertEqual(self.keys(), [GAP, 2 * GAP, 3 * GAP, 4 * GAP])
+
+    def test_move_writes_one_row(self):
+        with self.assertNumQueries(4):
+            rebalanced = move(self.playlist.id, self.songs['d'], self.songs['a'])
+        self.assertFalse(rebalanced)
+        self.assertEqual(self.order(), 'adbc')
+        self.assertEqual(self.keys(), [GAP, GAP + GAP // 2, 2 * GAP, 3 * GAP])
+
+        move(self.playlist.id, self.songs['c'])
+        self.assertEqual(self.order(), 'cadb')
+
+    def test_rebalances_only_when_keys_run_out(self):
+        # Halving the gap before "b" runs out of keys after log2(GAP) moves
+        moves = 0
+        while not move(self.playlist.id, self.songs['d' if moves % 2 else 'c'], self.songs['a']):
+            moves += 1
+        self.assertEqual(moves, 10)
+        self.assertEqual(self.order(), 'acdb')
+        self.assertEqual(self.keys(), [GAP, GAP + GAP // 2, 2 * GAP, 4 * GAP])
+
+    def test_insert_after(self):
+        self.client.post(reverse('add_song_to_playlist', args=[self.playlist.id]), {
+            'spotify_id': 'e', 'name': 'e', 'artist': "Artist", 'after': self.songs['b'],
+        })
+        self.assertEqual(self.order(), 'abecd')
+
+    def test_reorder_endpoint(self):
+        response = self.reorder([{'song': self.songs['a'], 'after': self.songs['d']}, {'song': self.songs['c'], 'after': None}])
+        self.assertEqual(response.json(), {'moved': 2, 'rebalanced': 0})
+        self.assertEqual(self.order(), 'cbda')
+
+    def test_reorder_rejects_bad_requests(self):
+        other = Playlist.objects.create(owner=User.objects.create_user('other'), name="Theirs")
+        self.assertEqual(self.reorder([], playlist=other).status_code, 403)
+        self.assertEqual(self.reorder([{'after': None}]).status_code, 400)
+        self.assertEqual(self.reorder([{'song': self.songs['a'], 'after': 0}]).status_code, 400)
+        # A failed move rolls back the ones before it
+        self.assertEqual(self.reorder([{'song': self.songs['d'], 'after': None}, {'song': 0}]).status_code, 400)
+        self.assertEqual(self.order(), 'abcd')
+
+
+@override_settings(PLAYLIST_PAGE_SIZE=10, FRAGMENT_CACHE_TIMEOUT=0)
+class PlaylistPageTests(TestCase):
+    """The playlist page reads one page of songs, and the rest load by cursor"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Mix")
+
+    def add_songs(self, count):
+        start = Song.objects.count()
+        songs = Song.objects.bulk_create([
+            Song(spotify_id=f"song-{n}", name=f"Song {n}", artist="Artist") for n in range(start, start + count)
+        ])
+        PlaylistSong.objects.bulk_create([
+            PlaylistSong(playlist=self.playlist, song=song, added_by=self.user, order=(start + i + 1) * GAP)
+            for i, song in enumerate(songs)
+        ])
+        call_command('repair_counters', stdout=StringIO())
+
+    def test_first_page_queries_do_not_grow(self):
+        for count in (15, 200):
+            self.add_songs(count)
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('playlist_detail', args=[self.playlist.id]))
+            self.assertEqual(len(response.context['page'].rows), 10)
+            self.assertContains(response, "Load more")
+        self.assertContains(response, "Songs (215)")
+
+    def test_pages_cover_every_song_once(self):
+        self.add_songs(25)
+        # A move leaves a song between two others; the cursor still follows the new order
+        move(self.playlist.id, Song.objects.get(spotify_id='song-24').id, Song.objects.get(spotify_id='song-0').id)
+        response = self.client.get(reverse('playlist_detail', args=[self.playlist.id]))
+        seen = [ps.song_id for ps in response.context['page'].rows]
+        cursor = response.context['page'].next_cursor
+        while cursor:
+            data = self.client.get(reverse('playlist_songs', args=[self.playlist.id]), {'after': cursor}).json()
+            seen += [int(song_id) for song_id in re.findall(r'data-song-id="(\d+)"', data['html'])]
+            cursor = data['next']
+        expected = list(PlaylistSong.objects.filter(playlist=self.playlist).values_list('song_id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(expected[1], Song.objects.get(spotify_id='song-24').id)
+
+    def test_page_at_a_cursor_knows_the_row_before_it(self):
+        self.add_songs(25)
+        first = self.client.get(reverse('playlist_detail', args=[self.playlist.id]))
+        self.assertContains(first, 'data-start="0" data-prev-song-id=""')
+        page = first.context['page']
+        response = self.client.get(
+            reverse('playlist_detail', args=[self.playlist.id]), {'after': page.next_cursor, 'start': page.next_start}
+        )
+        # "Up" on this page's first row moves it after the last row of the page before
+        self.assertContains(response, f'data-start="10" data-prev-song-id="{page.rows[-1].song_id}"')
+
+        # Still right after that row is removed
+        PlaylistSong.objects.filter(id=page.rows[-1].id).delete()
+        playlist_changed(self.playlist.id)
+        response = self.client.get(
+            reverse('playlist_detail', args=[self.playlist.id]), {'after': page.next_cursor, 'start': page.next_start}
+        )
+        self.assertContains(response, f'data-prev-song-id="{page.rows[-2].song_id}"')
+
+    def test_private_playlist_pages(self):
+        self.playlist.is_public = False
+        self.playlist.save()
+        self.add_songs(15)
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.get(reverse('playlist_songs', args=[self.playlist.id]))
+        self.assertEqual(response.status_code, 403)
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Road Trip")
+        songs = [
+            Song(spotify_id='a', name="First, with comma", artist="Artist A", album="Album", duration_ms=61000,
+                 spotify_url="https://open.spotify.com/track/a"),
+            Song(spotify_id='b', name='Second "quoted"', artist="Artist B", duration_ms=0),
+            Song(spotify_id='c', name="Ünïcode", artist="Artist C", duration_ms=1500),
+        ]
+        append_songs(self.playlist, songs, added_by=self.user)
+
+    def export(self, fmt, playlist=None):
+        return self.client.get(reverse('export_playlist', args=[(playlist or self.playlist).id, fmt]))
+
+    def import_file(self, name, content, playlist):
+        upload = SimpleUploadedFile(name, content.encode())
+        return self.client.post(reverse('import_playlist', args=[playlist.id]), {'file': upload}, follow=True)
+
+    def songs(self, playlist):
+        return list(PlaylistSong.objects.filter(playlist=playlist).values_list('song__spotify_id', flat=True))
+
+    def test_round_trip(self):
+        for fmt in ('jsonl', 'csv', 'm3u'):
+            response = self.export(fmt)
+            self.assertTrue(response.streaming)
+            self.assertIn(f'road-trip.{fmt}', response['Content-Disposition'])
+            content = b''.join(response.streaming_content).decode()
+
+            copy = Playlist.objects.create(owner=self.user, name=fmt)
+            response = self.import_file(f'backup.{fmt}', content, copy)
+            self.assertContains(response, "Imported 3 songs")
+            self.assertEqual(self.songs(copy), ['a', 'b', 'c'])
+            copy.refresh_from_db()
+            self.assertEqual((copy.song_count, copy.total_duration_ms), (3, 62500))
+
+            # Importing again only finds duplicates
+            response = self.import_file(f'backup.{fmt}', content, copy)
+            self.assertContains(response, "Imported 0 songs into &quot;%s&quot; (3 already there)." % fmt)
+
+    def test_m3u_links(self):
+        content = "#EXTM3U\n#EXTINF:200,Someone - New Song\nhttps://open.spotify.com/track/xyz?si=1\nspotify:track:pqr\n"
+        self.import_file('list.m3u8', content, self.playlist)
+        song = Song.objects.get(spotify_id='xyz')
+        self.assertEqual((song.name, song.artist, song.duration_ms), ("New Song", "Someone", 200000))
+        self.assertEqual(self.songs(self.playlist), ['a', 'b', 'c', 'xyz', 'pqr'])
+
+    def test_bad_file_imports_nothing(self):
+        content = '{"spotify_id": "d", "name": "D", "artist": "X"}\n{"spotify_id": "e"}\n'
+        response = self.import_file('bad.jsonl', content, self.playlist)
+        self.assertContains(response, "Nothing was imported. Line 2")
+        self.assertEqual(self.songs(self.playlist), ['a', 'b', 'c'])
+        self.assertFalse(Song.objects.filter(spotify_id='d').exists())
+
+        response = self.import_file('notes.txt', "hello", self.playlist)
+        self.assertContains(response, "Import a .jsonl, .csv or .m3u file.")
+
+    def test_permissions(self):
+        self.playlist.is_public = False
+        self.playlist.save()
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertRedirects(self.export('csv'), reverse('home'), fetch_redirect_response=False)
+        self.import_file('x.jsonl', '{"spotify_id": "d", "name": "D", "artist": "X"}\n', self.playlist)
+        self.assertEqual(self.songs(self.playlist), ['a', 'b', 'c'])
+
+
+@override_settings(CACHES=FRAGMENT_TEST_CACHES)
+class FragmentCacheTests(TestCase):
+    """Cached fragments are reused until something they show changes"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.create(owner=self.user, name="Mix")
+        append_songs(self.playlist, [Song(spotify_id=i, name=f"Song {i}", artist="Artist") for i in 'ab'])
+        self.url = reverse('playlist_detail', args=[self.playlist.id])
+
+    def add(self, spotify_id):
+        self.client.post(reverse('add_song_to_playlist', args=[self.playlist.id]), {
+            'spotify_id': spotify_id, 'name': f"Song {spotify_id}", 'artist': "Artist",
+        })
+
+    def test_hit_skips_song_query(self):
+        with self.assertNumQueries(5):
+            first = self.client.get(self.url)
+        hits = fragment_cache.stats['playlist_songs']['hits']
+        with self.assertNumQueries(4):
+            second = self.client.get(self.url)
+        # Same rows either way; only the per-request CSRF token outside the fragment differs
+        for response in (first, second):
+            self.assertContains(response, 'data-song-id=', count=2)
+        self.assertEqual(fragment_cache.stats['playlist_songs']['hits'], hits + 1)
+
+    def test_cursor_is_normalized_in_the_key(self):
+        self.client.get(self.url)
+        hits = fragment_cache.stats['playlist_songs']['hits']
+        # An unparseable cursor shows the first page, so it reuses its fragment
+        self.assertContains(self.client.get(self.url, {'after': 'junk'}), 'data-song-id=', count=2)
+        self.assertEqual(fragment_cache.stats['playlist_songs']['hits'], hits + 1)
+
+        first = PlaylistSong.objects.filter(playlist=self.playlist).order_by('order').first()
+        self.client.get(self.url, {'after': f"{first.order}_{first.id}"})
+        self.client.get(self.url, {'after': f"0{first.order}_{first.id}"})
+        self.assertEqual(fragment_cache.stats['playlist_songs']['hits'], hits + 2)
+
+    def test_song_changes_invalidate(self):
+        self.client.get(self.url)
+        self.add('c')
+        self.assertContains(self.client.get(self.url), "Song c")
+
+        song = Song.objects.get(spotify_id='c')
+        self.client.post(reverse('remove_song_from_playlist', args=[self.playlist.id, song.id]))
+        self.assertNotContains(self.client.get(self.url), f'data-song-id="{song.id}"')
+
+        self.client.post(
+            reverse('reorder_playlist', args=[self.playlist.id]),
+            json.dumps({'moves': [{'song': Song.objects.get(spotify_id='b').id, 'after': None}]}),
+            content_type='application/json',
+        )
+        content = self.client.get(self.url).content.decode()
+        self.assertLess(content.index("Song b"), content.index("Song a"))
+
+    def test_viewers_get_their_own_fragment(self):
+        self.client.get(self.url)
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.get(self.url)
+        self.assertContains(response, "Song a")
+        self.assertNotContains(response, "remove-song-form")
+
+    def test_badges(self):
+        url = reverse('profile')
+        self.assertNotContains(self.client.get(url), "Night Owl")
+        UserBadge.objects.create(user=self.user, badge=Badge.objects.create(name="Night Owl", description="d"))
+        self.assertContains(self.client.get(url), "Night Owl")
+        UserBadge.objects.all().delete()
+        self.assertNotContains(self.client.get(url), "Night Owl")
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.playlist = Playlist.objects.create(owner=self.user, name="Mix", is_public=True)
+        append_songs(self.playlist, [Song(spotify_id='a', name="Song a", artist="Artist")])
+        self.factory = RequestFactory()
+
+    def get(self, user=None, **headers):
+        request = self.factory.get('/', **headers)
+        request.user = user or self.user
+        return playlist_detail_view(request, self.playlist.id)
+
+    def test_not_modified_costs_one_query(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_song_changes_invalidate(self):
+        etag = self.get()['ETag']
+        append_songs(self.playlist, [Song(spotify_id='b', name="Song b", artist="Artist")])
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.get()['ETag']
+        move(self.playlist.id, Song.objects.get(spotify_id='b').id)
+        playlist_changed(self.playlist.id)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.get()['ETag']
+        PlaylistSong.objects.filter(song__spotify_id='a').get().delete()
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_each_viewer_validates_separately(self):
+        etag = self.get()['ETag']
+        other = User.objects.create_user('other')
+        self.assertEqual(self.get(other, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Joining a community changes the owner's share form
+        community = Community.objects.create(name="Jazz Club", description="d", created_by=other)
+        community.members.add(self.user)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AddSongTests(TestCase):
+    """Adding a track from the shared playlist picker (add_song) and the per-playlist endpoint"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.playlists = [Playlist.objects.create(name=f'Mix {i}', owner=self.user) for i in range(3)]
+        self.client.force_login(self.user)
+
+    def post(self, playlist, ajax=True, **data):
+        fields = {
+            'playlist_id': playlist.id if playlist else '',
+            'spotify_id': 'abc', 'name': 'Blue in Green', 'artist': 'Miles Davis',
+            'next': '/recommendations/spotify/search/?q=blue',
+        }
+        fields.update(data)
+        headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        return self.client.post(reverse('add_song'), fields, **headers)
+
+    def test_ajax_add_answers_with_json(self):
+        response = self.post(self.playlists[1])
+        self.assertEqual(response.json(), {
+            'status': 'added', 'message': 'Added "Blue in Green" to "Mix 1"!', 'playlist_id': self.playlists[1].id,
+        })
+        self.assertTrue(PlaylistSong.objects.filter(playlist=self.playlists[1], song__spotify_id='abc').exists())
+
+    def test_ajax_add_of_a_song_already_there_reports_it(self):
+        self.post(self.playlists[0])
+        response = self.post(self.playlists[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'exists')
+        self.assertEqual(PlaylistSong.objects.filter(playlist=self.playlists[0]).count(), 1)
+        self.assertEqual(Song.objects.filter(spotify_id='abc').count(), 1)
+
+    def test_form_post_without_javascript_redirects_back(self):
+        response = self.post(self.playlists[0], ajax=False)
+        self.assertRedirects(response, '/recommendations/spotify/search/?q=blue', fetch_redirect_response=False)
+        self.assertTrue(PlaylistSong.objects.filter(playlist=self.playlists[0]).exists())
+
+    def test_missing_playlist_or_song_is_refused(self):
+        self.assertEqual(self.post(None).status_code, 400)
+        self.assertRedirects(
+            self.post(None, ajax=False), '/recommendations/spotify/search/?q=blue', fetch_redirect_response=False,
+        )
+        self.assertEqual(self.post(self.playlists[0], name='').status_code, 400)
+        self.assertFalse(PlaylistSong.objects.exists())
+
+    def test_someone_elses_playlist_is_refused(self):
+        other = Playlist.objects.create(name='Not mine', owner=User.objects.create_user('other'))
+        self.assertEqual(self.post(other).status_code, 403)
+        self.assertFalse(PlaylistSong.objects.exists())
+
+
+@override_settings(LOCAL_SEARCH_MIN_HITS=1)
+class PlaylistPickerTests(TestCase):
+    """Track lists render one playlist picker and one add form per track"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        for i in range(5):
+            Playlist.objects.create(name=f'Mix {i}', owner=self.user)
+        for i in range(4):
+            Song.objects.create(spotify_id=f'blue{i}', name=f'Blue {i}', artist='Artist')
+        self.client.force_login(self.user)
+
+    def test_one_picker_per_page(self):
+        response = self.client.get(reverse('spotify_search'), {'q': 'blue'})
+        self.assertEqual(len(response.context['results']), 4)
+        self.assertContains(response, 'id="playlist-picker"', count=1)
+        self.assertContains(response, 'class="add-track-form"', count=4)
+        # One <option> per playlist, in the picker only
+        self.assertContains(response, '<option value=', count=5)
+
+    def test_no_picker_without_playlists(self):
+        Playlist.objects.all().delete()
+        response = self.client.get(reverse('spotify_search'), {'q': 'blue'})
+        self.assertNotContains(response, 'id="playlist-picker"')
+        self.assertNotContains(response, 'class="add-track-form"')
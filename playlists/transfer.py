@@ -0,0 +1,155 @@
+"""Playlist export and import as JSONL, CSV or M3U.
+
+Both directions stream. Exports read rows with ``.iterator()`` and yield
+one line at a time, so a response never holds the whole playlist. Imports
+read the upload line by line and write it ``batch_size`` songs at a time
+through ``append_songs``, so memory stays flat for any file size.
+"""
+import codecs
+import csv
+import json
+import re
+from itertools import islice
+
+from django.db import transaction
+
+from .catalog import append_songs, song_from_fields
+from .models import PlaylistSong
+
+# Song columns in an export, and the fields an import reads back
+FIELDS = ['spotify_id', 'name', 'artist', 'album', 'duration_ms', 'spotify_url', 'image_url']
+
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'm3u': 'audio/x-mpegurl',
+}
+
+SPOTIFY_TRACK_ID = re.compile(r'(?:open\.spotify\.com/track/|spotify:track:)([A-Za-z0-9]+)')
+
+
+class TransferError(ValueError):
+    """An upload that cannot be read as tracks"""
+
+
+def playlist_tracks(playlist_id, chunk_size=2000):
+    """The playlist's songs in order, as dicts of ``FIELDS``, read ``chunk_size`` rows at a time"""
+    rows = (
+        PlaylistSong.objects.filter(playlist_id=playlist_id).order_by('order', 'id')
+        .values_list(*[f'song__{field}' for field in FIELDS])
+        .iterator(chunk_size=chunk_size)
+    )
+    for row in rows:
+        yield dict(zip(FIELDS, row))
+
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def export_jsonl(tracks):
+    for track in tracks:
+        yield json.dumps(track, ensure_ascii=False) + '\n'
+
+
+def export_csv(tracks):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for track in tracks:
+        yield writer.writerow([track[field] for field in FIELDS])
+
+
+def export_m3u(tracks):
+    yield '#EXTM3U\n'
+    for track in tracks:
+        seconds = track['duration_ms'] // 1000 if track['duration_ms'] else -1
+        url = track['spotify_url'] or f"spotify:track:{track['spotify_id']}"
+        yield f"#EXTINF:{seconds},{track['artist']} - {track['name']}\n{url}\n"
+
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            raise TransferError(f"Line {number}: not valid JSON")
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_m3u(lines):
+    info = None
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            info = line[len('#EXTINF:'):]
+            continue
+        if not line or line.startswith('#'):
+            continue
+        match = SPOTIFY_TRACK_ID.search(line)
+        if not match:
+            raise TransferError(f"Line {number}: only Spotify track links can be imported")
+        seconds, _, title = (info or '').partition(',')
+        artist, _, name = title.partition(' - ')
+        seconds = seconds.strip()
+        yield number, {
+            'spotify_id': match.group(1),
+            'name': name.strip() or match.group(1),
+            'artist': artist.strip() or 'Unknown artist',
+            'duration_ms': int(seconds) * 1000 if seconds.isdigit() else 0,
+            'spotify_url': line if line.startswith('http') else f"https://open.spotify.com/track/{match.group(1)}",
+        }
+        info = None
+
+
+EXPORTERS = {'jsonl': export_jsonl, 'csv': export_csv, 'm3u': export_m3u}
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'm3u': read_m3u}
+
+
+def export_playlist(playlist_id, fmt, chunk_size=2000):
+    """Lines of the playlist in ``fmt``, generated as the rows are read"""
+    return EXPORTERS[fmt](playlist_tracks(playlist_id, chunk_size))
+
+
+def format_for(filename):
+    """Import format from an upload's file extension, or None"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    extension = {'ndjson': 'jsonl', 'json': 'jsonl', 'm3u8': 'm3u'}.get(extension, extension)
+    return extension if extension in READERS else None
+
+
+def import_playlist(playlist, upload, fmt, added_by=None, batch_size=2000):
+    """Append every track in ``upload`` (a binary file) to ``playlist``.
+
+    The whole import is one transaction: a line that cannot be read raises
+    TransferError and nothing is kept. Returns (added, skipped) as
+    ``append_songs`` does.
+    """
+    lines = codecs.iterdecode(upload, 'utf-8-sig')
+    records = READERS[fmt](lines)
+    added = skipped = 0
+    try:
+        with transaction.atomic():
+            while True:
+                batch = []
+                for number, fields in islice(records, batch_size):
+                    song = song_from_fields(fields)
+                    if song is None:
+                        raise TransferError(f"Line {number}: every track needs a spotify_id, name and artist")
+                    batch.append(song)
+                if not batch:
+                    return added, skipped
+                batch_added, batch_skipped = append_songs(playlist, batch, added_by=added_by, batch_size=batch_size)
+                added += batch_added
+                skipped += batch_skipped
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise TransferError(f"Could not read the file: {e}")
@@ -12,7 +12,13 @@ urlpatterns = [
     path('playlists/create/', views.create_playlist_view, name='create_playlist'),
     path('playlists/<int:playlist_id>/', views.playlist_detail_view, name='playlist_detail'),
     path('playlists/<int:playlist_id>/delete/', views.delete_playlist_view, name='delete_playlist'),
+    path('playlists/add-song/', views.add_song_view, name='add_song'),
     path('playlists/<int:playlist_id>/add-song/', views.add_song_to_playlist, name='add_song_to_playlist'),
+    path('playlists/<int:playlist_id>/add-songs/', views.add_songs_to_playlist, name='add_songs_to_playlist'),
+    path('playlists/<int:playlist_id>/reorder/', views.reorder_playlist_view, name='reorder_playlist'),
+    path('playlists/<int:playlist_id>/songs/', views.playlist_songs_view, name='playlist_songs'),
+    path('playlists/<int:playlist_id>/export/<str:fmt>/', views.export_playlist_view, name='export_playlist'),
+    path('playlists/<int:playlist_id>/import/', views.import_playlist_view, name='import_playlist'),
     path('playlists/<int:playlist_id>/remove-song/<int:song_id>/', views.remove_song_from_playlist, name='remove_song_from_playlist'),
     path('playlists/<int:playlist_id>/share/', views.share_playlist_to_community, name='share_playlist_to_community'),
 ]
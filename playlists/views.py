@@ -2,14 +2,33 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Subquery
 from django.conf import settings
+from django.utils.text import slugify
+import json
 import requests
-from .models import Playlist, Song, Review
+from . import transfer
+from .catalog import append_songs, song_from_fields
+from .conditional import Validator
+from .models import Playlist, PlaylistSong, Song, Review
+from .fragments import playlist_changed
+from .ordering import SongPage, append_orders, format_cursor, lock_playlist, move, parse_cursor, place_after
 from communities.models import Community
 from accounts.models import UserProfile
 
 
+# ?sort= options for the playlist listing; the counters make these plain column sorts
+PLAYLIST_SORTS = {
+    'recent': '-updated_at',
+    'size': '-song_count',
+    'longest': '-total_duration_ms',
+    'name': 'name',
+}
+
+
 def server_info(request):
     """Server info endpoint as specified in requirements"""
     server_geodata = requests.get('https://ipwhois.app/json/').json()
@@ -33,8 +52,8 @@ def home_view(request):
     
     # Get recent playlists from user's communities
     recent_playlists = Playlist.objects.filter(
-        community__in=user_communities
-    ).order_by('-updated_at')[:5]
+        community__in=user.communities.all()[:5]
+    ).select_related('community').order_by('-updated_at')[:5]
     
     # Get user's playlists
     user_playlists = user.owned_playlists.all()[:5]
@@ -57,8 +76,8 @@ def profile_view(request, user_id=None):
     
     # Get or create profile (should exist via signal, but handle edge case)
     profile, created = UserProfile.objects.get_or_create(user=profile_user)
-    playlists = profile_user.owned_playlists.filter(is_public=True)
-    badges = profile_user.badges.all()
+    playlists = profile_user.owned_playlists.filter(is_public=True).select_related('community')
+    badges = profile_user.badges.select_related('badge')
     
     context = {
         'profile_user': profile_user,
@@ -109,42 +128,141 @@ def create_playlist_view(request):
     })
 
 
+def song_page_context(request, playlist, can_edit):
+    """Context for one page of song rows, starting at the ``after`` cursor"""
+    start = request.GET.get('start', '')
+    after = parse_cursor(request.GET.get('after', ''))
+    return {
+        'playlist': playlist,
+        'page': SongPage(playlist.id, after, settings.PLAYLIST_PAGE_SIZE, int(start) if start.isdigit() else 0),
+        # Normalized, so '?after=junk' or '?after=0100_7' share their page's fragment
+        'cursor': format_cursor(after),
+        'can_edit': can_edit,
+    }
+
+
 @login_required
 def playlist_detail_view(request, playlist_id):
     """View playlist details"""
-    playlist = get_object_or_404(Playlist, id=playlist_id)
+    # The viewer's community memberships feed the share form; fetched with the
+    # playlist so the validator below costs this one query
+    memberships = Community.members.through.objects.filter(user_id=request.user.id).order_by().values('user_id')
+    playlist = get_object_or_404(
+        Playlist.objects.select_related('owner', 'community').annotate(
+            membership_count=Subquery(memberships.annotate(n=Count('id')).values('n')),
+            last_membership=Subquery(memberships.annotate(last=Max('id')).values('last')),
+        ),
+        id=playlist_id,
+    )
     
     # Check if user can view this playlist
-    if not playlist.is_public and playlist.owner != request.user:
+    if not playlist.is_public and playlist.owner_id != request.user.id:
         messages.error(request, "This playlist is private.")
         return redirect('home')
     
-    # Get songs with PlaylistSong info for ordering and metadata
-    from .models import PlaylistSong
-    playlist_songs = PlaylistSong.objects.filter(playlist=playlist).select_related('song', 'added_by')
-    is_owner = playlist.owner == request.user
+    is_owner = playlist.owner_id == request.user.id
     can_edit = is_owner or playlist.is_collaborative
     
+    # Song changes bump playlist.updated_at, so the browser's copy is current if nothing below moved
+    community_updated = playlist.community.updated_at if playlist.community else None
+    validator = Validator(
+        request,
+        [playlist.updated_at, community_updated, is_owner, can_edit, playlist.membership_count, playlist.last_membership],
+        max(filter(None, [playlist.updated_at, community_updated])),
+    )
+    not_modified = validator.not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    
     # Get user's communities for sharing
     user_communities = request.user.communities.all() if is_owner else []
     
-    context = {
-        'playlist': playlist,
-        'playlist_songs': playlist_songs,
+    # Only the first page of songs, read when its cached fragment is missing;
+    # the rest load on demand from playlist_songs_view
+    context = song_page_context(request, playlist, can_edit)
+    context.update({
         'is_owner': is_owner,
-        'can_edit': can_edit,
         'user_communities': user_communities,
-    }
-    return render(request, 'playlists/playlist_detail.html', context)
+    })
+    return validator.stamp(render(request, 'playlists/playlist_detail.html', context))
+
+
+@login_required
+def playlist_songs_view(request, playlist_id):
+    """Next page of a playlist's song rows as JSON: the rendered rows and the cursor after them"""
+    playlist = get_object_or_404(
+        Playlist.objects.only('id', 'owner_id', 'is_public', 'is_collaborative'), id=playlist_id
+    )
+    if not playlist.is_public and playlist.owner_id != request.user.id:
+        return JsonResponse({'error': "This playlist is private."}, status=403)
+    
+    can_edit = playlist.owner_id == request.user.id or playlist.is_collaborative
+    context = song_page_context(request, playlist, can_edit)
+    return JsonResponse({
+        'html': render_to_string('playlists/_playlist_song_rows.html', context, request=request),
+        'next': context['page'].next_cursor,
+    })
+
+
+@login_required
+def export_playlist_view(request, playlist_id, fmt):
+    """Download a playlist as JSONL, CSV or M3U, streamed as the rows are read"""
+    playlist = get_object_or_404(Playlist.objects.only('id', 'name', 'owner_id', 'is_public'), id=playlist_id)
+    if not playlist.is_public and playlist.owner_id != request.user.id:
+        messages.error(request, "This playlist is private.")
+        return redirect('home')
+    if fmt not in transfer.FORMATS:
+        messages.error(request, f"Unknown export format: {fmt}.")
+        return redirect('playlist_detail', playlist_id=playlist.id)
+    
+    response = StreamingHttpResponse(
+        transfer.export_playlist(playlist.id, fmt, settings.PLAYLIST_TRANSFER_BATCH_SIZE),
+        content_type=f"{transfer.FORMATS[fmt]}; charset=utf-8",
+    )
+    filename = slugify(playlist.name) or f"playlist-{playlist.id}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+@login_required
+def import_playlist_view(request, playlist_id):
+    """Append the tracks in an uploaded JSONL, CSV or M3U file to a playlist"""
+    playlist = get_object_or_404(Playlist.objects.only('id', 'name', 'owner_id', 'is_collaborative'), id=playlist_id)
+    if playlist.owner_id != request.user.id and not playlist.is_collaborative:
+        messages.error(request, "You don't have permission to add songs to this playlist.")
+        return redirect('playlist_detail', playlist_id=playlist.id)
+    
+    upload = request.FILES.get('file')
+    if request.method != 'POST' or upload is None:
+        messages.error(request, "Choose a file to import.")
+        return redirect('playlist_detail', playlist_id=playlist.id)
+    fmt = transfer.format_for(upload.name)
+    if fmt is None:
+        messages.error(request, "Import a .jsonl, .csv or .m3u file.")
+        return redirect('playlist_detail', playlist_id=playlist.id)
+    
+    try:
+        added, skipped = transfer.import_playlist(
+            playlist, upload, fmt, added_by=request.user, batch_size=settings.PLAYLIST_TRANSFER_BATCH_SIZE
+        )
+    except transfer.TransferError as e:
+        messages.error(request, f"Nothing was imported. {e}")
+    else:
+        messages.success(request, f'Imported {added} songs into "{playlist.name}"' + (f" ({skipped} already there)." if skipped else "."))
+    return redirect('playlist_detail', playlist_id=playlist.id)
 
 
 @login_required
 def my_playlists_view(request):
     """View all user's playlists"""
-    playlists = Playlist.objects.filter(owner=request.user).order_by('-updated_at')
+    sort = request.GET.get('sort', 'recent')
+    if sort not in PLAYLIST_SORTS:
+        sort = 'recent'
+    playlists = Playlist.objects.filter(owner=request.user).select_related('community').order_by(PLAYLIST_SORTS[sort], '-id')
     
     context = {
         'playlists': playlists,
+        'sort': sort,
     }
     return render(request, 'playlists/my_playlists.html', context)
 
@@ -169,14 +287,23 @@ def delete_playlist_view(request, playlist_id):
 
 @login_required
 def add_song_to_playlist(request, playlist_id):
-    """Add a song to a playlist from Spotify"""
+    """Add a song to a playlist from Spotify.
+
+    Requests sent with ``X-Requested-With: XMLHttpRequest`` get JSON back
+    instead of a redirect.
+    """
     if request.method != 'POST':
         return redirect('home')
     
-    playlist = get_object_or_404(Playlist, id=playlist_id)
+    ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+    playlist = get_object_or_404(
+        Playlist.objects.only('id', 'name', 'owner_id', 'is_collaborative'), id=playlist_id
+    )
     
     # Check if user can add to this playlist
-    if playlist.owner != request.user and not playlist.is_collaborative:
+    if playlist.owner_id != request.user.id and not playlist.is_collaborative:
+        if ajax:
+            return JsonResponse({'error': "You don't have permission to add songs to this playlist."}, status=403)
         messages.error(request, "You don't have permission to add songs to this playlist.")
         return redirect('playlist_detail', playlist_id=playlist_id)
     
@@ -185,11 +312,14 @@ def add_song_to_playlist(request, playlist_id):
     name = request.POST.get('name')
     artist = request.POST.get('artist')
     album = request.POST.get('album', '')
-    duration_ms = request.POST.get('duration_ms', 0)
+    duration_ms = request.POST.get('duration_ms', '')
+    duration_ms = int(duration_ms) if duration_ms.isdigit() else 0
     image_url = request.POST.get('image_url', '')
     spotify_url = request.POST.get('spotify_url', '')
     
     if not spotify_id or not name or not artist:
+        if ajax:
+            return JsonResponse({'error': "Missing song information."}, status=400)
         messages.error(request, "Missing song information.")
         return redirect('playlist_detail', playlist_id=playlist_id)
     
@@ -206,20 +336,50 @@ def add_song_to_playlist(request, playlist_id):
         }
     )
     
-    # Check if song is already in playlist
-    if playlist.songs.filter(id=song.id).exists():
-        messages.info(request, f'"{name}" is already in this playlist.')
+    # Add song to playlist, and count it in the same transaction
+    added = False
+    try:
+        with transaction.atomic():
+            # Lock the playlist so concurrent adds get distinct order keys, and
+            # check for the song under the lock so two adds of it cannot both pass
+            lock_playlist(playlist.id)
+            if not playlist.songs.filter(id=song.id).exists():
+                after = request.POST.get('after', '')
+                if after.isdigit() and PlaylistSong.objects.filter(playlist=playlist, song_id=after).exists():
+                    order, _ = place_after(playlist.id, int(after))
+                else:
+                    order = append_orders(playlist.id)[0]
+                PlaylistSong.objects.create(
+                    playlist=playlist,
+                    song=song,
+                    added_by=request.user,
+                    order=order
+                )
+                playlist.adjust_counters(songs=1, duration_ms=song.duration_ms)
+                added = True
+    except IntegrityError:
+        # Databases without row locks (SQLite) can still let a concurrent add through
+        added = False
+    
+    if not added:
+        status, message = 'exists', f'"{name}" is already in "{playlist.name}".'
+        if not ajax:
+            messages.info(request, f'"{name}" is already in this playlist.')
     else:
-        # Add song to playlist
-        from .models import PlaylistSong
-        max_order = playlist.playlistsong_set.count()
-        PlaylistSong.objects.create(
-            playlist=playlist,
-            song=song,
-            added_by=request.user,
-            order=max_order
-        )
-        messages.success(request, f'Added "{name}" to "{playlist.name}"!')
+        status, message = 'added', f'Added "{name}" to "{playlist.name}"!'
+        if not ajax:
+            messages.success(request, message)
+        
+        # Adding a recommended song counts as feedback on the recommendation
+        recommendation_id = request.POST.get('recommendation_id', '')
+        if recommendation_id.isdigit():
+            from recommendations.feedback import feedback_buffer
+            from recommendations.models import UserRecommendation
+            if UserRecommendation.objects.filter(id=recommendation_id, user=request.user).exists():
+                feedback_buffer.record_action(int(recommendation_id), 'added')
+    
+    if ajax:
+        return JsonResponse({'status': status, 'message': message, 'playlist_id': playlist.id})
     
     # Redirect back to the page they came from
     next_url = request.POST.get('next', 'playlist_detail')
@@ -228,6 +388,88 @@ def add_song_to_playlist(request, playlist_id):
     return redirect(next_url)
 
 
+@login_required
+def add_songs_to_playlist(request, playlist_id):
+    """Add many songs at once from a JSON body: ``{"tracks": [{"spotify_id": ..., "name": ..., "artist": ...}, ...]}``"""
+    if request.method != 'POST':
+        return JsonResponse({'error': "POST a JSON list of tracks."}, status=405)
+    
+    playlist = get_object_or_404(Playlist.objects.only('id', 'name', 'owner_id', 'is_collaborative'), id=playlist_id)
+    if playlist.owner_id != request.user.id and not playlist.is_collaborative:
+        return JsonResponse({'error': "You don't have permission to add songs to this playlist."}, status=403)
+    
+    try:
+        tracks = json.loads(request.body)['tracks']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body with a "tracks" list.'}, status=400)
+    if not isinstance(tracks, list) or not tracks:
+        return JsonResponse({'error': 'Expected a JSON body with a "tracks" list.'}, status=400)
+    if len(tracks) > settings.PLAYLIST_BULK_ADD_MAX:
+        return JsonResponse({'error': f"At most {settings.PLAYLIST_BULK_ADD_MAX} tracks per request."}, status=400)
+    
+    songs = [song_from_fields(track) for track in tracks]
+    if None in songs:
+        return JsonResponse({'error': "Every track needs a spotify_id, name and artist."}, status=400)
+    
+    added, skipped = append_songs(playlist, songs, added_by=request.user)
+    playlist.refresh_from_db(fields=['song_count'])
+    return JsonResponse({
+        'added': added,
+        'skipped': skipped,
+        'song_count': playlist.song_count,
+        'message': f'Added {added} songs to "{playlist.name}"' + (f" ({skipped} already there)." if skipped else "."),
+    })
+
+
+@login_required
+def reorder_playlist_view(request, playlist_id):
+    """Move songs within a playlist from a JSON body: ``{"moves": [{"song": id, "after": id or null}, ...]}``.
+
+    Moves apply in order; ``"after": null`` puts the song first. Each move
+    rewrites only the moved row unless the playlist has to be rebalanced.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': "POST a JSON list of moves."}, status=405)
+    
+    playlist = get_object_or_404(Playlist.objects.only('id', 'owner_id', 'is_collaborative'), id=playlist_id)
+    if playlist.owner_id != request.user.id and not playlist.is_collaborative:
+        return JsonResponse({'error': "You don't have permission to reorder this playlist."}, status=403)
+    
+    try:
+        moves = [(int(m['song']), None if m.get('after') is None else int(m['after'])) for m in json.loads(request.body)['moves']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body with a "moves" list of {"song", "after"}.'}, status=400)
+    if len(moves) > settings.PLAYLIST_BULK_ADD_MAX:
+        return JsonResponse({'error': f"At most {settings.PLAYLIST_BULK_ADD_MAX} moves per request."}, status=400)
+    
+    rebalanced = 0
+    try:
+        with transaction.atomic():
+            lock_playlist(playlist.id)
+            for song_id, after_song_id in moves:
+                rebalanced += move(playlist.id, song_id, after_song_id)
+            # Moves are plain updates, which send no signals
+            playlist_changed(playlist.id)
+    except PlaylistSong.DoesNotExist:
+        return JsonResponse({'error': "Every song in a move must be in the playlist."}, status=400)
+    return JsonResponse({'moved': len(moves), 'rebalanced': rebalanced})
+
+
+@login_required
+def add_song_view(request):
+    """Add a song to the playlist picked on the page (``playlist_id`` in POST)"""
+    if request.method != 'POST':
+        return redirect('home')
+    
+    playlist_id = request.POST.get('playlist_id', '')
+    if not playlist_id.isdigit():
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'error': "Pick a playlist first."}, status=400)
+        messages.error(request, "Pick a playlist first.")
+        return redirect(request.POST.get('next') or 'my_playlists')
+    return add_song_to_playlist(request, int(playlist_id))
+
+
 @login_required
 def remove_song_from_playlist(request, playlist_id, song_id):
     """Remove a song from a playlist"""
@@ -243,12 +485,13 @@ def remove_song_from_playlist(request, playlist_id, song_id):
         return redirect('playlist_detail', playlist_id=playlist_id)
     
     # Remove the song
-    from .models import PlaylistSong
-    try:
-        playlist_song = PlaylistSong.objects.get(playlist=playlist, song=song)
-        playlist_song.delete()
+    with transaction.atomic():
+        deleted, _ = PlaylistSong.objects.filter(playlist=playlist, song=song).delete()
+        if deleted:
+            playlist.adjust_counters(songs=-1, duration_ms=-song.duration_ms)
+    if deleted:
         messages.success(request, f'Removed "{song.name}" from "{playlist.name}".')
-    except PlaylistSong.DoesNotExist:
+    else:
         messages.error(request, "Song not found in playlist.")
     
     return redirect('playlist_detail', playlist_id=playlist_id)
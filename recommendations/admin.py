@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import RecommendationMode, UserRecommendation
+from .models import RecommendationMode, UserRecommendation, GenreSnapshot, JobCheckpoint
 
 
 @admin.register(RecommendationMode)
@@ -14,3 +14,14 @@ class UserRecommendationAdmin(admin.ModelAdmin):
     list_filter = ['mode', 'user_action', 'created_at']
     search_fields = ['user__username', 'song__name']
 
+
+@admin.register(GenreSnapshot)
+class GenreSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['genre', 'year', 'fetched_at', 'refresh_ms']
+    list_filter = ['genre', 'year']
+
+
+@admin.register(JobCheckpoint)
+class JobCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['name', 'value', 'updated_at']
+    readonly_fields = ['updated_at']
@@ -1,7 +1,20 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
 
 
 class RecommendationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recommendations'
 
+    def ready(self):
+        from playlists.models import Song
+        from . import signals  # noqa
+        from .vector_index import load_snapshot, mark_dirty
+
+        post_save.connect(mark_dirty, sender=Song, dispatch_uid='feature_index_mark_dirty')
+        # Memory-map the feature index snapshot so the first similar-songs
+        # request in this worker does not have to read every Song
+        try:
+            load_snapshot()
+        except (OSError, ValueError):
+            pass
@@ -0,0 +1,208 @@
+"""Async counterparts of the Spotify client calls, for the ASGI views.
+
+Token handling, rate limiting, the circuit breakers and the response cache
+are shared with ``spotify.py``. Only the HTTP round trip to api.spotify.com
+runs on the event loop. Every step that may touch the shared Django cache
+(the token, the rate limiter, the breakers) runs in a worker thread. The
+in-process response cache is a dictionary lookup and stays on the loop.
+"""
+import asyncio
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from playlists.catalog import ingest_tracks
+
+from . import spotify
+from .breaker import get_breaker
+from .cache import search_key
+from .exceptions import SpotifyAPIError, SpotifyThrottled, SpotifyUnavailable
+from .throttle import BACKGROUND, INTERACTIVE
+from .tracks import Track, dump_tracks, load_tracks
+
+
+# One pooled client per event loop; a client cannot be shared between loops
+_clients = weakref.WeakKeyDictionary()
+# In-flight fetches per event loop, keyed like the response cache
+_flights = weakref.WeakKeyDictionary()
+# Background refreshes of stale entries per event loop, by key. Holding the
+# task here keeps it from being garbage collected before it finishes.
+_refreshes = weakref.WeakKeyDictionary()
+async_stats = {'requests': 0, 'coalesced': 0}
+# With SONG_CATALOG_ASYNC off this writes to the database, which must not happen on the loop
+aingest_tracks = sync_to_async(ingest_tracks)
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        pool_size = getattr(settings, 'SPOTIFY_POOL_SIZE', 10)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.AsyncHTTPTransport(retries=getattr(settings, 'SPOTIFY_HTTP_RETRIES', 2)),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _prepare(endpoint, priority):
+    """Blocking part of a call: token, rate-limit slot and breaker.
+
+    Returns (token, probe) as ``CircuitBreaker.before_call`` reports it, or
+    (None, False) when Spotify is not configured.
+    """
+    token = spotify.get_spotify_token()
+    if not token:
+        return None, False
+    max_wait = getattr(settings, 'SPOTIFY_THROTTLE_MAX_WAIT', 2) if priority == INTERACTIVE else None
+    spotify.rate_limiter.acquire(priority, timeout=max_wait)
+    return token, get_breaker(endpoint).before_call()
+
+
+def _fresh_token():
+    """Blocking: drop the token Spotify refused and get another"""
+    spotify.token_manager.invalidate()
+    return spotify.get_spotify_token()
+
+
+async def _send(url, token, params, endpoint, breaker):
+    """One GET on the event loop, its outcome recorded on the endpoint's breaker"""
+    async_stats['requests'] += 1
+    try:
+        response = await get_client().get(
+            url,
+            headers={"Authorization": f"Bearer {token}"},
+            params=params,
+            timeout=spotify._latency_budget(endpoint),
+        )
+    except httpx.HTTPError:
+        await sync_to_async(breaker.record_failure, thread_sensitive=False)()
+        raise SpotifyUnavailable(endpoint)
+    if response.status_code >= 500:
+        await sync_to_async(breaker.record_failure, thread_sensitive=False)()
+    else:
+        await sync_to_async(breaker.record_success, thread_sensitive=False)()
+    return response
+
+
+async def aspotify_get_json(path, params=None, priority=INTERACTIVE):
+    """Async version of ``spotify._get_json``.
+
+    As in ``spotify.spotify_get``, a 401 drops the shared token and the call
+    is retried once with a fresh one.
+    """
+    endpoint = path.strip('/').split('/')[0]
+    token, probe = await sync_to_async(_prepare, thread_sensitive=False)(endpoint, priority)
+    if not token:
+        raise SpotifyAPIError('not configured')
+
+    breaker = get_breaker(endpoint)
+    api_base = getattr(settings, 'SPOTIFY_API_BASE', spotify.API_BASE)
+    url = f"{api_base.rstrip('/')}/{path.lstrip('/')}"
+    try:
+        response = await _send(url, token, params, endpoint, breaker)
+        if response.status_code == 401:
+            token = await sync_to_async(_fresh_token, thread_sensitive=False)()
+            if token:
+                spotify.http_stats['token_retries'] += 1
+                response = await _send(url, token, params, endpoint, breaker)
+    except BaseException:
+        # Cancelled mid-request: no answer to judge the endpoint by
+        if probe:
+            await sync_to_async(breaker.release_probe, thread_sensitive=False)()
+        raise
+
+    if response.status_code == 429:
+        retry_after = spotify._retry_after(response)
+        await sync_to_async(spotify.rate_limiter.block, thread_sensitive=False)(retry_after)
+        raise SpotifyThrottled(retry_after)
+    if response.status_code != 200:
+        raise SpotifyAPIError(response.status_code)
+    return response.json()
+
+
+async def _coalesced(key, fetch):
+    """Run ``fetch()`` once for concurrent identical requests on this loop"""
+    flights = _flights.setdefault(asyncio.get_running_loop(), {})
+    future = flights.get(key)
+    if future is not None:
+        async_stats['coalesced'] += 1
+        return await asyncio.shield(future)
+
+    future = flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await fetch()
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Nobody else may be waiting; mark it retrieved
+        raise
+    finally:
+        del flights[key]
+
+
+async def _refresh(key, fetch):
+    try:
+        spotify.response_cache.set(key, await _coalesced(key, fetch))
+        spotify.response_cache.stats['background_refreshes'] += 1
+    except Exception:
+        spotify.response_cache.stats['refresh_errors'] += 1
+
+
+def _refresh_in_background(key, fetch):
+    """Start one refresh task for ``key`` on this loop unless one is running"""
+    refreshes = _refreshes.setdefault(asyncio.get_running_loop(), {})
+    if key in refreshes:
+        return
+    task = refreshes[key] = asyncio.get_running_loop().create_task(_refresh(key, fetch))
+    task.add_done_callback(lambda _: refreshes.pop(key, None))
+
+
+async def _cached(key, fetch, refresh=None):
+    """Same fresh/stale/miss rules as ``ResponseCache.get_or_fetch``"""
+    cache = spotify.response_cache
+    payload = cache.get(key, max_age=cache.ttl)
+    if payload is not None:
+        cache.stats['hits'] += 1
+        return payload
+
+    payload = cache.get(key, max_age=cache.ttl + cache.stale_ttl)
+    if payload is not None:
+        cache.stats['stale_hits'] += 1
+        _refresh_in_background(key, refresh or fetch)
+        return payload
+
+    cache.stats['misses'] += 1
+    payload = await _coalesced(key, fetch)
+    cache.set(key, payload)
+    return payload
+
+
+async def asearch_tracks(q='', genre='', year='', market='US', limit=20, priority=INTERACTIVE):
+    """Async version of ``spotify.search_tracks``"""
+    params = spotify.search_params(q, genre, year, market, limit)
+
+    async def fetch(priority=priority):
+        data = await aspotify_get_json('search', params=params, priority=priority)
+        tracks = [Track.from_spotify(t) for t in data.get('tracks', {}).get('items', [])]
+        await aingest_tracks(tracks, genre=genre)
+        return dump_tracks(tracks)
+
+    return load_tracks(await _cached(search_key(q, genre, year, market, limit), fetch, refresh=lambda: fetch(BACKGROUND)))
+
+
+async def aget_track(track_id):
+    """Async version of ``spotify.get_track``"""
+    async def fetch(priority=INTERACTIVE):
+        track = Track.from_spotify(await aspotify_get_json(f'tracks/{track_id}', priority=priority))
+        await aingest_tracks([track])
+        return track.to_row()
+
+    return Track.load(await _cached(f'track:{track_id}', fetch, refresh=lambda: fetch(BACKGROUND)))
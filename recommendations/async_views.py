@@ -0,0 +1,232 @@
+"""Async versions of the Spotify-backed views, used when SPOTIFY_ASYNC_VIEWS is on.
+
+Under an ASGI worker (``ASGI=True`` in start.sh) a request waiting on
+Spotify only parks a coroutine, so one process can have many Spotify calls
+in flight at once.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import render, redirect
+
+from playlists.catalog import track_from_song
+from playlists.models import Playlist
+from playlists.search import search_songs
+from . import spotify
+from .async_spotify import aget_track, asearch_tracks
+from .tracks import load_tracks
+from .views import (
+    get_genre_snapshots, interleave, merge_genre_results, mode_recommendations_page, parse_genres,
+    parse_year, report_spotify_error, search_local_catalog, similar_from_index,
+)
+
+# Rendering touches request.user and lazy querysets, which must stay sync
+arender = sync_to_async(render)
+
+
+def async_login_required(view):
+    """``login_required`` for coroutine views"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def _user_playlists(user):
+    return [p async for p in Playlist.objects.filter(owner=user).only('id', 'name').order_by('-updated_at')]
+
+
+async def _has_token():
+    return bool(await sync_to_async(spotify.get_spotify_token, thread_sensitive=False)())
+
+
+@async_login_required
+async def spotify_recommendations_view(request):
+    """Get music recommendations from Spotify API using search.
+
+    Several genres and a year range can be asked for at once; the genre
+    searches run concurrently on the event loop.
+    """
+    if request.GET.get('mode'):
+        return await sync_to_async(mode_recommendations_page)(request, request.GET['mode'])
+    valid_genres = spotify.VALID_GENRES
+    genres = parse_genres(request.GET)
+    year = parse_year(request.GET.get('year', ''))
+    user = await request.auser()
+
+    context = {
+        'spotify_tracks': [],
+        'genre': ','.join(genres),
+        'genres': genres,
+        'year': year,
+        'valid_genres': valid_genres,
+    }
+    snapshots = await sync_to_async(get_genre_snapshots)(genres, year)
+    if len(snapshots) == len(genres):
+        context.update(
+            spotify_tracks=interleave(
+                [load_tracks(snapshots[g].tracks) for g in genres], settings.RECOMMENDATION_PAGE_SIZE
+            ),
+            snapshot_fetched_at=min(snapshot.fetched_at for snapshot in snapshots.values()),
+            user_playlists=await _user_playlists(user),
+        )
+        return await arender(request, 'recommendations/recommendations.html', context)
+
+    if not await _has_token():
+        messages.warning(request, "Spotify API not configured. Please set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET environment variables.")
+        return await arender(request, 'recommendations/recommendations.html', {'spotify_tracks': [], 'genre': 'pop'})
+
+    missing = [g for g in genres if g not in snapshots]
+    user_playlists, *searches = await asyncio.gather(
+        _user_playlists(user),
+        *(asearch_tracks(genre=g, year=year) for g in missing),
+        return_exceptions=True,
+    )
+    if isinstance(user_playlists, Exception):
+        raise user_playlists
+
+    tracks, stale, errors = await sync_to_async(merge_genre_results)(
+        genres, year, snapshots, dict(zip(missing, searches))
+    )
+    if errors:
+        report_spotify_error(request, errors[0])
+    context.update(spotify_tracks=tracks, stale=stale, user_playlists=user_playlists)
+    return await arender(request, 'recommendations/recommendations.html', context)
+
+
+@async_login_required
+async def search_spotify_view(request):
+    """Search for songs on Spotify"""
+    query = request.GET.get('q', '')
+    user_playlists = await _user_playlists(await request.auser())
+
+    local_results = await sync_to_async(search_local_catalog)(query)
+    if local_results is not None:
+        return await arender(request, 'recommendations/spotify_search.html', {
+            'results': local_results,
+            'query': query,
+            'user_playlists': user_playlists,
+        })
+
+    if not await _has_token():
+        messages.warning(request, "Spotify API not configured.")
+        return await arender(request, 'recommendations/spotify_search.html', {
+            'results': [],
+            'error': 'Spotify not configured',
+            'user_playlists': user_playlists
+        })
+
+    if not query:
+        return await arender(request, 'recommendations/spotify_search.html', {
+            'results': [],
+            'user_playlists': user_playlists
+        })
+
+    context = {'results': [], 'query': query, 'user_playlists': user_playlists}
+    try:
+        context['results'] = await asearch_tracks(q=query)
+    except spotify.SpotifyUnavailable:
+        stale_tracks = spotify.cached_search(q=query)
+        if stale_tracks is None:
+            songs = await sync_to_async(search_songs)(query)
+            stale_tracks = [track_from_song(song) for song in songs] or None
+        if stale_tracks is not None:
+            context.update(results=stale_tracks, stale=True)
+        else:
+            messages.error(request, "Spotify is not responding right now. Please try again shortly.")
+    except spotify.SpotifyThrottled as e:
+        messages.warning(request, str(e))
+    except spotify.SpotifyAPIError:
+        pass
+    except Exception as e:
+        messages.error(request, f"Error searching Spotify: {str(e)}")
+    return await arender(request, 'recommendations/spotify_search.html', context)
+
+
+async def _artist_tracks(artist_name):
+    """More tracks by the artist, falling back to cached results during an outage"""
+    try:
+        return await asearch_tracks(q=f"artist:{artist_name}"), False
+    except spotify.SpotifyUnavailable:
+        return spotify.cached_search(q=f"artist:{artist_name}") or [], True
+    except spotify.SpotifyAPIError:
+        return [], False
+
+
+async def _original_track(track_id):
+    try:
+        return await aget_track(track_id), False
+    except spotify.SpotifyUnavailable:
+        return spotify.cached_track(track_id), True
+    except spotify.SpotifyAPIError:
+        return None, False
+
+
+@async_login_required
+async def spotify_similar_view(request):
+    """Find songs similar to a given track using Spotify's search with artist.
+
+    Tracks with stored audio features are answered from the feature index
+    instead. Otherwise, when the link carries the artist name, the track lookup and the artist
+    search run concurrently instead of one after the other.
+    """
+    track_id = request.GET.get('track_id', '')
+    track_name = request.GET.get('track_name', '')
+    artist_hint = request.GET.get('artist', '')
+
+    from_index = await sync_to_async(similar_from_index)(track_id) if track_id else None
+    if from_index:
+        original_track, similar_tracks = from_index
+        return await arender(request, 'recommendations/spotify_similar.html', {
+            'original_track': original_track,
+            'similar_tracks': similar_tracks,
+            'track_name': track_name or original_track.name,
+            'user_playlists': await _user_playlists(await request.auser()),
+            'similar_source': 'features',
+        })
+
+    if not await _has_token():
+        messages.warning(request, "Spotify API not configured.")
+        return redirect('spotify_search')
+
+    if not track_id:
+        messages.error(request, "No track specified.")
+        return redirect('spotify_search')
+
+    # Loaded while Spotify answers
+    user_playlists_task = asyncio.ensure_future(_user_playlists(await request.auser()))
+    try:
+        if artist_hint:
+            (original_track, track_stale), (all_tracks, search_stale) = await asyncio.gather(
+                _original_track(track_id), _artist_tracks(artist_hint)
+            )
+        else:
+            original_track, track_stale = await _original_track(track_id)
+            all_tracks, search_stale = [], False
+            if original_track and original_track.artists:
+                all_tracks, search_stale = await _artist_tracks(original_track.first_artist)
+        user_playlists = await user_playlists_task
+
+        similar_tracks = [t for t in all_tracks if t.id != track_id] if original_track else []
+        context = {
+            'original_track': original_track,
+            'similar_tracks': similar_tracks,
+            'track_name': track_name or (original_track.name if original_track else 'Unknown'),
+            'user_playlists': user_playlists,
+            'stale': track_stale or search_stale,
+        }
+        return await arender(request, 'recommendations/spotify_similar.html', context)
+    except Exception as e:
+        messages.error(request, f"Error finding similar songs: {str(e)}")
+    finally:
+        # Never awaited if a lookup failed or the request was cancelled
+        user_playlists_task.cancel()
+
+    return redirect('spotify_search')
@@ -0,0 +1,161 @@
+"""Fill in Song columns from Spotify's multi-id endpoints.
+
+Songs added by hand or from search results only carry name, artist and
+album. Their audio features stay NULL, so the feature index and the
+recommendation engines never see them. The backfill walks those songs in
+id order. It asks for up to 100 ids per audio-features call (50 per
+tracks call) and runs several calls at once, all at BACKGROUND priority
+so the rate limiter keeps interactive requests first. Each page of
+results is written in bulk: audio features with UPDATE ... FROM (VALUES
+...), track details with ``bulk_update``.
+
+Progress is kept in a JobCheckpoint as the last Song id handled. An
+interrupted run, or one stopped by an outage, resumes where it stopped.
+Songs Spotify has no data for are not asked about again until the cursor
+is reset.
+"""
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models import Q
+
+from playlists.models import Song
+from . import spotify
+from .exceptions import SpotifyAPIError
+from .models import JobCheckpoint
+from .vector_index import FEATURES
+
+
+def _apply_features(song, features):
+    for name in FEATURES:
+        setattr(song, name, features.get(name))
+
+
+def _apply_track(song, track):
+    """Fill the song's blank columns from a ``Track``"""
+    if not song.album:
+        song.album = track.album[:255]
+    if not song.duration_ms:
+        song.duration_ms = track.duration_ms
+    if not song.image_url:
+        song.image_url = track.image_url[:200]
+    if not song.spotify_url:
+        song.spotify_url = track.spotify_url[:200]
+
+
+def update_song_floats(songs, fields, batch_size=500):
+    """Write float ``fields`` for ``songs`` with one UPDATE ... FROM (VALUES ...) per batch.
+
+    ``bulk_update`` builds a CASE expression per field and row, which costs
+    more to compile than the UPDATE itself takes to run. Databases without
+    UPDATE ... FROM fall back to it.
+    """
+    supports_from = connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 33)
+    )
+    if not supports_from:
+        Song.objects.bulk_update(songs, fields, batch_size=batch_size)
+        return
+    table = Song._meta.db_table
+    columns = ', '.join(fields)
+    assignments = ', '.join(f'{name} = CAST(v.{name} AS DOUBLE PRECISION)' for name in fields)
+    with connection.cursor() as cursor:
+        for start in range(0, len(songs), batch_size):
+            batch = songs[start:start + batch_size]
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * (len(fields) + 1)) + ')'] * len(batch))
+            params = [value for song in batch for value in [song.id, *(getattr(song, name) for name in fields)]]
+            cursor.execute(
+                f'WITH v (id, {columns}) AS (VALUES {placeholders}) '
+                f'UPDATE {table} SET {assignments} FROM v WHERE {table}.id = v.id',
+                params,
+            )
+
+
+def _write_features(songs):
+    update_song_floats(songs, FEATURES)
+
+
+def _write_track_details(songs):
+    Song.objects.bulk_update(songs, ['album', 'duration_ms', 'image_url', 'spotify_url'], batch_size=500)
+
+
+# name: (songs still missing data, fetch call, ids per call, apply, columns read, write)
+JOBS = {
+    'audio_features': (
+        Q(danceability__isnull=True) | Q(energy__isnull=True) | Q(tempo__isnull=True),
+        spotify.fetch_audio_features, spotify.AUDIO_FEATURES_BATCH, _apply_features,
+        FEATURES, _write_features,
+    ),
+    'track_details': (
+        Q(album='') | Q(image_url='') | Q(duration_ms=0),
+        spotify.fetch_tracks, spotify.TRACKS_BATCH, _apply_track,
+        ['album', 'duration_ms', 'image_url', 'spotify_url'], _write_track_details,
+    ),
+}
+
+
+def backfill(job='audio_features', workers=4, calls_per_page=None, limit=None, restart=False, progress=None):
+    """Run one backfill job until every candidate song was tried or a call fails.
+
+    ``progress`` is called with the running stats after each page. Returns
+    the final stats; ``stopped`` holds the error if Spotify stopped the run.
+    """
+    missing, fetch, per_call, apply, fields, write = JOBS[job]
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=f'backfill_{job}')
+    cursor = 0 if restart or not checkpoint.value else int(checkpoint.value)
+    page_size = per_call * (calls_per_page or workers)
+    stats = {'songs': 0, 'updated': 0, 'calls': 0, 'seconds': 0.0, 'songs_per_second': 0.0, 'stopped': None}
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'backfill-{job}') as pool:
+        while limit is None or stats['songs'] < limit:
+            size = page_size if limit is None else min(page_size, limit - stats['songs'])
+            songs = list(
+                Song.objects.filter(missing, id__gt=cursor).exclude(spotify_id='')
+                .order_by('id').only('id', 'spotify_id', *fields)[:size]
+            )
+            if not songs:
+                break
+
+            chunks = [songs[i:i + per_call] for i in range(0, len(songs), per_call)]
+            futures = [pool.submit(fetch, [s.spotify_id for s in chunk]) for chunk in chunks]
+            updated, done = [], []
+            for chunk, future in zip(chunks, futures):
+                try:
+                    results = future.result()
+                except SpotifyAPIError as e:
+                    stats['stopped'] = str(e)
+                    break
+                stats['calls'] += 1
+                for song in chunk:
+                    if song.spotify_id in results:
+                        apply(song, results[song.spotify_id])
+                        updated.append(song)
+                done.extend(chunk)
+
+            write(updated)
+            if done:
+                # Only move past the chunks that finished, in order, so a
+                # failed chunk is retried on the next run
+                cursor = done[-1].id
+                checkpoint.value = str(cursor)
+                checkpoint.save()
+            stats['songs'] += len(done)
+            stats['updated'] += len(updated)
+            elapsed = time.perf_counter() - started
+            stats['seconds'] = round(elapsed, 3)
+            stats['songs_per_second'] = round(stats['songs'] / elapsed, 1) if elapsed else 0.0
+            if progress:
+                progress(stats)
+            if stats['stopped']:
+                for future in futures:
+                    future.cancel()
+                break
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['songs_per_second'] = round(stats['songs'] / stats['seconds'], 1) if stats['seconds'] else 0.0
+    checkpoint.stats = stats
+    checkpoint.save()
+    return stats
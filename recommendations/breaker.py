@@ -0,0 +1,154 @@
+"""Circuit breakers for the Spotify API endpoints"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .exceptions import SpotifyUnavailable
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """Stops calling an endpoint once too many recent calls failed.
+
+    Calls are tracked over a rolling ``window`` of seconds. When at least
+    ``min_calls`` were made and the failure rate reaches ``failure_rate``, the
+    circuit opens for ``cooldown`` seconds. The open state goes into the
+    shared cache so every worker stops waiting on a dead endpoint, not just
+    the one that noticed. After the cooldown one probe call is let through
+    to decide whether to close again. A probe that never reports back (its
+    caller was throttled or cancelled) stops blocking others after another
+    ``cooldown`` seconds.
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=5, window=30, cooldown=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._calls = deque()  # (monotonic time, succeeded)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def cache_key(self):
+        return f'spotify:breaker:{self.name}'
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def current_failure_rate(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            if not self._calls:
+                return 0.0
+            return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def before_call(self):
+        """Raise SpotifyUnavailable instead of letting a doomed call through.
+
+        Returns True when the call is the half-open probe. Its caller must
+        then record the outcome, or call ``release_probe`` if the call ends
+        without one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN and now - self._opened_at >= self.cooldown:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                if self._probing and now - self._probe_started < self.cooldown:
+                    self.stats['rejected'] += 1
+                    raise SpotifyUnavailable(self.name)
+                self._probing = True
+                self._probe_started = now
+                return True
+            if self._state == OPEN:
+                self.stats['rejected'] += 1
+                raise SpotifyUnavailable(self.name)
+
+        # Another worker may have opened the circuit
+        if (cache.get(self.cache_key) or 0) > time.time():
+            self.stats['rejected'] += 1
+            raise SpotifyUnavailable(self.name)
+        return False
+
+    def release_probe(self):
+        """Let the next call probe again after a probe ended without an answer"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._probing = False
+                self._calls.clear()
+                cache.delete(self.cache_key)
+            self._calls.append((time.monotonic(), True))
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            self.stats['failures'] += 1
+            self._calls.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            tripped = (
+                self._state == HALF_OPEN
+                or (len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate)
+            )
+            if tripped and self._state != OPEN:
+                self._state = OPEN
+                self._opened_at = now
+                self._probing = False
+                self.stats['opened'] += 1
+                cache.set(self.cache_key, time.time() + self.cooldown, timeout=int(self.cooldown) + 1)
+
+    def state(self):
+        with self._lock:
+            state = self._state
+        if state == CLOSED and (cache.get(self.cache_key) or 0) > time.time():
+            state = OPEN  # Opened by another worker
+        return state
+
+    def metrics(self):
+        return dict(self.stats, state=self.state(), failure_rate=round(self.current_failure_rate(), 3))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    """The breaker for an endpoint name such as 'search' or 'tracks'"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                failure_rate=getattr(settings, 'SPOTIFY_BREAKER_FAILURE_RATE', 0.5),
+                min_calls=getattr(settings, 'SPOTIFY_BREAKER_MIN_CALLS', 5),
+                window=getattr(settings, 'SPOTIFY_BREAKER_WINDOW', 30),
+                cooldown=getattr(settings, 'SPOTIFY_BREAKER_COOLDOWN', 30),
+            )
+        return breaker
+
+
+def breaker_metrics():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.metrics() for b in breakers}
@@ -0,0 +1,133 @@
+"""In-process cache for Spotify responses"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def normalize_query(value):
+    """Lowercase and collapse whitespace so trivially different queries share an entry"""
+    return ' '.join(str(value or '').lower().split())
+
+
+def search_key(q='', genre='', year='', market='US', limit=20):
+    """Cache key for a /v1/search call"""
+    parts = [normalize_query(q), normalize_query(genre), normalize_query(year), str(market).upper(), str(int(limit))]
+    return 'search:' + '|'.join(parts)
+
+
+class ResponseCache:
+    """LRU cache with a TTL, a stale window and a memory cap.
+
+    Fresh entries are served as-is. Entries past their TTL but inside the
+    stale window are still served, while a single background thread fetches
+    a replacement. Anything older is a miss. When the estimated size of all
+    entries goes over ``max_bytes`` the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl=None, stale_ttl=None, max_bytes=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'SPOTIFY_CACHE_TTL', 600)
+        self.stale_ttl = stale_ttl if stale_ttl is not None else getattr(settings, 'SPOTIFY_CACHE_STALE_TTL', 3600)
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(settings, 'SPOTIFY_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+        self._entries = OrderedDict()  # key -> (payload, size, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'background_refreshes': 0,
+            'refresh_errors': 0,
+            'evictions': 0,
+        }
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key, max_age=None):
+        """Return a cached payload no older than ``max_age`` seconds, or None"""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        payload, _, stored_at = entry
+        if max_age is not None and time.monotonic() - stored_at > max_age:
+            return None
+        return payload
+
+    def set(self, key, payload):
+        size = len(json.dumps(payload, separators=(',', ':')))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (payload, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.stats['evictions'] += 1
+
+    def get_or_fetch(self, key, fetch, refresh=None):
+        """Return the payload for ``key``, calling ``fetch()`` on a miss.
+
+        A stale entry is replaced in the background by ``refresh()``, or
+        ``fetch()`` when no ``refresh`` is given. Both must return a
+        JSON-serializable payload or raise; errors are never cached.
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            payload, _, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                return payload
+            if age < self.ttl + self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                self._refresh_in_background(key, refresh or fetch)
+                return payload
+
+        self.stats['misses'] += 1
+        payload = fetch()
+        self.set(key, payload)
+        return payload
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.set(key, fetch())
+                self.stats['background_refreshes'] += 1
+            except Exception:
+                self.stats['refresh_errors'] += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self):
+        with self._lock:
+            entries = len(self._entries)
+            size = self._bytes
+        return dict(self.stats, entries=entries, bytes=size, max_bytes=self.max_bytes)
+
+
+response_cache = ResponseCache()
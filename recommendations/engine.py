@@ -0,0 +1,171 @@
+"""Batch scoring of songs against every RecommendationMode.
+
+Songs with audio features are loaded once into a NumPy matrix (the
+feature index). Each mode's min/max bands are checked against all songs
+at once. Songs inside a mode's bands score by how close they sit to the
+middle of the band: 1.0 at the centre, 0.0 at an edge. The top-k per mode
+are then written for every user as UserRecommendation rows. Songs the
+user already has in a playlist are skipped.
+"""
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from playlists.models import PlaylistSong
+from .models import RecommendationMode, UserRecommendation
+from .vector_index import FEATURES, get_index
+
+# The features RecommendationMode has bands for, in index column order
+MODE_FEATURES = ['danceability', 'energy', 'valence']
+MODE_COLUMNS = [FEATURES.index(name) for name in MODE_FEATURES]
+
+
+def mode_bands(modes):
+    """(low, high) arrays of shape (modes, features); open bounds become 0 and 1"""
+    low = np.array([
+        [getattr(mode, f'min_{name}') or 0.0 for name in MODE_FEATURES] for mode in modes
+    ], dtype=np.float32).reshape(len(modes), len(MODE_FEATURES))
+    high = np.array([
+        [1.0 if getattr(mode, f'max_{name}') is None else getattr(mode, f'max_{name}') for name in MODE_FEATURES]
+        for mode in modes
+    ], dtype=np.float32).reshape(len(modes), len(MODE_FEATURES))
+    return low, high
+
+
+def score_modes(features, low, high):
+    """Scores of shape (modes, songs); -inf where a song falls outside a mode's bands.
+
+    ``features`` is (songs, len(MODE_FEATURES)).
+    """
+    centre = (low + high) / 2
+    half_width = np.maximum((high - low) / 2, 1e-6)
+    # (modes, songs, features): 0 at the band centre, 1 at its edges
+    offset = np.abs(features[None, :, :] - centre[:, None, :]) / half_width[:, None, :]
+    scores = 1.0 - np.sqrt(np.mean(offset ** 2, axis=2))
+    scores[(offset > 1.0).any(axis=2)] = -np.inf
+    return scores
+
+
+def ranked_candidates(scores):
+    """Per mode, song rows inside the bands, best first"""
+    ranked = []
+    for row in scores:
+        inside = np.flatnonzero(np.isfinite(row))
+        ranked.append(inside[np.argsort(-row[inside], kind='stable')])
+    return ranked
+
+
+def top_k(ranked, song_ids, exclude, k):
+    """First ``k`` rows of ``ranked`` whose song id is not in ``exclude``"""
+    candidates = ranked[:k + len(exclude)]
+    if exclude:
+        candidates = candidates[~np.isin(song_ids[candidates], list(exclude))]
+    return candidates[:k]
+
+
+def describe(mode, features):
+    values = ', '.join(f'{name} {value:.2f}' for name, value in zip(MODE_FEATURES, features))
+    return f"Fits {mode.get_name_display()}: {values}"
+
+
+def playlist_songs_by_user(user_ids):
+    owned = defaultdict(set)
+    rows = PlaylistSong.objects.filter(playlist__owner_id__in=user_ids).values_list('playlist__owner_id', 'song_id')
+    for user_id, song_id in rows.iterator(chunk_size=5000):
+        owned[user_id].add(song_id)
+    return owned
+
+
+def acted_songs_by_user(user_ids, for_modes=True):
+    """{(user id, mode id): song ids} for rows the user liked, skipped or added.
+
+    Those rows survive a recompute, so their songs must not be written again.
+    """
+    acted = defaultdict(set)
+    rows = UserRecommendation.objects.filter(
+        user_id__in=user_ids, mode__isnull=not for_modes
+    ).exclude(user_action='').values_list('user_id', 'mode_id', 'song_id')
+    for user_id, mode_id, song_id in rows.iterator(chunk_size=5000):
+        acted[(user_id, mode_id)].add(song_id)
+    return acted
+
+
+def write_recommendations(user_ids, rows, batch_size=1000, for_modes=True):
+    """Replace the precomputed rows for ``user_ids`` with ``rows`` in one transaction.
+
+    ``for_modes`` picks which set is replaced: the per-mode rows or the
+    personalized rows without a mode. Rows the user has already acted on
+    are kept.
+    """
+    with transaction.atomic():
+        UserRecommendation.objects.filter(
+            user_id__in=user_ids, mode__isnull=not for_modes, user_action=''
+        ).delete()
+        UserRecommendation.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def compute_mode_recommendations(users=None, k=50, chunk_size=500, batch_size=1000):
+    """Score every song for every mode and store the top ``k`` per user and mode.
+
+    Users are processed ``chunk_size`` at a time. Returns counters for the run.
+    """
+    started = time.perf_counter()
+    modes = list(RecommendationMode.objects.order_by('id'))
+    stats = {'users': 0, 'rows': 0, 'songs': 0, 'modes': len(modes)}
+
+    index = get_index()
+    with index._lock:
+        song_ids = np.array(index.ids)
+        features = np.array(index.vectors[:, MODE_COLUMNS])
+    stats['songs'] = len(song_ids)
+    if not modes or not len(song_ids):
+        stats['seconds'] = round(time.perf_counter() - started, 3)
+        return stats
+
+    low, high = mode_bands(modes)
+    scores = score_modes(features, low, high)
+    ranked = ranked_candidates(scores)
+
+    if users is None:
+        users = User.objects.filter(is_active=True)
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        owned = playlist_songs_by_user(chunk)
+        acted = acted_songs_by_user(chunk)
+        rows = []
+        for user_id in chunk:
+            for m, mode in enumerate(modes):
+                exclude = owned.get(user_id, set()) | acted.get((user_id, mode.id), set())
+                for row in top_k(ranked[m], song_ids, exclude, k):
+                    rows.append(UserRecommendation(
+                        user_id=user_id,
+                        song_id=int(song_ids[row]),
+                        mode=mode,
+                        score=round(float(scores[m, row]), 4),
+                        reason=describe(mode, features[row]),
+                    ))
+        write_recommendations(chunk, rows, batch_size)
+        stats['users'] += len(chunk)
+        stats['rows'] += len(rows)
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def mode_recommendations(user, mode, limit=50):
+    """Precomputed recommendations for one user and mode (None for the personalized ones).
+
+    The stored score already includes the user's likes and skips (see
+    feedback.py), so rows come straight off the (user, mode, -score) index.
+    """
+    return list(
+        UserRecommendation.objects.filter(user=user, mode=mode)
+        .exclude(user_action='added')
+        .select_related('song')
+        .order_by('-score')[:limit]
+    )
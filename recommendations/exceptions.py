@@ -0,0 +1,27 @@
+"""Errors raised by the Spotify client"""
+
+
+class SpotifyAPIError(Exception):
+    """Spotify answered with something other than 200"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Spotify API error: {status_code}")
+        self.status_code = status_code
+
+
+class SpotifyThrottled(SpotifyAPIError):
+    """No request slot became free within the caller's wait budget"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(int(retry_after + 0.999), 1)
+        Exception.__init__(self, f"Spotify is busy right now, please try again in {self.retry_after} seconds.")
+        self.status_code = 429
+
+
+class SpotifyUnavailable(SpotifyAPIError):
+    """The endpoint's circuit is open or the call blew its latency budget"""
+
+    def __init__(self, endpoint):
+        Exception.__init__(self, "Spotify is not responding right now.")
+        self.endpoint = endpoint
+        self.status_code = 503
@@ -0,0 +1,188 @@
+"""Buffered impression and feedback writes for UserRecommendation.
+
+Rendering a recommendations page shows dozens of rows. Writing
+``shown_at`` for each one as the page renders would add an UPDATE per row
+to every page view. Instead, views append events to a per-process queue. A
+daemon thread drains the queue and writes each batch with a few statements:
+one CASE update for ``shown_at``, and one update per action that sets
+``user_action`` and folds the action's multiplier into ``score``. Pages
+then read rows in stored score order, straight off the (user, mode,
+-score) index. It writes once ``batch_size`` events are waiting or
+``flush_interval`` seconds after the first one arrived, and whatever is
+left when the worker exits.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import UserRecommendation
+from .precompute import mark_inputs_changed
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ('liked', 'skipped', 'added')
+# Folded into the stored score when the action is written
+SCORE_MULTIPLIERS = {'liked': 1.25, 'skipped': 0.25, 'added': 0.0}
+# Put on the queue by stop() to make the drain thread write what it holds and exit
+_STOP = object()
+
+
+def rescored(action):
+    """Expression for ``score`` re-weighted from the row's current action to ``action``.
+
+    The old multiplier is divided out first, so changing a like into a skip
+    does not compound the two. 'added' is final and never re-weighted.
+    """
+    factor = SCORE_MULTIPLIERS[action]
+    return F('score') * Case(
+        *[When(user_action=old, then=Value(factor / old_factor))
+          for old, old_factor in SCORE_MULTIPLIERS.items() if old_factor],
+        default=Value(factor),
+        output_field=FloatField(),
+    )
+
+
+def write_events(events):
+    """Apply a batch of (kind, recommendation id, value) events.
+
+    Impressions only fill ``shown_at`` where it is still empty. For actions,
+    the last one for a row wins. The users who acted are marked for the
+    next incremental precompute run, whose taste vectors use likes and skips.
+    """
+    shown, actions = {}, {}
+    for kind, rec_id, value in events:
+        if kind == 'shown':
+            shown.setdefault(rec_id, value)
+        else:
+            actions[rec_id] = value
+            shown.setdefault(rec_id, timezone.now())  # Acting on it means it was seen
+
+    shown_items = list(shown.items())
+    for start in range(0, len(shown_items), 500):
+        chunk = shown_items[start:start + 500]
+        UserRecommendation.objects.filter(id__in=[rec_id for rec_id, _ in chunk], shown_at__isnull=True).update(
+            shown_at=Case(
+                *[When(id=rec_id, then=Value(at)) for rec_id, at in chunk],
+                output_field=DateTimeField(),
+            )
+        )
+    by_action = {}
+    for rec_id, action in actions.items():
+        by_action.setdefault(action, []).append(rec_id)
+    for action, rec_ids in by_action.items():
+        for start in range(0, len(rec_ids), 500):
+            UserRecommendation.objects.filter(id__in=rec_ids[start:start + 500]).exclude(
+                user_action__in=[action, 'added']
+            ).update(user_action=action, score=rescored(action))
+    if actions:
+        mark_inputs_changed(UserRecommendation.objects.filter(id__in=list(actions)).values('user_id'))
+    return len(shown), len(actions)
+
+
+class FeedbackBuffer:
+    """Queue of recommendation events drained in batches by a daemon thread"""
+
+    def __init__(self, batch_size=500, flush_interval=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'events': 0, 'flushes': 0, 'rows_shown': 0, 'rows_acted': 0, 'errors': 0,
+            'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0,
+        }
+        # The drain thread is a daemon, so events it has not written yet
+        # would die with the worker
+        atexit.register(self.stop)
+
+    def record_impressions(self, rec_ids):
+        now = timezone.now()
+        self._put([('shown', rec_id, now) for rec_id in rec_ids])
+
+    def record_action(self, rec_id, action):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown recommendation action: {action}")
+        self._put([('action', rec_id, action)])
+
+    def _put(self, events):
+        if not events:
+            return
+        self.stats['events'] += len(events)
+        if not getattr(settings, 'FEEDBACK_BUFFERED', True):
+            self._write(events)
+            return
+        for event in events:
+            self._queue.put(event)
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='recommendation-feedback', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                pass
+            events = [event for event in batch if event is not _STOP]
+            if events:
+                close_old_connections()
+                self._write(events)
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is _STOP:
+                return
+
+    def flush(self):
+        """Block until everything queued so far is written"""
+        self._queue.join()
+
+    def stop(self, timeout=10.0):
+        """Write everything queued so far without waiting out the flush interval, and end the thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _write(self, events):
+        started = time.perf_counter()
+        try:
+            shown, acted = write_events(events)
+            self.stats['rows_shown'] += shown
+            self.stats['rows_acted'] += acted
+        except Exception:
+            self.stats['errors'] += 1
+            logger.exception("Recommendation feedback flush failed")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats['flushes'] += 1
+        self.stats['last_flush_ms'] = round(elapsed_ms, 2)
+        self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed_ms), 2)
+        self.stats['total_flush_ms'] += elapsed_ms
+
+    def metrics(self):
+        stats = dict(self.stats, queue_depth=self._queue.qsize())
+        total = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = round(total / stats['flushes'], 2) if stats['flushes'] else 0.0
+        return stats
+
+
+feedback_buffer = FeedbackBuffer(
+    batch_size=getattr(settings, 'FEEDBACK_FLUSH_SIZE', 500),
+    flush_interval=getattr(settings, 'FEEDBACK_FLUSH_INTERVAL', 5.0),
+)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations import spotify
+from recommendations.backfill import JOBS, backfill
+
+
+class Command(BaseCommand):
+    help = ("Fill in missing Song audio features (and, with --job track_details, album art and "
+            "durations) from Spotify's multi-id endpoints; resumes where the last run stopped")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', choices=sorted(JOBS), default='audio_features')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Spotify calls in flight at once')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many songs')
+        parser.add_argument('--restart', action='store_true',
+                            help='Start over from the first song instead of the saved cursor')
+
+    def handle(self, *args, **options):
+        if not spotify.get_spotify_token():
+            raise CommandError("Spotify API not configured.")
+
+        def progress(stats):
+            self.stdout.write(
+                f"  {stats['songs']} songs, {stats['updated']} updated, "
+                f"{stats['calls']} calls, {stats['songs_per_second']} songs/sec"
+            )
+
+        stats = backfill(
+            job=options['job'],
+            workers=options['workers'],
+            limit=options['limit'],
+            restart=options['restart'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        summary = (
+            f"{stats['songs']} songs checked, {stats['updated']} updated in {stats['calls']} calls, "
+            f"{stats['seconds']}s ({stats['songs_per_second']} songs/sec)"
+        )
+        if stats['stopped']:
+            raise CommandError(f"Stopped early ({stats['stopped']}); rerun to resume. {summary}")
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,57 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from playlists.search import search_songs
+from recommendations import spotify
+
+
+DEFAULT_QUERIES = ['love', 'night', 'dance', 'blue', 'heart', 'summer', 'fire', 'dream', 'rain', 'home']
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = "Compare p50/p99 latency of local catalog search against remote Spotify search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Query to run (repeatable); defaults to a fixed list')
+        parser.add_argument('--runs', type=int, default=5, help='Passes over the query list')
+        parser.add_argument('--local-only', action='store_true', help='Skip the Spotify side')
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or DEFAULT_QUERIES
+        runs = options['runs']
+
+        self.report('local', self.measure(lambda q: search_songs(q), queries, runs))
+
+        if options['local_only']:
+            return
+        if not spotify.get_spotify_token():
+            raise CommandError("Spotify API not configured; use --local-only.")
+        # fetch_search skips the response cache, like the old remote-only path
+        self.report('remote', self.measure(lambda q: spotify.fetch_search(q=q), queries, runs))
+
+    def measure(self, search, queries, runs):
+        samples, hits = [], []
+        for _ in range(runs):
+            for query in queries:
+                start = time.perf_counter()
+                results = search(query)
+                samples.append((time.perf_counter() - start) * 1000)
+                hits.append(len(results))
+        return samples, hits
+
+    def report(self, label, measured):
+        samples, hits = measured
+        self.stdout.write(
+            f"{label:>6}: n={len(samples)} p50={percentile(samples, 50):.2f} ms "
+            f"p99={percentile(samples, 99):.2f} ms mean={statistics.mean(samples):.2f} ms "
+            f"avg hits={statistics.mean(hits):.1f}"
+        )
@@ -0,0 +1,60 @@
+import json
+import pickle
+import string
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from recommendations.stub import fake_track
+from recommendations.tracks import Track, dump_tracks
+
+
+def spotify_tracks(count, markets):
+    """Spotify-shaped track dicts; real ones list ~185 available markets"""
+    codes = [a + b for a in string.ascii_uppercase for b in string.ascii_uppercase][:markets]
+    tracks = []
+    for i in range(count):
+        track = fake_track(f"bench{i:08d}")
+        track['available_markets'] = list(codes)
+        track['album']['available_markets'] = list(codes)
+        tracks.append(track)
+    return tracks
+
+
+def measure(build):
+    """(result, bytes still allocated by ``build``)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+class Command(BaseCommand):
+    help = "Compare memory and cache size of raw Spotify track dicts against Track objects"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Tracks to build')
+        parser.add_argument('--markets', type=int, default=185, help='Market codes per track and album')
+
+    def handle(self, *args, **options):
+        count, markets = options['count'], options['markets']
+        raw = spotify_tracks(count, markets)
+
+        # Raw dicts as the views used to hold them: parsed from the API response
+        payload = json.dumps(raw)
+        raw, raw_bytes = measure(lambda: json.loads(payload))
+        tracks, track_bytes = measure(lambda: [Track.from_spotify(t) for t in raw])
+        rows = dump_tracks(tracks)
+
+        self.report('memory', raw_bytes, track_bytes, count)
+        self.report('json', len(payload), len(json.dumps(rows)), count)
+        self.report('pickle', len(pickle.dumps(raw)), len(pickle.dumps(rows)), count)
+
+    def report(self, label, before, after, count):
+        self.stdout.write(
+            f"{label:>6}: raw {before / 1024:,.0f} KiB ({before / count:,.0f} B/track)  "
+            f"Track {after / 1024:,.0f} KiB ({after / count:,.0f} B/track)  "
+            f"{before / max(after, 1):.1f}x smaller"
+        )
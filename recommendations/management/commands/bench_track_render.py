@@ -0,0 +1,73 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from playlists.models import Playlist
+from recommendations.stub import fake_track
+from recommendations.tracks import Track
+from recommendations.views import user_playlist_choices
+
+
+TEMPLATES = {
+    'recommendations': ('recommendations/recommendations.html', 'spotify_tracks'),
+    'search': ('recommendations/spotify_search.html', 'results'),
+    'similar': ('recommendations/spotify_similar.html', 'similar_tracks'),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time track-list page renders for users with many playlists"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--playlists', type=int, action='append', dest='playlist_counts',
+                            help='Playlist count to test (repeatable); defaults to 0, 10, 200 and 1000')
+        parser.add_argument('--tracks', type=int, default=20, help='Tracks per page')
+        parser.add_argument('--runs', type=int, default=20, help='Renders per page and playlist count')
+
+    def handle(self, *args, **options):
+        counts = options['playlist_counts'] or [0, 10, 200, 1000]
+        tracks = [Track.from_spotify(fake_track(f"render{i:06d}")) for i in range(options['tracks'])]
+        original = tracks[0]
+
+        # Users and playlists only exist for the run
+        try:
+            with transaction.atomic():
+                for count in counts:
+                    self.bench(count, tracks, original, options['runs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def bench(self, count, tracks, original, runs):
+        user = User.objects.create_user(f"bench-render-{count}-{time.monotonic_ns()}")
+        Playlist.objects.bulk_create([Playlist(owner=user, name=f"Playlist {i}") for i in range(count)])
+        request = RequestFactory().get('/')
+        request.user = user
+
+        for label, (template, key) in TEMPLATES.items():
+            samples, size = [], 0
+            for _ in range(runs):
+                start = time.perf_counter()
+                context = {
+                    key: tracks,
+                    'user_playlists': user_playlist_choices(user),
+                    'original_track': original,
+                    'genres': ['pop'],
+                    'query': 'bench',
+                }
+                html = render_to_string(template, context, request=request)
+                samples.append((time.perf_counter() - start) * 1000)
+                size = len(html.encode())
+            self.stdout.write(
+                f"{count:>5} playlists, {label:>15}: median {statistics.median(samples):7.2f} ms "
+                f"max {max(samples):7.2f} ms  {size / 1024:8.1f} KiB"
+            )
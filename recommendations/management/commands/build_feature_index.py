@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recommendations.vector_index import feature_index
+
+
+class Command(BaseCommand):
+    help = "Build the audio-feature index from Song and write the snapshot workers load at startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.FEATURE_INDEX_PATH,
+                            help='Snapshot directory (default: FEATURE_INDEX_PATH)')
+        parser.add_argument('--queries', type=int, default=100,
+                            help='Time this many sample similar-song lookups afterwards')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        feature_index.rebuild()
+        feature_index.save(options['path'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(feature_index)} songs into {options['path']} in {elapsed:.2f}s"
+        ))
+
+        sample = feature_index.spotify_ids[:options['queries']]
+        if not sample:
+            return
+        started = time.perf_counter()
+        for spotify_id in sample:
+            feature_index.similar(spotify_id, k=20, metric=settings.FEATURE_INDEX_METRIC)
+        per_query = (time.perf_counter() - started) / len(sample) * 1000
+        self.stdout.write(f"Top-20 {settings.FEATURE_INDEX_METRIC} lookup: {per_query:.3f} ms on average")
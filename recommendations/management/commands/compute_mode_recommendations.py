@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.engine import compute_mode_recommendations
+
+
+class Command(BaseCommand):
+    help = "Score every song against each RecommendationMode and store the top picks per user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames',
+                            help='Only compute for this username (repeatable)')
+        parser.add_argument('--top-k', type=int, default=50,
+                            help='Recommendations kept per user and mode')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Users written per transaction')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk_create INSERT')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        stats = compute_mode_recommendations(
+            users=users,
+            k=options['top_k'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {stats['songs']} songs for {stats['modes']} modes; "
+            f"wrote {stats['rows']} recommendations for {stats['users']} users in {stats['seconds']}s"
+        ))
@@ -0,0 +1,40 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations.precompute import precompute_recommendations
+
+
+class Command(BaseCommand):
+    help = ("Refresh personalized recommendations for users whose playlists, reviews or "
+            "profile changed since the last run (meant to run nightly)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes, each given a range of user ids')
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every user, e.g. after many new songs were added')
+        parser.add_argument('--top-k', type=int, default=50,
+                            help='Recommendations kept per user')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Users written per transaction')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, refreshing every N seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = precompute_recommendations(
+                workers=options['workers'],
+                full=options['full'],
+                k=options['top_k'],
+                chunk_size=options['chunk_size'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"{'Full' if stats['full'] else 'Incremental'} run: {stats['users']} users, "
+                f"{stats['rows']} recommendations in {stats['seconds']}s "
+                f"({stats['users_per_second']} users/sec over {stats['partitions']} partitions)"
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recommendations.stub import run_stub
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Spotify API (set SPOTIFY_TOKEN_URL/SPOTIFY_API_BASE to use it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before each API response')
+
+    def handle(self, *args, **options):
+        host, port = options['host'], options['port']
+        self.stdout.write(f"Spotify stub on http://{host}:{port}")
+        self.stdout.write(f"  SPOTIFY_TOKEN_URL=http://{host}:{port}/api/token")
+        self.stdout.write(f"  SPOTIFY_API_BASE=http://{host}:{port}/v1")
+        run_stub(host, port, delay=options['delay'])
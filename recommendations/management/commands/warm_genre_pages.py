@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from playlists.catalog import ingestor
+from recommendations import spotify
+from recommendations.models import GenreSnapshot
+from recommendations.tracks import dump_tracks
+
+
+class Command(BaseCommand):
+    help = "Fetch every genre page from Spotify ahead of time and store it as a GenreSnapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=0,
+                            help='Also warm each genre for the last N years')
+        parser.add_argument('--genre', action='append', dest='genres',
+                            help='Only warm this genre (repeatable)')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, refreshing every N seconds')
+
+    def handle(self, *args, **options):
+        if not spotify.get_spotify_token():
+            raise CommandError("Spotify API not configured.")
+
+        genres = options['genres'] or spotify.VALID_GENRES
+        unknown = set(genres) - set(spotify.VALID_GENRES)
+        if unknown:
+            raise CommandError(f"Unknown genre(s): {', '.join(sorted(unknown))}")
+
+        while True:
+            self.warm(genres, options['years'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def warm(self, genres, years):
+        this_year = timezone.now().year
+        year_filters = [''] + [str(this_year - i) for i in range(years)]
+        existing = {
+            (s.genre, s.year): s.fetched_at
+            for s in GenreSnapshot.objects.only('genre', 'year', 'fetched_at')
+        }
+
+        started = time.monotonic()
+        refreshed = failed = 0
+        for genre in genres:
+            for year in year_filters:
+                label = f"{genre} {year}".strip()
+                fetch_start = time.monotonic()
+                try:
+                    tracks = spotify.fetch_search(genre=genre, year=year, priority=spotify.BACKGROUND)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"  {label}: {e}")
+                    continue
+                refresh_ms = int((time.monotonic() - fetch_start) * 1000)
+
+                now = timezone.now()
+                previous = existing.get((genre, year))
+                GenreSnapshot.objects.update_or_create(
+                    genre=genre, year=year,
+                    defaults={'tracks': dump_tracks(tracks), 'fetched_at': now, 'refresh_ms': refresh_ms},
+                )
+                refreshed += 1
+                age = f"{int((now - previous).total_seconds())}s old" if previous else "new"
+                self.stdout.write(f"  {label}: {len(tracks)} tracks in {refresh_ms} ms (was {age})")
+
+        # Snapshot tracks also go into the Song catalog; finish before exiting
+        ingestor.flush()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {refreshed} genre pages in {elapsed:.1f}s ({failed} failed)"
+        ))
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(max_length=50)),
+                ('year', models.CharField(blank=True, max_length=20)),
+                ('tracks', models.JSONField(default=list)),
+                ('fetched_at', models.DateTimeField()),
+                ('refresh_ms', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('genre', 'year')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+# name: (description, danceability, energy, valence) as (min, max) bands
+MODES = {
+    'focus': ("Steady, low-key tracks that stay out of the way", (0.0, 0.5), (0.2, 0.6), (0.2, 0.7)),
+    'workout': ("High-energy tracks to keep you moving", (0.6, 1.0), (0.75, 1.0), (0.4, 1.0)),
+    'driving': ("Upbeat tracks for the road", (0.5, 0.9), (0.6, 1.0), (0.4, 1.0)),
+    'dancing': ("Tracks built for the dance floor", (0.7, 1.0), (0.6, 1.0), (0.5, 1.0)),
+    'singing': ("Happy, catchy tracks to sing along to", (0.4, 0.9), (0.4, 0.9), (0.5, 1.0)),
+    'relaxing': ("Calm, gentle tracks to unwind", (0.0, 0.5), (0.0, 0.4), (0.2, 0.8)),
+    'party': ("Loud, happy, danceable tracks", (0.7, 1.0), (0.7, 1.0), (0.6, 1.0)),
+}
+
+
+def seed_modes(apps, schema_editor):
+    RecommendationMode = apps.get_model('recommendations', 'RecommendationMode')
+    for name, (description, danceability, energy, valence) in MODES.items():
+        RecommendationMode.objects.get_or_create(name=name, defaults={
+            'description': description,
+            'min_danceability': danceability[0], 'max_danceability': danceability[1],
+            'min_energy': energy[0], 'max_energy': energy[1],
+            'min_valence': valence[0], 'max_valence': valence[1],
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0002_song_search_index'),
+        ('recommendations', '0002_genresnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userrecommendation',
+            index=models.Index(fields=['user', 'mode', '-score'], name='userrec_user_mode_score_idx'),
+        ),
+        migrations.RunPython(seed_modes, migrations.RunPython.noop),
+    ]
@@ -43,7 +43,36 @@ class UserRecommendation(models.Model):
     
     class Meta:
         ordering = ['-score', '-created_at']
+        indexes = [
+            # Serves /recommendations/?mode=... straight from the index
+            models.Index(fields=['user', 'mode', '-score'], name='userrec_user_mode_score_idx'),
+        ]
     
     def __str__(self):
         return f"Recommendation for {self.user.username}: {self.song.name}"
 
+
+class GenreSnapshot(models.Model):
+    """Precomputed genre page results, written by the warm_genre_pages command"""
+    genre = models.CharField(max_length=50)
+    year = models.CharField(max_length=20, blank=True)
+    tracks = models.JSONField(default=list)
+    fetched_at = models.DateTimeField()
+    refresh_ms = models.IntegerField(default=0)  # How long the Spotify fetch took
+    
+    class Meta:
+        unique_together = ['genre', 'year']
+    
+    def __str__(self):
+        return f"{self.genre} {self.year}".strip()
+
+
+class JobCheckpoint(models.Model):
+    """Where a batch job left off, so the next run only does new work"""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.CharField(max_length=255, blank=True)  # Watermark or cursor
+    stats = models.JSONField(default=dict, blank=True)  # Counters from the last run
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
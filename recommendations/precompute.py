@@ -0,0 +1,224 @@
+"""Personalized "For You" recommendations, precomputed for every user.
+
+Each user gets a taste vector, a weighted sum of the feature vectors of
+the songs in their playlists (weight 1), the songs they reviewed (from
+-1 for one star to +1 for five) and earlier recommendations they liked or
+skipped. Songs are scored by cosine similarity to
+that vector. Songs matching the user's favorite artist or genre get a
+boost. The best ``k`` unseen songs are written as UserRecommendation rows
+with no mode.
+
+Runs are incremental. A JobCheckpoint stores when the last run started,
+and the next run only reprocesses users whose inputs changed since then,
+as recorded in UserProfile.inputs_changed_at (see signals.py). The work
+is split by user-id range across a process pool.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from playlists.models import PlaylistSong, Review
+from .engine import write_recommendations
+from .models import JobCheckpoint, UserRecommendation
+from .vector_index import _featured_songs, get_index
+
+CHECKPOINT_NAME = 'precompute_recommendations'
+ARTIST_BOOST = 0.15
+GENRE_BOOST = 0.1
+PLAYLIST_WEIGHT = 1.0
+FEEDBACK_WEIGHTS = {'liked': 0.5, 'skipped': -0.5}
+
+
+class SongTable:
+    """Unit feature vectors plus lowercased genre/artist for every indexed song"""
+
+    def __init__(self):
+        index = get_index()
+        with index._lock:
+            self.ids = np.array(index.ids)
+            self.unit = np.array(index.unit)
+
+        genres, artists = {}, {}
+        for song_id, genre, artist in _featured_songs().values_list('id', 'genre', 'artist').iterator(chunk_size=5000):
+            genres[song_id] = genre.lower()
+            artists[song_id] = artist.lower()
+        self.genres = np.array([genres.get(i, '') for i in self.ids.tolist()], dtype=str)
+        self.artists = np.array([artists.get(i, '') for i in self.ids.tolist()], dtype=str)
+
+    def rows_for(self, song_ids):
+        """Index rows for the songs that are in the index"""
+        song_ids = np.asarray(list(song_ids), dtype=np.int64)
+        rows = np.searchsorted(self.ids, song_ids)
+        rows = np.minimum(rows, max(len(self.ids) - 1, 0))
+        return rows[self.ids[rows] == song_ids] if len(self.ids) else rows[:0]
+
+
+def _signals_for(user_ids):
+    """Per user: {song_id: weight} and (favorite_genre, favorite_artist)"""
+    weights = {user_id: {} for user_id in user_ids}
+    rows = PlaylistSong.objects.filter(playlist__owner_id__in=user_ids).values_list('playlist__owner_id', 'song_id')
+    for user_id, song_id in rows.iterator(chunk_size=5000):
+        weights[user_id][song_id] = weights[user_id].get(song_id, 0.0) + PLAYLIST_WEIGHT
+    reviews = Review.objects.filter(user_id__in=user_ids).values_list('user_id', 'song_id', 'rating')
+    for user_id, song_id, rating in reviews.iterator(chunk_size=5000):
+        weights[user_id][song_id] = weights[user_id].get(song_id, 0.0) + (rating - 3) / 2
+    # Likes and skips on earlier recommendations nudge the taste vector
+    feedback = UserRecommendation.objects.filter(
+        user_id__in=user_ids, user_action__in=FEEDBACK_WEIGHTS
+    ).values_list('user_id', 'song_id', 'user_action')
+    for user_id, song_id, action in feedback.iterator(chunk_size=5000):
+        weights[user_id][song_id] = weights[user_id].get(song_id, 0.0) + FEEDBACK_WEIGHTS[action]
+    favorites = {
+        user_id: (genre.strip(), artist.strip())
+        for user_id, genre, artist in UserProfile.objects.filter(user_id__in=user_ids)
+        .values_list('user_id', 'favorite_genre', 'favorite_artist')
+    }
+    return weights, favorites
+
+
+def recommend_for_user(table, weights, favorite_genre='', favorite_artist='', k=50):
+    """[(song_id, score, reason)] for one user, best first"""
+    if not len(table.ids):
+        return []
+    genre_match = (table.genres == favorite_genre.lower()) if favorite_genre else None
+    artist_match = (np.char.find(table.artists, favorite_artist.lower()) >= 0) if favorite_artist else None
+
+    taste = np.zeros(table.unit.shape[1], dtype=np.float32)
+    if weights:
+        song_ids = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        rows = table.rows_for(song_ids)
+        by_id = dict(zip(song_ids.tolist(), weights.values()))
+        w = np.array([by_id[i] for i in table.ids[rows].tolist()], dtype=np.float32)
+        taste = (table.unit[rows] * w[:, None]).sum(axis=0)
+    if np.linalg.norm(taste) < 1e-6:
+        # No usable history: start from what their favorites sound like
+        liked = np.zeros(len(table.ids), dtype=bool)
+        for match in (genre_match, artist_match):
+            if match is not None:
+                liked |= match
+        if not liked.any():
+            return []
+        taste = table.unit[liked].mean(axis=0)
+    taste = taste / np.linalg.norm(taste)
+
+    scores = table.unit @ taste
+    if genre_match is not None:
+        scores = scores + GENRE_BOOST * genre_match
+    if artist_match is not None:
+        scores = scores + ARTIST_BOOST * artist_match
+    if weights:
+        scores[table.rows_for(weights.keys())] = -np.inf  # Already known
+
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+
+    results = []
+    for row in top.tolist():
+        if artist_match is not None and artist_match[row]:
+            reason = f"Because you like {favorite_artist}"
+        elif genre_match is not None and genre_match[row]:
+            reason = f"From your favorite genre, {favorite_genre}"
+        else:
+            reason = "Sounds like the songs in your playlists"
+        results.append((int(table.ids[row]), float(scores[row]), reason))
+    return results
+
+
+def process_users(user_ids, k=50, chunk_size=500, batch_size=1000):
+    """Recompute and store recommendations for ``user_ids``. Returns counters."""
+    table = SongTable()
+    stats = {'users': 0, 'rows': 0}
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        weights, favorites = _signals_for(chunk)
+        rows = []
+        for user_id in chunk:
+            genre, artist = favorites.get(user_id, ('', ''))
+            for song_id, score, reason in recommend_for_user(table, weights[user_id], genre, artist, k):
+                rows.append(UserRecommendation(
+                    user_id=user_id, song_id=song_id, score=round(score, 4), reason=reason,
+                ))
+        write_recommendations(chunk, rows, batch_size, for_modes=False)
+        stats['users'] += len(chunk)
+        stats['rows'] += len(rows)
+    return stats
+
+
+def _run_partition(user_ids, k, chunk_size, batch_size):
+    try:
+        return process_users(user_ids, k, chunk_size, batch_size)
+    finally:
+        connections.close_all()
+
+
+def mark_inputs_changed(user_ids):
+    """Have the next incremental run reprocess ``user_ids`` (ids or a values() queryset).
+
+    A queryset update, so the profile's ``updated_at`` and signals stay out of it.
+    """
+    UserProfile.objects.filter(user_id__in=user_ids).update(inputs_changed_at=timezone.now())
+
+
+def changed_user_ids(since):
+    """Users whose playlists, reviews or favorites changed after ``since``"""
+    return set(UserProfile.objects.filter(inputs_changed_at__gt=since).values_list('user_id', flat=True))
+
+
+def partition(user_ids, parts):
+    """Split sorted ``user_ids`` into up to ``parts`` contiguous id ranges"""
+    size = -(-len(user_ids) // max(parts, 1))
+    return [user_ids[i:i + size] for i in range(0, len(user_ids), size)] if user_ids else []
+
+
+def precompute_recommendations(workers=1, full=False, k=50, chunk_size=500, batch_size=1000):
+    """Refresh "For You" rows for every user that changed since the last run.
+
+    Returns counters for the run, which are also stored on the checkpoint.
+    """
+    started = time.perf_counter()
+    run_started_at = timezone.now()
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+
+    users = User.objects.filter(is_active=True)
+    if checkpoint.value and not full:
+        since = datetime.fromisoformat(checkpoint.value)
+        users = users.filter(id__in=changed_user_ids(since))
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+
+    if connection.vendor == 'sqlite':
+        workers = 1  # One writer at a time; parallel workers would only hit "database is locked"
+    stats = {'users': 0, 'rows': 0, 'partitions': 0, 'workers': workers, 'full': full or not checkpoint.value}
+    parts = partition(user_ids, workers * 4 if workers > 1 else 1)
+    stats['partitions'] = len(parts)
+    if workers > 1 and len(parts) > 1:
+        get_index()  # Load once here; forked workers share it
+        connections.close_all()  # Children must not inherit open connections
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = [pool.submit(_run_partition, part, k, chunk_size, batch_size) for part in parts]
+            for future in futures:
+                result = future.result()
+                stats['users'] += result['users']
+                stats['rows'] += result['rows']
+    else:
+        for part in parts:
+            result = process_users(part, k, chunk_size, batch_size)
+            stats['users'] += result['users']
+            stats['rows'] += result['rows']
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['users_per_second'] = round(stats['users'] / elapsed, 1) if elapsed else 0.0
+    checkpoint.value = run_started_at.isoformat()
+    checkpoint.stats = stats
+    checkpoint.save()
+    return stats
@@ -0,0 +1,60 @@
+"""Keep UserProfile.inputs_changed_at current for incremental precompute runs.
+
+Only writes that change what a user's "For You" rows are computed from
+count: songs added to or removed from their playlists, their reviews and
+their favorite genre/artist. Logging in saves the profile too, but that
+leaves the timestamp alone. Bulk writes send no signals, so code doing
+them calls ``precompute.mark_inputs_changed`` itself.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from accounts.models import UserProfile
+from playlists.models import Playlist, PlaylistSong, Review
+from .precompute import mark_inputs_changed
+
+
+def _cascade_from(origin, *models):
+    """Whether this delete is part of deleting one of ``models``"""
+    return isinstance(origin, models)
+
+
+@receiver(post_save, sender=PlaylistSong)
+@receiver(post_delete, sender=PlaylistSong)
+def playlist_song_changed(sender, instance, origin=None, **kwargs):
+    # Deleting the playlist or the user is handled once, below or not at all
+    if _cascade_from(origin, Playlist, User):
+        return
+    mark_inputs_changed(Playlist.objects.filter(pk=instance.playlist_id).values('owner_id'))
+
+
+@receiver(post_delete, sender=Playlist)
+def playlist_deleted(sender, instance, origin=None, **kwargs):
+    if not _cascade_from(origin, User):
+        mark_inputs_changed([instance.owner_id])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, origin=None, **kwargs):
+    if not _cascade_from(origin, User):
+        mark_inputs_changed([instance.user_id])
+
+
+def _favorites(profile):
+    # Read from __dict__ so a deferred field is not fetched just to remember it
+    return profile.__dict__.get('favorite_genre'), profile.__dict__.get('favorite_artist')
+
+
+@receiver(post_init, sender=UserProfile)
+def remember_favorites(sender, instance, **kwargs):
+    instance._saved_favorites = _favorites(instance)
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, created, **kwargs):
+    favorites = _favorites(instance)
+    if created or favorites != instance._saved_favorites:
+        mark_inputs_changed([instance.user_id])
+        instance._saved_favorites = favorites
@@ -0,0 +1,443 @@
+"""Spotify Web API access shared by the recommendation views"""
+import base64
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from playlists.catalog import ingest_tracks, ingestor
+
+from .breaker import breaker_metrics, get_breaker
+from .cache import response_cache, search_key
+from .exceptions import SpotifyAPIError, SpotifyThrottled, SpotifyUnavailable
+from .throttle import BACKGROUND, INTERACTIVE, RateLimiter, SharedLock, SingleFlight
+from .tracks import Track, dump_tracks, load_tracks
+
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+API_BASE = "https://api.spotify.com/v1"
+
+# Genres offered on the recommendations page
+VALID_GENRES = [
+    'pop', 'rock', 'hip-hop', 'electronic', 'jazz', 'classical', 
+    'country', 'r&b', 'indie', 'metal', 'punk', 'blues', 'reggae',
+    'folk', 'soul', 'funk', 'disco', 'house', 'techno', 'trance',
+    'edm', 'ambient', 'latin', 'reggaeton', 'k-pop', 'afrobeat'
+]
+
+# How long one worker may hold the refresh lock before others give up on it
+TOKEN_LOCK_TIMEOUT = 15
+# How long a worker waits for another worker's refresh when it has no usable token
+TOKEN_WAIT_SECONDS = 3
+
+
+class SpotifyTokenManager:
+    """Client-credentials token shared by every worker through the Django cache.
+
+    The token is kept until ``SPOTIFY_TOKEN_REFRESH_MARGIN`` seconds before it
+    expires. Inside that margin exactly one worker (whoever takes the SharedLock)
+    refreshes it while the others keep using the still-valid old token.
+    """
+
+    def __init__(self):
+        self._token = None  # process-local copy: {'access_token', 'expires_at'}
+        self._lock = threading.Lock()
+        self.stats = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'refreshes': 0,
+            'refresh_failures': 0,
+            'lock_waits': 0,
+        }
+
+    def _credentials(self):
+        client_id = getattr(settings, 'SPOTIFY_CLIENT_ID', None)
+        client_secret = getattr(settings, 'SPOTIFY_CLIENT_SECRET', None)
+        return client_id, client_secret
+
+    def _cache_key(self, client_id):
+        # Key on the client id so rotating credentials never serves an old token
+        digest = hashlib.sha1(client_id.encode()).hexdigest()[:12]
+        return f"spotify:token:{digest}"
+
+    def _usable(self, token, now, margin=0):
+        return bool(token) and token['expires_at'] - margin > now
+
+    def get_token(self):
+        """Return a valid access token, or None if Spotify is not configured"""
+        client_id, client_secret = self._credentials()
+        if not client_id or not client_secret:
+            return None
+
+        margin = getattr(settings, 'SPOTIFY_TOKEN_REFRESH_MARGIN', 300)
+        now = time.time()
+
+        if self._usable(self._token, now, margin):
+            self.stats['local_hits'] += 1
+            return self._token['access_token']
+
+        key = self._cache_key(client_id)
+        with self._lock:
+            shared = cache.get(key)
+            if self._usable(shared, now, margin):
+                self._token = shared
+                self.stats['shared_hits'] += 1
+                return shared['access_token']
+
+            # Only one worker refreshes; the rest carry on with the old token
+            lock = SharedLock(f"{key}:lock", TOKEN_LOCK_TIMEOUT)
+            if lock.acquire():
+                try:
+                    fresh = self._refresh(client_id, client_secret, key)
+                finally:
+                    lock.release()
+                if fresh:
+                    return fresh['access_token']
+
+            if self._usable(shared, now):
+                self._token = shared
+                self.stats['shared_hits'] += 1
+                return shared['access_token']
+
+        # No usable token at all: give the refreshing worker a moment. This
+        # worker's other threads stay free to find a token meanwhile.
+        self.stats['lock_waits'] += 1
+        deadline = time.time() + TOKEN_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.05)
+            shared = cache.get(key)
+            if self._usable(shared, time.time()):
+                self._token = shared
+                return shared['access_token']
+
+        # The other worker never delivered, fetch our own
+        with self._lock:
+            if self._usable(self._token, time.time()):
+                return self._token['access_token']
+            fresh = self._refresh(client_id, client_secret, key)
+            return fresh['access_token'] if fresh else None
+
+    def _refresh(self, client_id, client_secret, key):
+        token = self._request_token(client_id, client_secret)
+        if not token:
+            self.stats['refresh_failures'] += 1
+            return None
+        self.stats['refreshes'] += 1
+        cache.set(key, token, timeout=max(int(token['expires_at'] - time.time()), 1))
+        self._token = token
+        return token
+
+    def _request_token(self, client_id, client_secret):
+        credentials = f"{client_id}:{client_secret}"
+        credentials_b64 = base64.b64encode(credentials.encode()).decode()
+        headers = {
+            "Authorization": f"Basic {credentials_b64}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        data = {"grant_type": "client_credentials"}
+
+        try:
+            token_url = getattr(settings, 'SPOTIFY_TOKEN_URL', TOKEN_URL)
+            response = get_session().post(token_url, headers=headers, data=data, timeout=_latency_budget('token'))
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+
+        payload = response.json()
+        access_token = payload.get('access_token')
+        if not access_token:
+            return None
+        return {
+            'access_token': access_token,
+            'expires_at': time.time() + int(payload.get('expires_in', 3600)),
+        }
+
+    def invalidate(self):
+        """Drop the current token, e.g. after Spotify answered 401"""
+        client_id, _ = self._credentials()
+        self._token = None
+        if client_id:
+            cache.delete(self._cache_key(client_id))
+
+
+token_manager = SpotifyTokenManager()
+
+
+def get_spotify_token():
+    """Get Spotify API access token"""
+    return token_manager.get_token()
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+http_stats = {'requests': 0, 'token_retries': 0}
+
+
+def get_session():
+    """Keep-alive session for this worker process.
+
+    Connections to accounts.spotify.com and api.spotify.com are pooled so
+    consecutive calls skip the TCP and TLS handshakes. The session is rebuilt
+    after a fork so workers never share sockets.
+    """
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            pool_size = getattr(settings, 'SPOTIFY_POOL_SIZE', 10)
+            # Slow reads are not retried: they would blow the latency budget
+            # several times over, and the circuit breaker deals with them
+            retries = Retry(
+                total=getattr(settings, 'SPOTIFY_HTTP_RETRIES', 2),
+                read=0,
+                backoff_factor=0.2,
+                status_forcelist=[500, 502, 503, 504],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retries)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+
+rate_limiter = RateLimiter(
+    rate=getattr(settings, 'SPOTIFY_RATE_LIMIT', 10),
+    burst=getattr(settings, 'SPOTIFY_RATE_BURST', 20),
+)
+single_flight = SingleFlight()
+
+
+def _retry_after(response):
+    try:
+        return max(float(response.headers.get('Retry-After', 1)), 0.0)
+    except ValueError:
+        return 1.0
+
+
+def _latency_budget(endpoint):
+    budgets = getattr(settings, 'SPOTIFY_LATENCY_BUDGETS', {})
+    return budgets.get(endpoint, budgets.get('default', 10))
+
+
+def spotify_get(path, params=None, timeout=None, priority=INTERACTIVE):
+    """GET ``path`` from the Web API with the pooled session.
+
+    Returns the response, or None when Spotify is not configured. A 401 means
+    the shared token was revoked early, so it is dropped and the call retried once.
+    Every call takes a slot from the rate limiter first. Interactive calls
+    wait at most SPOTIFY_THROTTLE_MAX_WAIT seconds and raise SpotifyThrottled
+    after that, including when a 429 asks for a longer pause. Background calls
+    wait as long as needed.
+
+    Each endpoint ('search', 'tracks', ...) has its own circuit breaker and
+    latency budget. Timeouts, connection errors and 5xx answers count as
+    failures. An open circuit raises SpotifyUnavailable right away.
+    """
+    token = get_spotify_token()
+    if not token:
+        return None
+
+    endpoint = path.strip('/').split('/')[0]
+    breaker = get_breaker(endpoint)
+    if timeout is None:
+        timeout = _latency_budget(endpoint)
+
+    # The slot comes first: a call throttled here never takes the breaker's probe
+    max_wait = getattr(settings, 'SPOTIFY_THROTTLE_MAX_WAIT', 2) if priority == INTERACTIVE else None
+    rate_limiter.acquire(priority, timeout=max_wait)
+    probe = breaker.before_call()
+
+    api_base = getattr(settings, 'SPOTIFY_API_BASE', API_BASE)
+    url = f"{api_base.rstrip('/')}/{path.lstrip('/')}"
+    session = get_session()
+
+    def send(token):
+        http_stats['requests'] += 1
+        try:
+            response = session.get(url, headers={"Authorization": f"Bearer {token}"}, params=params, timeout=timeout)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise SpotifyUnavailable(endpoint)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    try:
+        response = send(token)
+        if response.status_code == 401:
+            token_manager.invalidate()
+            token = get_spotify_token()
+            if token:
+                http_stats['token_retries'] += 1
+                response = send(token)
+        if response.status_code == 429:
+            retry_after = _retry_after(response)
+            rate_limiter.block(retry_after)
+            if max_wait is not None and retry_after > max_wait:
+                raise SpotifyThrottled(retry_after)
+            rate_limiter.acquire(priority, timeout=max_wait)
+            response = send(token)
+    except BaseException:
+        if probe:
+            breaker.release_probe()
+        raise
+    return response
+
+
+def _get_json(path, params=None, priority=INTERACTIVE):
+    response = spotify_get(path, params=params, priority=priority)
+    if response is None:
+        raise SpotifyAPIError('not configured')
+    if response.status_code == 429:
+        rate_limiter.block(_retry_after(response))
+        raise SpotifyThrottled(_retry_after(response))
+    if response.status_code != 200:
+        raise SpotifyAPIError(response.status_code)
+    return response.json()
+
+
+def search_params(q='', genre='', year='', market='US', limit=20):
+    """Query string for /v1/search with the genre and year filters applied"""
+    search_query = q
+    if genre:
+        search_query = f"{search_query} genre:{genre}".strip()
+    if year:
+        search_query += f" year:{year}"
+    return {
+        "q": search_query,
+        "type": "track",
+        "limit": limit,
+        "market": market
+    }
+
+
+def fetch_search(q='', genre='', year='', market='US', limit=20, priority=INTERACTIVE):
+    """Search tracks on Spotify, bypassing the cache.
+
+    Returns a list of ``Track``.
+    """
+    params = search_params(q, genre, year, market, limit)
+    data = _get_json('search', params=params, priority=priority)
+    tracks = [Track.from_spotify(t) for t in data.get('tracks', {}).get('items', [])]
+    ingest_tracks(tracks, genre=genre)
+    return tracks
+
+
+def search_tracks(q='', genre='', year='', market='US', limit=20):
+    """Search tracks, served from the response cache when possible.
+
+    The cache holds tracks as rows (``Track.to_row``), not objects.
+    """
+    key = search_key(q, genre, year, market, limit)
+
+    def fetch(priority=INTERACTIVE):
+        return single_flight.do(key, lambda: dump_tracks(fetch_search(q, genre, year, market, limit, priority=priority)))
+
+    # Nobody waits on the refresh of a stale entry, so it yields to interactive calls
+    return load_tracks(response_cache.get_or_fetch(key, fetch, refresh=lambda: fetch(BACKGROUND)))
+
+
+def fetch_track(track_id, priority=INTERACTIVE):
+    """Look up a single track on Spotify, bypassing the cache"""
+    track = Track.from_spotify(_get_json(f'tracks/{track_id}', priority=priority))
+    ingest_tracks([track])
+    return track
+
+
+def get_track(track_id):
+    """Look up a single track, served from the response cache when possible"""
+    key = f'track:{track_id}'
+
+    def fetch(priority=INTERACTIVE):
+        return single_flight.do(key, lambda: fetch_track(track_id, priority=priority).to_row())
+
+    return Track.load(response_cache.get_or_fetch(key, fetch, refresh=lambda: fetch(BACKGROUND)))
+
+
+# Most ids Spotify accepts in one multi-id request
+AUDIO_FEATURES_BATCH = 100
+TRACKS_BATCH = 50
+
+
+def fetch_audio_features(track_ids, priority=BACKGROUND):
+    """Audio features for up to 100 tracks in one call, as {track id: features}.
+
+    Tracks Spotify has no features for are left out.
+    """
+    if len(track_ids) > AUDIO_FEATURES_BATCH:
+        raise ValueError(f"At most {AUDIO_FEATURES_BATCH} ids per audio-features call")
+    data = _get_json('audio-features', params={'ids': ','.join(track_ids)}, priority=priority)
+    return {f['id']: f for f in data.get('audio_features') or [] if f}
+
+
+def fetch_tracks(track_ids, priority=BACKGROUND):
+    """``Track`` objects for up to 50 tracks in one call, as {track id: track}"""
+    if len(track_ids) > TRACKS_BATCH:
+        raise ValueError(f"At most {TRACKS_BATCH} ids per tracks call")
+    data = _get_json('tracks', params={'ids': ','.join(track_ids)}, priority=priority)
+    return {t['id']: Track.from_spotify(t) for t in data.get('tracks') or [] if t}
+
+
+def cached_search(q='', genre='', year='', market='US', limit=20):
+    """Last known results for a search however old they are, or None.
+
+    Used to keep pages working while Spotify is unavailable.
+    """
+    rows = response_cache.get(search_key(q, genre, year, market, limit))
+    return None if rows is None else load_tracks(rows)
+
+
+def cached_track(track_id):
+    """Last known copy of a track however old it is, or None"""
+    row = response_cache.get(f'track:{track_id}')
+    return None if row is None else Track.load(row)
+
+
+def connection_stats():
+    """Requests sent versus connections opened by this worker's pool"""
+    opened = 0
+    pooled_requests = 0
+    if _session is not None and _session_pid == os.getpid():
+        # The same adapter is mounted for http and https
+        for adapter in {id(a): a for a in _session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                pooled_requests += pool.num_requests
+    return {
+        'requests': http_stats['requests'],
+        'token_retries': http_stats['token_retries'],
+        'connections_opened': opened,
+        'connections_reused': max(pooled_requests - opened, 0),
+    }
+
+
+def get_metrics():
+    """Counters for this worker process, for the status endpoint"""
+    return {
+        'pid': os.getpid(),
+        'token': dict(token_manager.stats),
+        'http': connection_stats(),
+        'cache': response_cache.metrics(),
+        'coalescing': dict(single_flight.stats),
+        'rate_limit': dict(rate_limiter.stats),
+        'breakers': breaker_metrics(),
+        'catalog': ingestor.metrics(),
+    }
@@ -0,0 +1,137 @@
+"""Minimal local stand-in for the Spotify Web API, for offline runs.
+
+Answers the token endpoint and the API paths the app uses with
+deterministic fake tracks, optionally after an artificial delay. Start it
+with ``python manage.py spotify_stub`` and point SPOTIFY_TOKEN_URL and
+SPOTIFY_API_BASE at it.
+
+Tests can also read the API paths it was asked for (``received``) and
+queue error statuses for the next calls (``failures``) on the server's
+handler class.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_track(track_id, hint=''):
+    """A track object shaped like Spotify's, derived from ``track_id``"""
+    digest = hashlib.sha1(track_id.encode()).hexdigest()
+    return {
+        'id': track_id,
+        'name': f"Track {digest[:6]}",
+        'artists': [{'id': f"artist{digest[6:10]}", 'name': f"Artist {digest[6:10]} {hint}".strip()}],
+        'album': {
+            'name': f"Album {digest[10:14]}",
+            'images': [{'url': f"https://i.scdn.co/image/{digest}", 'height': 640, 'width': 640}],
+        },
+        'duration_ms': 120000 + int(digest[14:18], 16),
+        'preview_url': None,
+        'explicit': False,
+        'external_urls': {'spotify': f"https://open.spotify.com/track/{track_id}"},
+        'available_markets': ['US'],
+    }
+
+
+def fake_audio_features(track_id):
+    """An audio-features object shaped like Spotify's, derived from ``track_id``"""
+    digest = hashlib.sha1(f"features:{track_id}".encode()).digest()
+    unit = [b / 255 for b in digest]
+    return {
+        'id': track_id,
+        'danceability': round(unit[0], 3),
+        'energy': round(unit[1], 3),
+        'valence': round(unit[2], 3),
+        'tempo': round(60 + unit[3] * 140, 3),
+        'acousticness': round(unit[4], 3),
+        'instrumentalness': round(unit[5], 3),
+        'liveness': round(unit[6], 3),
+        'speechiness': round(unit[7], 3),
+        'key': digest[8] % 12,
+        'mode': digest[9] % 2,
+        'duration_ms': 120000 + digest[10] * 500,
+    }
+
+
+class SpotifyStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0.0
+    retry_after = 1  # Sent with queued 429 answers
+    received = []  # Paths of the API calls answered, in order
+    failures = []  # Statuses to answer the next API calls with instead
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path.rstrip('/').endswith('/api/token'):
+            self._send_json({'access_token': 'stub-token', 'token_type': 'Bearer', 'expires_in': 3600})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.received.append(self.path)
+        try:
+            status = self.failures.pop(0)
+        except IndexError:
+            status = None
+        if status == 429:
+            self._send_json({'error': 'rate limited'}, status=429, headers={'Retry-After': str(self.retry_after)})
+            return
+        if status:
+            self._send_json({'error': 'unavailable'}, status=status)
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split('/') if p]
+
+        if parts[-1:] == ['search']:
+            q = query.get('q', [''])[0]
+            limit = int(query.get('limit', ['20'])[0])
+            seed = hashlib.sha1(q.encode()).hexdigest()[:8]
+            items = [fake_track(f"{seed}{i:04d}", hint=q) for i in range(limit)]
+            self._send_json({'tracks': {'items': items, 'total': limit}})
+        elif parts[-1:] == ['tracks'] and 'ids' in query:
+            ids = query['ids'][0].split(',')
+            self._send_json({'tracks': [fake_track(track_id) for track_id in ids]})
+        elif len(parts) >= 2 and parts[-2] == 'tracks':
+            self._send_json(fake_track(parts[-1]))
+        elif parts[-1:] == ['audio-features'] and 'ids' in query:
+            ids = query['ids'][0].split(',')
+            self._send_json({'audio_features': [fake_audio_features(track_id) for track_id in ids]})
+        elif len(parts) >= 2 and parts[-2] == 'audio-features':
+            self._send_json(fake_audio_features(parts[-1]))
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stub(host='127.0.0.1', port=8765, delay=0.0, background=False):
+    """Serve the stub; with ``background`` return the server running in a thread"""
+    handler = type('Handler', (SpotifyStubHandler,), {'delay': delay, 'received': [], 'failures': []})
+    server = ThreadingHTTPServer((host, port), handler)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,1184 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import httpx
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from playlists.catalog import track_from_song, upsert_songs
+from playlists.models import Playlist, PlaylistSong, Review, Song
+from playlists.search import search_songs
+from . import async_spotify, async_views, breaker, precompute, spotify
+from .backfill import backfill
+from .breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from .cache import ResponseCache, search_key
+from .engine import compute_mode_recommendations, mode_bands, mode_recommendations, score_modes, top_k
+from .exceptions import SpotifyAPIError, SpotifyThrottled, SpotifyUnavailable
+from .feedback import FeedbackBuffer, feedback_buffer, write_events
+from .models import GenreSnapshot, JobCheckpoint, RecommendationMode, UserRecommendation
+from .precompute import CHECKPOINT_NAME, changed_user_ids, precompute_recommendations
+from .stub import fake_audio_features, fake_track, run_stub
+from .throttle import BACKGROUND, INTERACTIVE, RateLimiter, SharedLock, SingleFlight
+from .tracks import Track, dump_tracks, load_tracks
+from .vector_index import FEATURES, FeatureIndex, feature_index
+from .views import interleave, parse_genres, parse_year
+
+
+# Tests get a cache of their own, so nothing carries over between runs
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'recommendations-tests'},
+}
+
+# The site's URLs with the async Spotify views in front, for AsyncViewTests
+urlpatterns = [
+    path('recommendations/', async_views.spotify_recommendations_view, name='recommendations'),
+    path('recommendations/spotify/search/', async_views.search_spotify_view, name='spotify_search'),
+    path('recommendations/spotify/similar/', async_views.spotify_similar_view, name='spotify_similar'),
+    path('', include('musicmatch.urls')),
+]
+
+
+class StubSpotifyMixin:
+    """Serves the Spotify stub (stub.py) for the test class and points the settings at it.
+
+    Every test starts with no token, an empty response cache and closed
+    circuit breakers.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stub = run_stub(port=0, background=True)
+        cls.addClassCleanup(cls.stub.server_close)
+        cls.addClassCleanup(cls.stub.shutdown)
+        base = f"http://127.0.0.1:{cls.stub.server_address[1]}"
+        cls.enterClassContext(override_settings(
+            CACHES=TEST_CACHES,
+            SPOTIFY_CLIENT_ID='stub-client',
+            SPOTIFY_CLIENT_SECRET='stub-secret',
+            SPOTIFY_TOKEN_URL=f"{base}/api/token",
+            SPOTIFY_API_BASE=f"{base}/v1",
+            SONG_CATALOG_ASYNC=False,
+        ))
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        spotify.token_manager._token = None
+        spotify.response_cache.clear()
+        breaker._breakers.clear()
+        handler = self.stub.RequestHandlerClass
+        handler.delay = 0.0
+        handler.retry_after = 0
+        handler.received.clear()
+        handler.failures.clear()
+
+
+class Clock:
+    """A monotonic clock the test moves by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(
+    CACHES=TEST_CACHES, SPOTIFY_CLIENT_ID='client', SPOTIFY_CLIENT_SECRET='secret', SPOTIFY_TOKEN_REFRESH_MARGIN=300,
+)
+class TokenManagerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = spotify.SpotifyTokenManager()
+        self.issued = 0
+        patcher = mock.patch.object(spotify.SpotifyTokenManager, '_request_token', autospec=True,
+                                    side_effect=self.issue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def issue(self, manager, client_id, client_secret, expires_in=3600):
+        self.issued += 1
+        return {'access_token': f"token-{self.issued}", 'expires_at': time.time() + expires_in}
+
+    def test_token_is_reused_until_the_refresh_margin(self):
+        self.assertEqual(self.manager.get_token(), 'token-1')
+        self.assertEqual(self.manager.get_token(), 'token-1')
+        self.assertEqual(self.manager.stats['local_hits'], 1)
+
+        # Inside the margin: still valid, but replaced
+        self.manager._token['expires_at'] = time.time() + 200
+        cache.clear()
+        self.assertEqual(self.manager.get_token(), 'token-2')
+        self.assertEqual(self.manager.stats['refreshes'], 2)
+
+    def test_other_workers_share_the_cached_token(self):
+        self.manager.get_token()
+        other = spotify.SpotifyTokenManager()
+        self.assertEqual(other.get_token(), 'token-1')
+        self.assertEqual(other.stats['shared_hits'], 1)
+        self.assertEqual(self.issued, 1)
+
+    def test_worker_inside_the_margin_keeps_the_old_token_while_another_refreshes(self):
+        self.manager.get_token()
+        shared = cache.get(self.manager._cache_key('client'))
+        shared['expires_at'] = time.time() + 200
+        cache.set(self.manager._cache_key('client'), shared)
+        cache.add(f"{self.manager._cache_key('client')}:lock", 'other worker')
+        other = spotify.SpotifyTokenManager()
+        self.assertEqual(other.get_token(), 'token-1')
+        self.assertEqual(self.issued, 1)
+
+    def test_waiting_for_another_worker_does_not_block_this_ones_threads(self):
+        key = self.manager._cache_key('client')
+        cache.add(f"{key}:lock", 'other worker')
+        tokens = []
+        waiter = threading.Thread(target=lambda: tokens.append(self.manager.get_token()))
+        waiter.start()
+        time.sleep(0.1)
+        self.assertTrue(self.manager._lock.acquire(timeout=0.5))
+        self.manager._lock.release()
+        cache.set(key, {'access_token': 'from-other-worker', 'expires_at': time.time() + 3600})
+        waiter.join()
+        self.assertEqual(tokens, ['from-other-worker'])
+        self.assertEqual(self.issued, 0)
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    """Answers every GET with an empty JSON object over keep-alive connections"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SessionTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        breaker._breakers.clear()
+        spotify._session = None
+        self.addCleanup(setattr, spotify, '_session', None)
+
+    def test_session_is_reused_until_the_process_forks(self):
+        session = spotify.get_session()
+        self.assertIs(spotify.get_session(), session)
+        with mock.patch('recommendations.spotify.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(spotify.get_session(), session)
+
+    def test_only_server_errors_are_retried(self):
+        retries = spotify.get_session().get_adapter(spotify.API_BASE).max_retries
+        self.assertEqual(retries.total, 2)
+        # Slow reads are left to the circuit breaker
+        self.assertEqual(retries.read, 0)
+        self.assertEqual(set(retries.status_forcelist), {500, 502, 503, 504})
+        self.assertFalse(retries.raise_on_status)
+
+    def test_connection_stats_count_reused_connections(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), OkHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        requests_before = spotify.http_stats['requests']
+        with self.settings(SPOTIFY_API_BASE=f"http://127.0.0.1:{server.server_address[1]}/v1"), \
+                mock.patch('recommendations.spotify.get_spotify_token', return_value='token'):
+            for _ in range(3):
+                self.assertEqual(spotify.spotify_get('tracks/abc').status_code, 200)
+        stats = spotify.connection_stats()
+        self.assertEqual(stats['requests'] - requests_before, 3)
+        self.assertEqual((stats['connections_opened'], stats['connections_reused']), (1, 2))
+
+    def test_401_drops_the_token_and_retries_once(self):
+        session = mock.Mock()
+        session.get.side_effect = [mock.Mock(status_code=401), mock.Mock(status_code=200)]
+        tokens = iter(['old', 'new'])
+        with mock.patch('recommendations.spotify.get_spotify_token', side_effect=lambda: next(tokens)), \
+                mock.patch.object(spotify.token_manager, 'invalidate') as invalidate, \
+                mock.patch('recommendations.spotify.get_session', return_value=session):
+            response = spotify.spotify_get('tracks/abc')
+        self.assertEqual(response.status_code, 200)
+        invalidate.assert_called_once_with()
+        sent = [call.kwargs['headers']['Authorization'] for call in session.get.call_args_list]
+        self.assertEqual(sent, ['Bearer old', 'Bearer new'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = Clock()
+        patcher = mock.patch('recommendations.breaker.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test-endpoint', failure_rate=0.5, min_calls=4, window=30, cooldown=10)
+
+    def trip(self):
+        for _ in range(4):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_once_failure_rate_is_reached(self):
+        for ok in (True, False, True):
+            self.breaker.before_call()
+            self.breaker.record_success() if ok else self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+        with self.assertRaises(SpotifyUnavailable):
+            self.breaker.before_call()
+
+    def test_successful_probe_closes(self):
+        self.trip()
+        self.clock.now += 10
+        self.assertTrue(self.breaker.before_call())
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        # Only the probe goes through until it has an answer
+        with self.assertRaises(SpotifyUnavailable):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertFalse(self.breaker.before_call())
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.clock.now += 10
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertEqual(self.breaker.stats['opened'], 2)
+        with self.assertRaises(SpotifyUnavailable):
+            self.breaker.before_call()
+
+    def test_released_probe_lets_the_next_call_probe(self):
+        self.trip()
+        self.clock.now += 10
+        self.breaker.before_call()
+        self.breaker.release_probe()
+        self.assertTrue(self.breaker.before_call())
+
+    def test_lost_probe_expires_after_cooldown(self):
+        self.trip()
+        self.clock.now += 10
+        self.breaker.before_call()
+        self.clock.now += 9
+        with self.assertRaises(SpotifyUnavailable):
+            self.breaker.before_call()
+        self.clock.now += 1
+        self.assertTrue(self.breaker.before_call())
+
+
+@override_settings(CACHES=TEST_CACHES, SPOTIFY_API_BASE='http://spotify.invalid/v1')
+class AbortedProbeTests(SimpleTestCase):
+    """spotify_get gives the probe back when the call ends without an answer"""
+
+    def setUp(self):
+        cache.clear()
+        self.clock = Clock()
+        self.breaker = CircuitBreaker('tracks', min_calls=1, cooldown=10)
+        patches = [
+            mock.patch('recommendations.breaker.time.monotonic', self.clock),
+            mock.patch('recommendations.spotify.get_breaker', return_value=self.breaker),
+            mock.patch('recommendations.spotify.get_spotify_token', return_value='token'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.breaker.record_failure()
+        self.clock.now += 10
+
+    def test_throttled_call_never_takes_the_probe(self):
+        with mock.patch.object(spotify.rate_limiter, 'acquire', side_effect=SpotifyThrottled(5)):
+            with self.assertRaises(SpotifyThrottled):
+                spotify.spotify_get('tracks/abc')
+        self.assertTrue(self.breaker.before_call())
+
+    def test_interrupted_probe_is_released(self):
+        session = mock.Mock()
+        session.get.side_effect = KeyboardInterrupt
+        with mock.patch.object(spotify.rate_limiter, 'acquire'), \
+                mock.patch('recommendations.spotify.get_session', return_value=session):
+            with self.assertRaises(KeyboardInterrupt):
+                spotify.spotify_get('tracks/abc')
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        self.assertTrue(self.breaker.before_call())
+
+
+class GenreSnapshotTests(StubSpotifyMixin, TestCase):
+    """warm_genre_pages against the stub, and the pages served from its snapshots"""
+
+    def warm(self, *genres):
+        out = StringIO()
+        args = [arg for genre in genres for arg in ('--genre', genre)]
+        call_command('warm_genre_pages', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_warm_stores_a_snapshot_per_genre(self):
+        output = self.warm('jazz', 'soul')
+        self.assertIn('Warmed 2 genre pages', output)
+        snapshots = {s.genre: s for s in GenreSnapshot.objects.all()}
+        self.assertEqual(set(snapshots), {'jazz', 'soul'})
+        self.assertEqual(len(snapshots['jazz'].tracks), 20)
+        self.assertEqual(snapshots['jazz'].year, '')
+
+    def test_refresh_replaces_the_snapshot_and_reports_its_age(self):
+        self.warm('jazz')
+        first = GenreSnapshot.objects.get(genre='jazz')
+        GenreSnapshot.objects.filter(pk=first.pk).update(fetched_at=first.fetched_at - timedelta(minutes=5))
+        output = self.warm('jazz')
+        self.assertRegex(output, r'jazz: 20 tracks in \d+ ms \(was 30\ds old\)')
+        self.assertEqual(GenreSnapshot.objects.count(), 1)
+        self.assertGreater(GenreSnapshot.objects.get(genre='jazz').fetched_at, first.fetched_at)
+
+    def test_refresh_time_is_recorded(self):
+        self.stub.RequestHandlerClass.delay = 0.05
+        self.warm('jazz')
+        self.assertGreaterEqual(GenreSnapshot.objects.get(genre='jazz').refresh_ms, 50)
+
+    def test_page_is_served_from_a_fresh_snapshot(self):
+        self.warm('jazz')
+        GenreSnapshot.objects.update(fetched_at=timezone.now() - timedelta(hours=2))
+        self.client.force_login(User.objects.create_user('listener'))
+        requests_before = spotify.http_stats['requests']
+        response = self.client.get(reverse('recommendations'), {'genre': 'jazz'})
+        self.assertEqual(spotify.http_stats['requests'], requests_before)
+        self.assertEqual(len(response.context['spotify_tracks']), 20)
+        self.assertContains(response, 'Updated 2\xa0hours ago')
+
+    @override_settings(SPOTIFY_SNAPSHOT_MAX_AGE=60)
+    def test_old_snapshot_is_not_served(self):
+        self.warm('jazz')
+        GenreSnapshot.objects.update(fetched_at=timezone.now() - timedelta(minutes=2))
+        self.client.force_login(User.objects.create_user('listener'))
+        requests_before = spotify.http_stats['requests']
+        response = self.client.get(reverse('recommendations'), {'genre': 'jazz'})
+        self.assertEqual(spotify.http_stats['requests'], requests_before + 1)
+        self.assertNotIn('snapshot_fetched_at', response.context)
+        self.assertEqual(len(response.context['spotify_tracks']), 20)
+
+    def test_status_reports_snapshot_age_and_slowest_refresh(self):
+        self.stub.RequestHandlerClass.delay = 0.05
+        self.warm('jazz', 'soul')
+        GenreSnapshot.objects.filter(genre='soul').update(fetched_at=timezone.now() - timedelta(minutes=10))
+        self.client.force_login(User.objects.create_superuser('staff', password='pw'))
+        snapshots = self.client.get(reverse('spotify_status')).json()['snapshots']
+        self.assertEqual(snapshots['count'], 2)
+        self.assertIn(snapshots['oldest_age_seconds'], range(600, 610))
+        self.assertGreaterEqual(snapshots['slowest_refresh_ms'], 50)
+
+
+class SharedLockTests(SimpleTestCase):
+    def test_cache_lock(self):
+        with self.settings(CACHES=TEST_CACHES):
+            cache.clear()
+            self.check_exclusive()
+
+    def test_file_lock_with_file_based_cache(self):
+        directory = self.enterContext(TemporaryDirectory())
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+        with self.settings(CACHES=file_cache):
+            self.check_exclusive()
+            # flock, not the cache's add, which FileBasedCache does not do atomically
+            self.assertIsNone(cache.get('spotify:test:lock'))
+
+    def test_each_key_has_a_lock_file_of_its_own(self):
+        directory = self.enterContext(TemporaryDirectory())
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+        with self.settings(CACHES=file_cache):
+            first, other = SharedLock('spotify:test:lock', 5), SharedLock('spotify:other:lock', 5)
+            self.assertTrue(first.acquire())
+            self.assertTrue(other.acquire())
+            self.assertEqual(len(os.listdir(os.path.join(directory, 'locks'))), 2)
+            first.release()
+            other.release()
+            self.assertEqual(os.listdir(os.path.join(directory, 'locks')), [])
+
+    def check_exclusive(self):
+        first, second = SharedLock('spotify:test:lock', 5), SharedLock('spotify:test:lock', 5)
+        self.assertTrue(first.acquire())
+        self.assertTrue(second.locked())
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertFalse(second.locked())
+        self.assertTrue(second.acquire())
+        second.release()
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('recommendations.cache.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ResponseCache(ttl=10, stale_ttl=60, max_bytes=1024)
+
+    def test_fresh_entry_is_served_without_fetching(self):
+        self.assertEqual(self.cache.get_or_fetch('k', lambda: ['v1']), ['v1'])
+        self.clock.now += 9
+        self.assertEqual(self.cache.get_or_fetch('k', lambda: ['v2']), ['v1'])
+        self.assertEqual((self.cache.stats['misses'], self.cache.stats['hits']), (1, 1))
+
+    def test_stale_entry_is_served_while_one_refresh_runs(self):
+        self.cache.get_or_fetch('k', lambda: ['v1'])
+        self.clock.now += 11
+        release = threading.Event()
+        fetches = []
+
+        def slow_fetch():
+            fetches.append(1)
+            release.wait(5)
+            return ['v2']
+
+        self.assertEqual(self.cache.get_or_fetch('k', slow_fetch), ['v1'])
+        self.assertEqual(self.cache.get_or_fetch('k', slow_fetch), ['v1'])
+        release.set()
+        self.wait_for_refresh()
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(self.cache.stats['stale_hits'], 2)
+        self.assertEqual(self.cache.get_or_fetch('k', lambda: ['v3']), ['v2'])
+
+    def test_entry_past_the_stale_window_is_a_miss(self):
+        self.cache.get_or_fetch('k', lambda: ['v1'])
+        self.clock.now += 71
+        self.assertEqual(self.cache.get_or_fetch('k', lambda: ['v2']), ['v2'])
+        self.assertEqual(self.cache.stats['misses'], 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key in 'abc':
+            self.cache.set(key, 'x' * 400)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(self.cache.stats['evictions'], 1)
+
+    def test_stale_entry_is_refreshed_in_the_background_at_background_priority(self):
+        fetch_search = self.enterContext(mock.patch.object(spotify, 'fetch_search', return_value=[Track('a')]))
+        self.enterContext(mock.patch.object(spotify, 'response_cache', self.cache))
+        self.enterContext(self.settings(CACHES=TEST_CACHES))
+        cache.clear()
+        spotify.search_tracks(q='blue')
+        self.clock.now += 11
+        cache.clear()  # Past the single-flight result's lifetime too
+        spotify.search_tracks(q='blue')
+        self.wait_for_refresh()
+        priorities = [call.kwargs['priority'] for call in fetch_search.call_args_list]
+        self.assertEqual(priorities, [INTERACTIVE, BACKGROUND])
+
+    def wait_for_refresh(self):
+        for _ in range(100):
+            if self.cache.stats['background_refreshes'] or self.cache.stats['refresh_errors']:
+                return
+            time.sleep(0.01)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsyncSpotifyTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        breaker._breakers.clear()
+
+    def test_one_refresh_task_per_stale_key(self):
+        clock = Clock()
+        response_cache = ResponseCache(ttl=10, stale_ttl=60, max_bytes=1024)
+        self.enterContext(mock.patch('recommendations.cache.time.monotonic', clock))
+        self.enterContext(mock.patch.object(spotify, 'response_cache', response_cache))
+        response_cache.set('k', ['v1'])
+        clock.now += 11
+
+        async def run():
+            release = asyncio.Event()
+            fetches = []
+
+            async def fetch():
+                fetches.append(1)
+                await release.wait()
+                return ['v2']
+
+            first = await async_spotify._cached('k', fetch)
+            second = await async_spotify._cached('k', fetch)
+            refreshes = async_spotify._refreshes[asyncio.get_running_loop()]
+            tasks = list(refreshes.values())
+            release.set()
+            await asyncio.gather(*tasks)
+            return first, second, len(tasks), len(fetches), dict(refreshes)
+
+        first, second, tasks, fetches, left = asyncio.run(run())
+        self.assertEqual((first, second), (['v1'], ['v1']))
+        self.assertEqual((tasks, fetches), (1, 1))
+        self.assertEqual(left, {})
+        self.assertEqual(response_cache.get('k'), ['v2'])
+
+    def test_401_drops_the_token_and_retries_once(self):
+        sent = []
+
+        def handler(request):
+            sent.append(request.headers['Authorization'])
+            return httpx.Response(401 if len(sent) == 1 else 200, json={'id': 'abc'})
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            with mock.patch.object(async_spotify, 'get_client', return_value=client):
+                return await async_spotify.aspotify_get_json('tracks/abc')
+
+        tokens = iter(['old', 'new'])
+        with mock.patch('recommendations.spotify.get_spotify_token', side_effect=lambda: next(tokens)), \
+                mock.patch.object(spotify.token_manager, 'invalidate') as invalidate:
+            self.assertEqual(asyncio.run(run()), {'id': 'abc'})
+        invalidate.assert_called_once_with()
+        self.assertEqual(sent, ['Bearer old', 'Bearer new'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_burst_then_throttled(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        limiter.acquire(timeout=0)
+        limiter.acquire(timeout=0)
+        with self.assertRaises(SpotifyThrottled):
+            limiter.acquire(timeout=0.1)
+        self.assertEqual(limiter.stats['throttled'], 1)
+
+    def test_slots_refill_over_time(self):
+        limiter = RateLimiter(rate=50, burst=1)
+        limiter.acquire(timeout=0)
+        started = time.monotonic()
+        limiter.acquire(timeout=1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.015)
+
+    def test_retry_after_blocks_every_worker(self):
+        RateLimiter(rate=10, burst=10).block(5)
+        other = RateLimiter(rate=10, burst=10)
+        with self.assertRaises(SpotifyThrottled):
+            other.acquire(timeout=1)
+        self.assertEqual(other.stats['acquired'], 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats['coalesced_local'], 4)
+
+    def test_other_workers_reuse_a_fresh_result(self):
+        SingleFlight().do('k', lambda: 'first')
+        other = SingleFlight()
+        self.assertEqual(other.do('k', lambda: 'second'), 'first')
+        self.assertEqual(other.stats['coalesced_shared'], 1)
+
+    def test_errors_reach_every_caller_and_are_not_kept(self):
+        flight = SingleFlight()
+        with self.assertRaises(SpotifyAPIError):
+            flight.do('k', mock.Mock(side_effect=SpotifyAPIError(503)))
+        self.assertEqual(flight.do('k', lambda: 'retried'), 'retried')
+
+
+class BackfillTests(StubSpotifyMixin, TestCase):
+    """backfill() filling audio features from the stub's multi-id endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.songs = Song.objects.bulk_create([
+            Song(spotify_id=f"backfill{i:04d}", name=f"Song {i}", artist="Artist") for i in range(250)
+        ])
+        # Already filled in: never asked about
+        self.filled = self.songs[::10]
+        Song.objects.filter(id__in=[s.id for s in self.filled]).update(danceability=0.5, energy=0.5, tempo=120)
+
+    def requested_ids(self):
+        paths = [p for p in self.stub.RequestHandlerClass.received if '/audio-features' in p]
+        return [p.split('ids=')[1].split('&')[0].split('%2C') for p in paths]
+
+    def test_fills_missing_features_100_ids_per_call(self):
+        stats = backfill(workers=2)
+        self.assertEqual([len(ids) for ids in self.requested_ids()], [100, 100, 25])
+        self.assertEqual(stats['updated'], 225)
+        self.assertIsNone(stats['stopped'])
+        song = Song.objects.get(id=self.songs[1].id)
+        self.assertEqual(song.danceability, fake_audio_features(song.spotify_id)['danceability'])
+        self.assertEqual(song.tempo, fake_audio_features(song.spotify_id)['tempo'])
+
+    def test_filled_songs_are_skipped(self):
+        backfill(workers=2)
+        requested = {i for ids in self.requested_ids() for i in ids}
+        self.assertFalse(requested & {s.spotify_id for s in self.filled})
+        self.assertEqual(Song.objects.get(id=self.filled[0].id).valence, None)
+        # A second run finds nothing left to do
+        self.stub.RequestHandlerClass.received.clear()
+        self.assertEqual(backfill(workers=2, restart=True)['songs'], 0)
+        self.assertEqual(self.requested_ids(), [])
+
+    def test_429_waits_and_retries(self):
+        self.stub.RequestHandlerClass.failures.append(429)
+        stats = backfill(workers=1)
+        self.assertIsNone(stats['stopped'])
+        self.assertEqual(stats['updated'], 225)
+        self.assertEqual(len(self.requested_ids()), 4)
+
+    def test_single_5xx_is_retried(self):
+        self.stub.RequestHandlerClass.failures.append(502)
+        stats = backfill(workers=1)
+        self.assertIsNone(stats['stopped'])
+        self.assertEqual(stats['updated'], 225)
+
+    def test_persistent_5xx_stops_and_resumes_from_the_checkpoint(self):
+        # The first page goes through; the second call fails every retry
+        self.stub.RequestHandlerClass.failures.extend([None, 503, 503, 503])
+        stats = backfill(workers=1, calls_per_page=1)
+        self.assertIsNotNone(stats['stopped'])
+        self.assertEqual(stats['updated'], 100)
+        missing = [s for s in self.songs if s not in self.filled]
+        checkpoint = JobCheckpoint.objects.get(name='backfill_audio_features')
+        self.assertEqual(int(checkpoint.value), missing[99].id)
+
+        stats = backfill(workers=1, calls_per_page=1)
+        self.assertIsNone(stats['stopped'])
+        self.assertEqual(stats['updated'], 125)
+        self.assertFalse(Song.objects.filter(danceability__isnull=True).exists())
+
+
+class CatalogTests(StubSpotifyMixin, TestCase):
+    def test_upsert_inserts_and_updates_by_spotify_id(self):
+        Song.objects.create(spotify_id='a', name='Old name', artist='Artist', genre='jazz')
+        written = upsert_songs([
+            Song(spotify_id='a', name='New name', artist='Artist', album='Album', genre='rock'),
+            Song(spotify_id='b', name='First', artist='Someone', genre='soul'),
+            Song(spotify_id='b', name='Second', artist='Someone', genre='soul'),
+            Song(spotify_id='', name='No id', artist='Nobody'),
+        ])
+        self.assertEqual(written, 2)
+        songs = {s.spotify_id: s for s in Song.objects.all()}
+        self.assertEqual(set(songs), {'a', 'b'})
+        self.assertEqual((songs['a'].name, songs['a'].album), ('New name', 'Album'))
+        # A stored genre is kept; a blank one is filled
+        self.assertEqual(songs['a'].genre, 'jazz')
+        self.assertEqual((songs['b'].name, songs['b'].genre), ('Second', 'soul'))
+
+    def test_track_from_song_keeps_commas_in_artist_names(self):
+        track = track_from_song(Song(spotify_id='t', name='EARFQUAKE', artist='Tyler, The Creator'))
+        self.assertEqual(track.artists, ('Tyler, The Creator',))
+        self.assertEqual(track.first_artist, 'Tyler, The Creator')
+        self.assertEqual(track_from_song(Song(spotify_id='u', name='Untitled', artist='')).artists, ())
+
+    def test_search_ranks_catalog_matches(self):
+        upsert_songs([
+            Song(spotify_id='1', name='Blue in Green', artist='Miles Davis', album='Kind of Blue'),
+            Song(spotify_id='2', name='So What', artist='Miles Davis', album='Kind of Blue'),
+            Song(spotify_id='3', name='Bluebird', artist='Charlie Parker'),
+            Song(spotify_id='4', name='Yellow', artist='Coldplay'),
+        ])
+        self.assertEqual([s.spotify_id for s in search_songs('blue in')], ['1'])
+        # The last word matches as a prefix
+        self.assertEqual({s.spotify_id for s in search_songs('blue')}, {'1', '2', '3'})
+        self.assertEqual([s.spotify_id for s in search_songs('  coldplay ')], ['4'])
+        self.assertEqual(search_songs('   '), [])
+
+    def test_genre_search_results_land_in_the_catalog(self):
+        tracks = spotify.search_tracks(genre='jazz')
+        songs = Song.objects.filter(spotify_id__in=[t.id for t in tracks])
+        self.assertEqual(songs.count(), len(tracks))
+        self.assertEqual(set(songs.values_list('genre', flat=True)), {'jazz'})
+
+
+class TrackTests(SimpleTestCase):
+    def test_row_round_trip(self):
+        track = Track.from_spotify(fake_track('abc'))
+        self.assertEqual(Track.from_row(track.to_row()), track)
+        # Cached rows come back from JSON as lists
+        rows = json.loads(json.dumps(dump_tracks([track])))
+        self.assertEqual(load_tracks(rows), [track])
+        self.assertEqual(Track.load(fake_track('abc')), track)
+
+    def test_equal_tracks_hash_alike(self):
+        track = Track.from_spotify(fake_track('abc'))
+        copy = Track.from_row(track.to_row())
+        self.assertEqual(hash(track), hash(copy))
+        self.assertEqual(len({track, copy, Track('other')}), 2)
+
+    def test_from_spotify_keeps_only_what_the_pages_use(self):
+        track = Track.from_spotify(fake_track('abc'))
+        self.assertEqual(track.id, 'abc')
+        self.assertEqual(len(track.artists), 1)
+        self.assertTrue(track.image_url.startswith('https://i.scdn.co/image/'))
+        self.assertFalse(hasattr(track, '__dict__'))
+
+
+class FeatureIndexTests(TestCase):
+    """The index follows songs added and features edited after it was built"""
+
+    def setUp(self):
+        self.songs = [self.song('a', 0.1), self.song('b', 0.5), self.song('c', 0.9)]
+        self.index = FeatureIndex()
+        self.index.rebuild()
+
+    def song(self, spotify_id, level):
+        return Song.objects.create(
+            spotify_id=spotify_id, name=spotify_id, artist='Artist',
+            **{name: level * (250 if name == 'tempo' else 1) for name in FEATURES},
+        )
+
+    def nearest_to(self, spotify_id):
+        (song_id, _), *_ = self.index.similar(spotify_id, k=1, metric='euclidean')
+        return Song.objects.get(id=song_id).spotify_id
+
+    def test_new_songs_are_appended(self):
+        self.assertEqual(self.nearest_to('a'), 'b')
+        self.song('d', 0.15)
+        self.index.refresh()
+        self.assertEqual(self.nearest_to('a'), 'd')
+        self.assertEqual(self.index.stats['rebuilds'], 1)
+        np.testing.assert_allclose(np.linalg.norm(self.index.unit, axis=1), 1.0, rtol=1e-6)
+
+    def test_edited_features_are_picked_up(self):
+        self.assertEqual(self.nearest_to('a'), 'b')
+        # A bulk UPDATE sends no post_save, as another worker's edit would not either
+        Song.objects.filter(spotify_id='c').update(**{name: 0.12 for name in FEATURES if name != 'tempo'}, tempo=30)
+        self.index.refresh()
+        self.assertEqual(self.nearest_to('a'), 'c')
+        self.assertEqual(self.index.stats['rebuilds'], 2)
+
+    def test_checksum_sees_a_one_in_a_million_edit(self):
+        Song.objects.filter(spotify_id='a').update(valence=0.100001)
+        self.index.refresh()
+        self.assertEqual(self.index.stats['rebuilds'], 2)
+
+    def test_songs_losing_features_are_dropped(self):
+        Song.objects.filter(spotify_id='b').update(energy=None)
+        self.index.refresh()
+        self.assertIsNone(self.index.similar('b'))
+        self.assertEqual(self.nearest_to('a'), 'c')
+
+    def test_unchanged_songs_are_not_reread(self):
+        self.index.refresh()
+        self.assertEqual(self.index.stats['rebuilds'], 1)
+        self.assertEqual(len(self.index), 3)
+
+    def test_snapshot_keeps_its_version(self):
+        path = self.enterContext(TemporaryDirectory())
+        self.index.save(path)
+        loaded = FeatureIndex()
+        loaded.load(path)
+        loaded.refresh()
+        self.assertEqual(loaded.stats['rebuilds'], 0)
+        Song.objects.filter(spotify_id='a').update(valence=0.7)
+        loaded.refresh()
+        self.assertEqual(loaded.stats['rebuilds'], 1)
+
+    def test_snapshot_memory_maps_the_normalized_vectors(self):
+        path = self.enterContext(TemporaryDirectory())
+        self.index.save(path)
+        loaded = FeatureIndex()
+        loaded.load(path)
+        self.assertIsInstance(loaded.unit, np.memmap)
+        self.assertEqual(loaded.similar('a'), self.index.similar('a'))
+
+
+class EngineScoringTests(SimpleTestCase):
+    def test_open_bounds_become_0_and_1(self):
+        mode = RecommendationMode(name='workout', min_energy=0.6, max_danceability=0.8)
+        low, high = mode_bands([mode])
+        np.testing.assert_allclose(low, [[0.0, 0.6, 0.0]])
+        np.testing.assert_allclose(high, [[0.8, 1.0, 1.0]])
+
+    def test_scores_are_1_at_the_centre_0_at_the_edge_and_out_of_band_excluded(self):
+        low = np.array([[0.2, 0.2, 0.2]], dtype=np.float32)
+        high = np.array([[0.6, 0.6, 0.6]], dtype=np.float32)
+        features = np.array([[0.4, 0.4, 0.4], [0.6, 0.6, 0.6], [0.4, 0.4, 0.7]], dtype=np.float32)
+        scores = score_modes(features, low, high)
+        np.testing.assert_allclose(scores[0, :2], [1.0, 0.0], atol=1e-6)
+        self.assertEqual(scores[0, 2], -np.inf)
+
+    def test_top_k_skips_excluded_songs(self):
+        ranked = np.array([2, 0, 1, 3])
+        song_ids = np.array([10, 11, 12, 13])
+        self.assertEqual(list(top_k(ranked, song_ids, {12}, 2)), [0, 1])
+
+
+class ModeRecommendationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('runner', password='pw')
+        self.songs = {level: self.song(level) for level in (0.8, 0.85, 0.95, 0.2)}
+        playlist = Playlist.objects.create(name='Mine', owner=self.user)
+        PlaylistSong.objects.create(playlist=playlist, song=self.songs[0.85])
+        self.workout = RecommendationMode.objects.get(name='workout')
+        feature_index.rebuild()
+
+    def song(self, level):
+        return Song.objects.create(
+            spotify_id=f'song-{level}', name=str(level), artist='Artist',
+            **{name: level * (250 if name == 'tempo' else 1) for name in FEATURES},
+        )
+
+    def test_top_songs_in_band_are_stored_without_the_users_own(self):
+        stats = compute_mode_recommendations(k=5)
+        self.assertEqual((stats['users'], stats['songs']), (1, 4))
+        rows = mode_recommendations(self.user, self.workout)
+        self.assertEqual({r.song for r in rows}, {self.songs[0.8], self.songs[0.95]})
+        self.assertEqual([r.score for r in rows], sorted((r.score for r in rows), reverse=True))
+
+    def test_rows_the_user_acted_on_survive_a_recompute(self):
+        compute_mode_recommendations(k=5)
+        liked = mode_recommendations(self.user, self.workout)[0]
+        liked.user_action = 'liked'
+        liked.save()
+        compute_mode_recommendations(k=5)
+        self.assertTrue(self.user.recommendations.filter(id=liked.id, user_action='liked').exists())
+
+
+class PrecomputeTests(TestCase):
+    """Incremental "For You" runs pick up exactly the users whose inputs changed"""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'user{i}', password='pw') for i in range(3)]
+        self.songs = [self.song(i, level) for i, level in enumerate((0.1, 0.3, 0.5, 0.7, 0.9))]
+        self.playlists = []
+        for user, song in zip(self.users, self.songs):
+            playlist = Playlist.objects.create(name='Mine', owner=user)
+            PlaylistSong.objects.create(playlist=playlist, song=song)
+            self.playlists.append(playlist)
+        feature_index.rebuild()
+        self.first_run = precompute_recommendations()
+        self.since = timezone.now()
+
+    def song(self, i, level):
+        return Song.objects.create(
+            spotify_id=f'song-{i}', name=f'Song {i}', artist=f'Artist {i}',
+            **{name: (level if n % 2 else 1 - level) * (250 if name == 'tempo' else 1) for n, name in enumerate(FEATURES)},
+        )
+
+    def test_first_run_covers_everyone(self):
+        self.assertEqual((self.first_run['users'], self.first_run['full']), (3, True))
+        self.assertTrue(self.users[0].recommendations.filter(mode__isnull=True).exists())
+
+    def test_logging_in_does_not_mark_a_user_changed(self):
+        self.assertTrue(self.client.login(username='user0', password='pw'))
+        self.users[1].profile.save()
+        self.assertEqual(changed_user_ids(self.since), set())
+        self.assertEqual(precompute_recommendations()['users'], 0)
+
+    def test_playlist_review_and_favorite_changes_mark_their_user(self):
+        PlaylistSong.objects.create(playlist=self.playlists[0], song=self.songs[3])
+        self.assertEqual(changed_user_ids(self.since), {self.users[0].id})
+        Review.objects.create(user=self.users[1], song=self.songs[4], rating=5)
+        profile = self.users[2].profile
+        profile.favorite_genre = 'jazz'
+        profile.save()
+        self.assertEqual(changed_user_ids(self.since), {user.id for user in self.users})
+
+    def test_removing_songs_and_playlists_marks_the_owner(self):
+        PlaylistSong.objects.filter(playlist=self.playlists[0]).delete()
+        self.playlists[1].delete()
+        self.assertEqual(changed_user_ids(self.since), {self.users[0].id, self.users[1].id})
+
+    def test_incremental_run_recomputes_only_changed_users(self):
+        untouched = set(self.users[1].recommendations.values_list('id', flat=True))
+        added = self.users[0].recommendations.filter(mode__isnull=True).first().song
+        PlaylistSong.objects.create(playlist=self.playlists[0], song=added)
+        stats = precompute_recommendations()
+        self.assertEqual((stats['users'], stats['full']), (1, False))
+        self.assertFalse(self.users[0].recommendations.filter(song=added, mode__isnull=True).exists())
+        self.assertEqual(set(self.users[1].recommendations.values_list('id', flat=True)), untouched)
+
+    def test_partitions_run_in_a_process_pool(self):
+        parent = os.getpid()
+
+        def process_users(user_ids, *args):
+            # Runs in a forked worker, which inherits this patch
+            return {'users': len(user_ids), 'rows': int(os.getpid() != parent)}
+
+        self.enterContext(mock.patch.object(connection, 'vendor', 'postgresql'))
+        self.enterContext(mock.patch.object(precompute, 'process_users', process_users))
+        stats = precompute_recommendations(workers=2, full=True)
+        self.assertEqual((stats['users'], stats['workers'], stats['partitions']), (3, 2, 3))
+        # Every partition reported from a process of its own
+        self.assertEqual(stats['rows'], 3)
+
+    def test_failed_run_leaves_the_checkpoint_for_the_next_one(self):
+        checkpoint = JobCheckpoint.objects.get(name=CHECKPOINT_NAME).value
+        Review.objects.create(user=self.users[0], song=self.songs[4], rating=1)
+        with mock.patch.object(precompute, 'process_users', side_effect=RuntimeError('worker died')):
+            with self.assertRaises(RuntimeError):
+                precompute_recommendations()
+        self.assertEqual(JobCheckpoint.objects.get(name=CHECKPOINT_NAME).value, checkpoint)
+        stats = precompute_recommendations()
+        self.assertEqual(stats['users'], 1)
+        self.assertEqual(JobCheckpoint.objects.get(name=CHECKPOINT_NAME).stats['users'], 1)
+
+
+@override_settings(FEEDBACK_BUFFERED=True)
+class FeedbackBufferTests(SimpleTestCase):
+    def buffer(self, batch_size, flush_interval):
+        buffer = FeedbackBuffer(batch_size=batch_size, flush_interval=flush_interval)
+        self.batches = []
+        self.enterContext(mock.patch.object(buffer, '_write', side_effect=self.batches.append))
+        self.addCleanup(buffer.stop)
+        return buffer
+
+    def test_full_batches_are_written_at_once_and_the_rest_after_the_interval(self):
+        buffer = self.buffer(batch_size=2, flush_interval=0.05)
+        buffer.record_impressions([1, 2, 3])
+        buffer.record_action(3, 'liked')
+        buffer.record_action(4, 'skipped')
+        buffer.flush()
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+        self.assertEqual(self.batches[-1], [('action', 4, 'skipped')])
+        self.assertEqual(buffer.metrics()['queue_depth'], 0)
+
+    def test_stop_writes_a_partial_batch_without_waiting_for_the_interval(self):
+        buffer = self.buffer(batch_size=100, flush_interval=60)
+        buffer.record_impressions([1, 2])
+        started = time.monotonic()
+        buffer.stop()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([len(batch) for batch in self.batches], [2])
+        # The next event starts a new drain thread
+        buffer.record_action(1, 'liked')
+        buffer.stop()
+        self.assertEqual(len(self.batches), 2)
+
+    def test_unknown_actions_are_refused(self):
+        with self.assertRaises(ValueError):
+            self.buffer(batch_size=10, flush_interval=1).record_action(1, 'loved')
+
+
+@override_settings(FEEDBACK_BUFFERED=False)
+class FeedbackTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('listener', password='pw')
+        self.workout = RecommendationMode.objects.get(name='workout')
+        self.recs = [
+            UserRecommendation.objects.create(
+                user=self.user, mode=self.workout, score=score,
+                song=Song.objects.create(spotify_id=f'song-{score}', name=str(score), artist='Artist'),
+            )
+            for score in (0.8, 0.6, 0.5, 0.4)
+        ]
+
+    def ranked(self):
+        return [(rec.id, rec.score, rec.user_action) for rec in mode_recommendations(self.user, self.workout)]
+
+    def test_actions_are_folded_into_the_stored_score(self):
+        top, second, third, fourth = self.recs
+        since = timezone.now()
+        write_events([
+            ('shown', top.id, since), ('action', top.id, 'skipped'),
+            ('action', second.id, 'liked'), ('action', fourth.id, 'added'),
+        ])
+        self.assertEqual(self.ranked(), [
+            (second.id, 0.75, 'liked'), (third.id, 0.5, ''), (top.id, 0.2, 'skipped'),
+        ])
+        self.assertEqual(changed_user_ids(since), {self.user.id})
+        # Changing a skip into a like swaps the multiplier rather than stacking it
+        write_events([('action', top.id, 'liked'), ('action', second.id, 'liked'), ('action', fourth.id, 'liked')])
+        self.assertEqual(self.ranked()[:2], [(top.id, 1.0, 'liked'), (second.id, 0.75, 'liked')])
+        self.assertEqual(UserRecommendation.objects.get(id=fourth.id).user_action, 'added')
+
+    def test_impressions_only_fill_an_empty_shown_at(self):
+        first_seen = timezone.now() - timedelta(days=1)
+        write_events([('shown', self.recs[0].id, first_seen)])
+        write_events([('shown', self.recs[0].id, timezone.now())])
+        self.assertEqual(UserRecommendation.objects.get(id=self.recs[0].id).shown_at, first_seen)
+
+    def test_mode_page_records_impressions(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('recommendations'), {'mode': 'workout'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(UserRecommendation.objects.filter(user=self.user, shown_at__isnull=True).exists())
+
+    def test_feedback_endpoint(self):
+        rec = self.recs[1]
+        url = reverse('recommendation_feedback', args=[rec.id])
+        self.client.force_login(self.user)
+        response = self.client.post(url, {'action': 'liked'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'status': 'queued', 'action': 'liked'})
+        rec.refresh_from_db()
+        self.assertEqual((rec.user_action, rec.score), ('liked', 0.75))
+        self.assertEqual(self.client.post(url, {'action': 'loved'}).status_code, 400)
+        self.assertRedirects(self.client.get(url), reverse('recommendations'), fetch_redirect_response=False)
+        self.client.force_login(User.objects.create_user('someone-else'))
+        self.assertEqual(self.client.post(url, {'action': 'skipped'}).status_code, 404)
+
+    def test_feedback_endpoint_queues_when_buffered(self):
+        rec = self.recs[0]
+        self.client.force_login(self.user)
+        with self.settings(FEEDBACK_BUFFERED=True), mock.patch.object(feedback_buffer, '_ensure_thread'):
+            response = self.client.post(
+                reverse('recommendation_feedback', args=[rec.id]), {'action': 'skipped', 'next': '/recommendations/?mode=workout'},
+            )
+            queued = feedback_buffer._queue.get_nowait()
+            feedback_buffer._queue.task_done()
+        self.assertRedirects(response, '/recommendations/?mode=workout', fetch_redirect_response=False)
+        self.assertEqual(queued, ('action', rec.id, 'skipped'))
+        rec.refresh_from_db()
+        self.assertEqual(rec.user_action, '')
+
+
+class ViewHelperTests(SimpleTestCase):
+    def test_parse_genres(self):
+        self.assertEqual(parse_genres(QueryDict('genre=Jazz,soul&genre=nope&genre=jazz')), ['jazz', 'soul'])
+        self.assertEqual(parse_genres(QueryDict('')), ['pop'])
+        with self.settings(RECOMMENDATION_MAX_GENRES=2):
+            self.assertEqual(parse_genres(QueryDict('genre=pop,rock,jazz')), ['pop', 'rock'])
+
+    def test_parse_year(self):
+        self.assertEqual(parse_year('2015'), '2015')
+        self.assertEqual(parse_year('2020 - 2015'), '2015-2020')
+        self.assertEqual(parse_year('2015-2015'), '2015')
+        self.assertEqual(parse_year('2015-20'), '')
+        self.assertEqual(parse_year('recent'), '')
+
+    def test_interleave(self):
+        a, b, c = Track('a'), Track('b'), Track('c')
+        self.assertEqual(interleave([[a, b], [c, a]]), [a, c, b])
+        self.assertEqual(interleave([[a, b], [c]], limit=2), [a, c])
+
+
+class GenreFanoutViewTests(StubSpotifyMixin, TestCase):
+    """Several genres on the recommendations page, searched on the fan-out pool"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('listener', password='pw'))
+        self.searched = []
+        fetch_search = spotify.fetch_search
+
+        def recording_fetch(q, genre, *args, **kwargs):
+            self.searched.append((genre, threading.current_thread().name))
+            if genre in self.failing:
+                raise SpotifyUnavailable('search')
+            return fetch_search(q, genre, *args, **kwargs)
+
+        self.failing = set()
+        self.enterContext(mock.patch.object(spotify, 'fetch_search', side_effect=recording_fetch))
+        # The fan-out threads would write outside the test's transaction
+        self.enterContext(mock.patch.object(spotify, 'ingest_tracks'))
+
+    def get(self, genres):
+        return self.client.get(reverse('recommendations'), {'genre': genres})
+
+    def test_genres_are_searched_at_once_and_interleaved(self):
+        self.stub.RequestHandlerClass.delay = 0.3
+        started = time.monotonic()
+        response = self.get('jazz,soul,rock')
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual(sorted(genre for genre, _ in self.searched), ['jazz', 'rock', 'soul'])
+        self.assertTrue(all(thread.startswith('spotify-fanout') for _, thread in self.searched))
+        tracks = response.context['spotify_tracks']
+        self.assertEqual(len(tracks), 60)
+        first_three = [spotify.search_tracks(genre=genre)[0].id for genre in ('jazz', 'soul', 'rock')]
+        self.assertEqual([t.id for t in tracks[:3]], first_three)
+        self.assertFalse(response.context['stale'])
+
+    def test_failing_genre_falls_back_to_its_last_known_tracks(self):
+        GenreSnapshot.objects.create(
+            genre='soul', tracks=dump_tracks([Track('old-soul', 'Old soul')]),
+            fetched_at=timezone.now() - timedelta(days=2),
+        )
+        self.failing = {'soul'}
+        response = self.get('jazz,soul')
+        ids = [t.id for t in response.context['spotify_tracks']]
+        self.assertEqual(len(ids), 21)
+        self.assertEqual(ids[1], 'old-soul')
+        self.assertTrue(response.context['stale'])
+        self.assertEqual(list(response.context['messages']), [])
+
+    def test_failing_genre_without_fallback_leaves_a_partial_page(self):
+        self.failing = {'rock'}
+        response = self.get('jazz,rock')
+        self.assertEqual(len(response.context['spotify_tracks']), 20)
+        self.assertFalse(response.context['stale'])
+        self.assertEqual(
+            [str(m) for m in response.context['messages']],
+            ["Spotify is not responding right now. Please try again shortly."],
+        )
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(StubSpotifyMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('listener', password='pw')
+        self.async_client.force_login(self.user)
+
+    async def test_search_renders_spotify_results(self):
+        response = await self.async_client.get(reverse('spotify_search'), {'q': 'blue'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertNotIn('stale', response.context)
+
+    async def test_search_falls_back_to_old_results_when_spotify_times_out(self):
+        # Entries are past their stale window at once, so only the outage fallback sees them
+        response_cache = ResponseCache(ttl=0, stale_ttl=0, max_bytes=1024)
+        self.enterContext(mock.patch.object(spotify, 'response_cache', response_cache))
+        response_cache.set(search_key(q='blue'), dump_tracks([Track('old', 'Old')]))
+        self.stub.RequestHandlerClass.delay = 0.5
+        with self.settings(SPOTIFY_LATENCY_BUDGETS={'search': 0.05}):
+            response = await self.async_client.get(reverse('spotify_search'), {'q': 'blue'})
+        self.assertEqual(response.context['results'], [Track('old', 'Old')])
+        self.assertTrue(response.context['stale'])
+
+    async def test_failed_lookup_cancels_the_playlists_query(self):
+        started = asyncio.Event()
+        cancelled = []
+
+        async def user_playlists(user):
+            started.set()
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def original_track(track_id):
+            await started.wait()
+            raise RuntimeError('boom')
+
+        with mock.patch.object(async_views, '_user_playlists', user_playlists), \
+                mock.patch.object(async_views, '_original_track', original_track):
+            response = await self.async_client.get(reverse('spotify_similar'), {'track_id': 'abc'})
+            await asyncio.sleep(0)
+        self.assertRedirects(response, reverse('spotify_search'), fetch_redirect_response=False)
+        self.assertEqual(cancelled, [True])
@@ -0,0 +1,258 @@
+"""Shared locks, request coalescing and rate limiting for outbound Spotify calls"""
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+try:
+    import fcntl
+except ImportError:  # Windows: cache locks only
+    fcntl = None
+
+from .exceptions import SpotifyThrottled
+
+
+# Lower numbers are served first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# A leader that has not published its result after this long is presumed dead
+FLIGHT_LOCK_TIMEOUT = 15
+# How long a finished flight's result stays available to late followers
+FLIGHT_RESULT_TTL = 5
+
+RETRY_AFTER_KEY = 'spotify:retry_after_until'
+
+
+class SharedLock:
+    """A non-blocking lock shared by every worker using the default cache.
+
+    Redis and memcached do the cache's ``add`` atomically, so it serves as
+    the lock, expiring after ``timeout`` if the holder dies. FileBasedCache
+    reads and writes separately, so two workers can both win the same
+    ``add``. With that backend the lock is an ``flock`` on a file of its own
+    in the cache directory instead, which the OS drops when the holder
+    exits. The holder deletes the file on release. Use one instance per
+    acquisition.
+    """
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        self._file = None
+
+    def _lock_path(self):
+        backend = caches['default']
+        if fcntl is None or not isinstance(backend, FileBasedCache):
+            return None
+        directory = os.path.join(backend._dir, 'locks')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, hashlib.sha1(self.key.encode()).hexdigest() + '.lock')
+
+    def _try_flock(self, f):
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def acquire(self):
+        """Take the lock if nobody holds it; returns whether it was taken"""
+        path = self._lock_path()
+        if path is None:
+            return cache.add(self.key, os.getpid(), timeout=self.timeout)
+        while True:
+            f = open(path, 'a')
+            if not self._try_flock(f):
+                f.close()
+                return False
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(f.fileno()).st_ino:
+                self._file = f
+                return True
+            # The previous holder deleted this file after we opened it
+            f.close()
+
+    def release(self):
+        if self._file is not None:
+            # Delete while still holding the lock, so nobody locks a file on its way out
+            os.unlink(self._file.name)
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        else:
+            cache.delete(self.key)
+
+    def locked(self):
+        """Whether some worker holds the lock right now"""
+        path = self._lock_path()
+        if path is None:
+            return cache.get(self.key) is not None
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            if not self._try_flock(f):
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+
+class RateLimiter:
+    """Token bucket with a priority queue of waiters.
+
+    Each worker process owns one bucket refilled at ``rate`` requests per
+    second up to ``burst``. When several threads wait, the lowest priority
+    number goes first, so interactive searches overtake background jobs.
+    A ``Retry-After`` from Spotify is published through the shared cache so
+    every worker backs off, not just the one that got the 429.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0  # wall-clock time, comparable across workers
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {'acquired': 0, 'waited': 0, 'throttled': 0, 'retry_after': 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def block(self, seconds):
+        """Stop handing out slots for ``seconds`` in every worker"""
+        until = time.time() + seconds
+        self.stats['retry_after'] += 1
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, until)
+        cache.set(RETRY_AFTER_KEY, until, timeout=max(int(seconds + 1), 1))
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """Take one request slot, waiting up to ``timeout`` seconds.
+
+        Raises SpotifyThrottled when the slot would not be free in time.
+        """
+        shared_block = cache.get(RETRY_AFTER_KEY) or 0.0
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        entry = (priority, next(self._seq))
+
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, shared_block)
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    blocked = self._blocked_until - time.time()
+                    if self._waiters[0] == entry and self._tokens >= 1 and blocked <= 0:
+                        self._tokens -= 1
+                        self.stats['acquired'] += 1
+                        return
+                    if blocked > 0:
+                        wait = blocked
+                    elif self._tokens < 1:
+                        wait = (1 - self._tokens) / self.rate
+                    else:
+                        wait = 0.01  # Someone with higher priority goes first
+                    if deadline is not None and time.monotonic() + wait > deadline:
+                        self.stats['throttled'] += 1
+                        raise SpotifyThrottled(wait)
+                    self.stats['waited'] += 1
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Share one upstream call between identical concurrent requests.
+
+    Threads of the same worker wait on the leader's in-memory result. Across
+    workers the leader holds a SharedLock and publishes its result in the
+    cache for a few seconds, so other workers poll for it rather than repeat
+    the call.
+    """
+
+    def __init__(self, shared_wait=3.0):
+        self.shared_wait = shared_wait
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced_local': 0, 'coalesced_shared': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            self.stats['coalesced_local'] += 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._lead(key, fn)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.done.set()
+            with self._lock:
+                del self._flights[key]
+
+    def _lead(self, key, fn):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        lock = SharedLock(f'spotify:flight:{digest}:lock', FLIGHT_LOCK_TIMEOUT)
+        result_key = f'spotify:flight:{digest}'
+
+        result = cache.get(result_key)
+        if result is not None:
+            self.stats['coalesced_shared'] += 1
+            return result
+
+        if not lock.acquire():
+            # Another worker is already on it
+            deadline = time.monotonic() + self.shared_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                result = cache.get(result_key)
+                if result is not None:
+                    self.stats['coalesced_shared'] += 1
+                    return result
+                if not lock.locked():
+                    break  # The leader gave up without a result
+            self.stats['leaders'] += 1
+            return fn()
+
+        self.stats['leaders'] += 1
+        try:
+            result = fn()
+            cache.set(result_key, result, timeout=FLIGHT_RESULT_TTL)
+            return result
+        finally:
+            lock.release()
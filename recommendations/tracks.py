@@ -0,0 +1,94 @@
+"""Compact track objects passed to templates and stored in caches.
+
+A Spotify track object carries available markets, full album and artist
+objects, and more. The pages only show a handful of fields, so tracks are
+cut down to a ``Track`` as soon as they come back from Spotify. A Track
+has ``__slots__`` and no per-instance dict. Caches and snapshots store it
+as a plain row (see ``to_row``), which is much smaller as JSON or pickle
+than the equivalent dict with repeated keys.
+"""
+
+
+class Track:
+    """The parts of a Spotify track the pages use"""
+
+    __slots__ = (
+        'id', 'name', 'artists', 'album', 'image_url',
+        'preview_url', 'duration_ms', 'spotify_url', 'explicit',
+    )
+
+    def __init__(self, id, name='', artists=(), album='', image_url='',
+                 preview_url=None, duration_ms=0, spotify_url='', explicit=False):
+        self.id = id
+        self.name = name
+        self.artists = tuple(artists)  # Artist names
+        self.album = album
+        self.image_url = image_url
+        self.preview_url = preview_url
+        self.duration_ms = duration_ms
+        self.spotify_url = spotify_url
+        self.explicit = explicit
+
+    @classmethod
+    def from_spotify(cls, data):
+        """Track from a Spotify API track object"""
+        album = data.get('album') or {}
+        images = album.get('images') or []
+        return cls(
+            id=data.get('id'),
+            name=data.get('name') or '',
+            artists=[artist.get('name', '') for artist in data.get('artists') or []],
+            album=album.get('name') or '',
+            image_url=(images[0].get('url') or '') if images else '',
+            preview_url=data.get('preview_url'),
+            duration_ms=data.get('duration_ms') or 0,
+            spotify_url=(data.get('external_urls') or {}).get('spotify', ''),
+            explicit=bool(data.get('explicit')),
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @classmethod
+    def load(cls, value):
+        """Track from a cached row, a Spotify-shaped dict or a Track"""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls.from_spotify(value)
+        return cls.from_row(value)
+
+    def to_row(self):
+        """Positional form for caches and JSON columns"""
+        return (
+            self.id, self.name, self.artists, self.album, self.image_url,
+            self.preview_url, self.duration_ms, self.spotify_url, self.explicit,
+        )
+
+    @property
+    def artist(self):
+        """All artist names, comma separated"""
+        return ', '.join(self.artists)
+
+    @property
+    def first_artist(self):
+        return self.artists[0] if self.artists else ''
+
+    def __eq__(self, other):
+        return isinstance(other, Track) and self.to_row() == other.to_row()
+
+    def __hash__(self):
+        # Consistent with __eq__: equal tracks always share an id
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<Track {self.id}: {self.name} by {self.artist}>"
+
+
+def dump_tracks(tracks):
+    return [track.to_row() for track in tracks]
+
+
+def load_tracks(rows):
+    return [Track.load(row) for row in rows or []]
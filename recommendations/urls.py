@@ -1,10 +1,18 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# The async views need an ASGI server to pay off (ASGI=True in start.sh)
+if settings.SPOTIFY_ASYNC_VIEWS:
+    from . import async_views as spotify_views
+else:
+    spotify_views = views
+
 urlpatterns = [
-    path('', views.spotify_recommendations_view, name='recommendations'),
-    path('spotify/', views.spotify_recommendations_view, name='spotify_recommendations'),
-    path('spotify/search/', views.search_spotify_view, name='spotify_search'),
-    path('spotify/similar/', views.spotify_similar_view, name='spotify_similar'),
+    path('', spotify_views.spotify_recommendations_view, name='recommendations'),
+    path('spotify/', spotify_views.spotify_recommendations_view, name='spotify_recommendations'),
+    path('spotify/search/', spotify_views.search_spotify_view, name='spotify_search'),
+    path('spotify/similar/', spotify_views.spotify_similar_view, name='spotify_similar'),
+    path('spotify/status/', views.spotify_status_view, name='spotify_status'),
+    path('feedback/<int:recommendation_id>/', views.recommendation_feedback_view, name='recommendation_feedback'),
 ]
-
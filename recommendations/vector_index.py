@@ -0,0 +1,252 @@
+"""In-memory nearest-neighbour index over Song audio features.
+
+Every Song with all audio features filled in becomes one row of a float32
+matrix. Features are scaled to 0..1 with fixed bounds, so new rows can be
+appended without rescaling the old ones. Queries are brute force. At tens
+of thousands of songs a cosine or euclidean top-k is a single matrix-vector
+product plus ``argpartition``, well under a millisecond.
+
+Each worker loads a memory-mapped snapshot written by ``build_feature_index``
+at startup. It then appends songs added since the snapshot, checking at
+most every FEATURE_INDEX_REFRESH_SECONDS (straight away after a Song is
+saved in the same worker). Each check also compares a checksum of the
+features of the songs already indexed with the database. Features edited
+in place, by any worker or by a bulk UPDATE that sends no signals, change
+it, and the index is then rebuilt.
+"""
+import json
+import os
+import threading
+import time
+from functools import reduce
+from operator import add
+
+import numpy as np
+from django.conf import settings
+from django.db.models import BigIntegerField, Count, F, Q, Sum
+from django.db.models.functions import Cast, Mod, Round
+
+FEATURES = [
+    'danceability', 'energy', 'valence', 'tempo',
+    'acousticness', 'instrumentalness', 'liveness', 'speechiness',
+]
+# Tempo is in BPM; everything else is already 0..1
+FEATURE_SCALE = np.array([1, 1, 1, 250, 1, 1, 1, 1], dtype=np.float32)
+# Checksum weights: distinct per feature and per song, so moving a value to
+# another feature or another song still changes the sum
+CHECKSUM_WEIGHTS = [1, 2, 3, 4, 5, 7, 11, 13]
+CHECKSUM_ROW_MODULUS = 1009
+# Features enter the checksum as whole millionths
+CHECKSUM_QUANTUM = 1_000_000
+
+
+def _featured_songs():
+    from playlists.models import Song
+
+    filters = {f'{name}__isnull': False for name in FEATURES}
+    return Song.objects.filter(**filters)
+
+
+def _features_version(watermark):
+    """((count, checksum) of featured songs up to ``watermark``, the same for all of them)
+
+    One aggregate query. Every feature is rounded to an integer number of
+    millionths before it is weighted, so the checksum is an exact integer
+    sum. Summing in a different order can never look like a change.
+    """
+    weighted = reduce(add, (
+        Cast(Round(F(name) * CHECKSUM_QUANTUM), BigIntegerField()) * weight
+        for name, weight in zip(FEATURES, CHECKSUM_WEIGHTS)
+    ))
+    checksum = (Mod('id', CHECKSUM_ROW_MODULUS) + 1) * weighted
+    upto = Q(id__lte=watermark)
+    totals = _featured_songs().aggregate(
+        count_upto=Count('id', filter=upto),
+        sum_upto=Sum(checksum, filter=upto, output_field=BigIntegerField()),
+        count=Count('id'),
+        sum=Sum(checksum, output_field=BigIntegerField()),
+    )
+    # PostgreSQL sums bigints into a numeric
+    return (
+        (totals['count_upto'], int(totals['sum_upto'] or 0)),
+        (totals['count'], int(totals['sum'] or 0)),
+    )
+
+
+def _normalized(vectors):
+    """Rows scaled to unit length, for cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+class FeatureIndex:
+    """Song feature vectors with cosine/euclidean top-k lookups"""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, len(FEATURES)), dtype=np.float32)
+        self.unit = np.empty((0, len(FEATURES)), dtype=np.float32)  # Row-normalized, for cosine
+        self._row_by_spotify_id = {}
+        self.spotify_ids = []
+        self.watermark = 0  # Highest Song.id included
+        self.version = None  # (count, checksum) of the indexed songs when they were read
+        self.checked_at = 0.0
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.stats = {'queries': 0, 'refreshes': 0, 'rebuilds': 0}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows_from(self, queryset):
+        rows = list(queryset.order_by('id').values_list('id', 'spotify_id', *FEATURES))
+        if not rows:
+            return np.empty(0, dtype=np.int64), [], np.empty((0, len(FEATURES)), dtype=np.float32)
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        spotify_ids = [r[1] for r in rows]
+        vectors = np.array([r[2:] for r in rows], dtype=np.float32) / FEATURE_SCALE
+        return ids, spotify_ids, np.clip(vectors, 0.0, 1.0)
+
+    def _set(self, ids, spotify_ids, vectors, unit):
+        self.ids = ids
+        self.spotify_ids = spotify_ids
+        self.vectors = vectors
+        self.unit = unit
+        self._row_by_spotify_id = {sid: row for row, sid in enumerate(spotify_ids)}
+        self.watermark = int(ids[-1]) if len(ids) else 0
+
+    def rebuild(self):
+        """Load every featured song from the database"""
+        # Versioned before reading, so a change in between shows up next time
+        _, version = _features_version(0)
+        ids, spotify_ids, vectors = self._rows_from(_featured_songs())
+        unit = _normalized(vectors)
+        with self._lock:
+            self._set(ids, spotify_ids, vectors, unit)
+            self.version = version
+            self.checked_at = time.monotonic()
+            self.dirty = False
+            self.stats['rebuilds'] += 1
+
+    def refresh(self):
+        """Append songs added since the last load, or rebuild if indexed songs changed.
+
+        Songs that gained, lost or changed features after they were indexed
+        (edited, or filled in by an audio-features backfill) change the
+        version of the rows up to the watermark.
+        """
+        indexed, version = _features_version(self.watermark)
+        if indexed != self.version:
+            self.rebuild()
+            return
+        if version != indexed:
+            ids, spotify_ids, vectors = self._rows_from(_featured_songs().filter(id__gt=self.watermark))
+        else:
+            ids = ()
+        with self._lock:
+            if len(ids):
+                self._set(
+                    np.concatenate([self.ids, ids]),
+                    self.spotify_ids + spotify_ids,
+                    np.concatenate([self.vectors, vectors]),
+                    np.concatenate([self.unit, _normalized(vectors)]),
+                )
+                self.version = version
+            self.checked_at = time.monotonic()
+            self.dirty = False
+            self.stats['refreshes'] += 1
+
+    def maybe_refresh(self):
+        interval = getattr(settings, 'FEATURE_INDEX_REFRESH_SECONDS', 60)
+        if self.dirty or time.monotonic() - self.checked_at > interval:
+            self.refresh()
+
+    def nearest(self, vector, k=20, metric='cosine', exclude_row=None):
+        """Top-k (song id, score) pairs, best first.
+
+        Scores are cosine similarity (higher is closer) or negated euclidean
+        distance, so callers can always sort descending.
+        """
+        self.stats['queries'] += 1
+        if not len(self.ids):
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        if metric == 'euclidean':
+            scores = -np.linalg.norm(self.vectors - vector, axis=1)
+        else:
+            unit = vector / max(float(np.linalg.norm(vector)), 1e-9)
+            scores = self.unit @ unit
+        if exclude_row is not None:
+            scores = scores.copy()
+            scores[exclude_row] = -np.inf
+        k = min(k, len(scores) - (exclude_row is not None))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top]
+
+    def similar(self, spotify_id, k=20, metric='cosine'):
+        """Songs closest to the given one, or None if it is not indexed"""
+        with self._lock:
+            row = self._row_by_spotify_id.get(spotify_id)
+            if row is None:
+                return None
+            return self.nearest(self.vectors[row], k=k, metric=metric, exclude_row=row)
+
+    def save(self, path):
+        """Write a snapshot that ``load`` can memory-map"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'vectors.npy'), np.ascontiguousarray(self.vectors))
+        # Stored too, so workers memory-map them instead of each normalizing a copy
+        np.save(os.path.join(path, 'unit.npy'), np.ascontiguousarray(self.unit))
+        np.save(os.path.join(path, 'ids.npy'), self.ids)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'spotify_ids': self.spotify_ids, 'features': FEATURES, 'version': self.version}, f)
+
+    def load(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('features') != FEATURES:
+            raise ValueError("Feature index snapshot was built with different features")
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        unit_path = os.path.join(path, 'unit.npy')
+        unit = np.load(unit_path, mmap_mode='r') if os.path.exists(unit_path) else _normalized(vectors)
+        with self._lock:
+            self._set(np.load(os.path.join(path, 'ids.npy')), meta['spotify_ids'], vectors, unit)
+            # Snapshots without a version are rebuilt on first use
+            self.version = tuple(meta['version']) if meta.get('version') else None
+            # Catch up with the database on first use
+            self.checked_at = 0.0
+
+    def metrics(self):
+        return dict(self.stats, songs=len(self), watermark=self.watermark)
+
+
+feature_index = FeatureIndex()
+_loaded = False
+
+
+def mark_dirty(sender, instance, **kwargs):
+    """post_save hook: check the index against the database on this worker's next query"""
+    feature_index.dirty = True
+
+
+def get_index():
+    """The worker's index, loaded from the database on first use if no snapshot was"""
+    global _loaded
+    if not _loaded:
+        _loaded = True
+        if not len(feature_index):
+            feature_index.rebuild()
+    feature_index.maybe_refresh()
+    return feature_index
+
+
+def load_snapshot():
+    """Memory-map the snapshot at FEATURE_INDEX_PATH if there is one"""
+    path = getattr(settings, 'FEATURE_INDEX_PATH', None)
+    if path and os.path.exists(os.path.join(path, 'meta.json')):
+        feature_index.load(path)
+        return True
+    return False
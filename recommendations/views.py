@@ -1,121 +1,306 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.conf import settings
-import requests
-import base64
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import zip_longest
+from .engine import mode_recommendations
+from .feedback import ACTIONS, feedback_buffer
+from .models import GenreSnapshot, RecommendationMode, UserRecommendation
+from .tracks import load_tracks
+from playlists.catalog import track_from_song
+from playlists.fragments import fragment_cache
+from playlists.search import search_songs
+from . import spotify
+from .async_spotify import async_stats
+from .spotify import get_spotify_token
+from .vector_index import feature_index, get_index
 
 
-def get_spotify_token():
-    """Get Spotify API access token"""
-    client_id = getattr(settings, 'SPOTIFY_CLIENT_ID', None)
-    client_secret = getattr(settings, 'SPOTIFY_CLIENT_SECRET', None)
-    
-    if not client_id or not client_secret:
+# Multi-genre requests run their per-genre searches on this pool
+_fanout_pool = ThreadPoolExecutor(
+    max_workers=settings.SPOTIFY_FANOUT_WORKERS, thread_name_prefix='spotify-fanout'
+)
+YEAR_PATTERN = re.compile(r'^(\d{4})(?:-(\d{4}))?$')
+
+
+def parse_genres(query):
+    """Valid genres from ``?genre=jazz,soul`` or repeated ``?genre=``, in the order given"""
+    genres = []
+    for value in query.getlist('genre'):
+        for genre in value.split(','):
+            genre = genre.lower().strip()
+            if genre in spotify.VALID_GENRES and genre not in genres:
+                genres.append(genre)
+    return genres[:settings.RECOMMENDATION_MAX_GENRES] or ['pop']
+
+
+def parse_year(value):
+    """'2015', '2015-2020' (or '2020-2015', normalized), else '' for anything else"""
+    match = YEAR_PATTERN.match(value.replace(' ', ''))
+    if not match:
+        return ''
+    start, end = match.group(1), match.group(2)
+    if end is None or start == end:
+        return start
+    return f"{min(start, end)}-{max(start, end)}"
+
+
+def interleave(track_lists, limit=None):
+    """Round-robin merge of several result lists, dropping repeated track ids"""
+    merged, seen = [], set()
+    for row in zip_longest(*track_lists):
+        for track in row:
+            if track and track.id not in seen:
+                seen.add(track.id)
+                merged.append(track)
+    return merged[:limit] if limit else merged
+
+
+def get_genre_snapshots(genres, year=''):
+    """Warmed results for genre pages that are recent enough to serve, by genre"""
+    cutoff = timezone.now() - timedelta(seconds=settings.SPOTIFY_SNAPSHOT_MAX_AGE)
+    snapshots = GenreSnapshot.objects.filter(
+        genre__in=genres, year=year, fetched_at__gte=cutoff
+    ).only('genre', 'tracks', 'fetched_at')
+    return {snapshot.genre: snapshot for snapshot in snapshots}
+
+
+def stale_genre_tracks(genre, year=''):
+    """Last known tracks for a genre during an outage: cached results, else the newest snapshot"""
+    tracks = spotify.cached_search(genre=genre, year=year)
+    if tracks is None:
+        latest = GenreSnapshot.objects.filter(genre=genre, year=year).only('tracks').first()
+        tracks = load_tracks(latest.tracks) if latest else None
+    return tracks
+
+
+def search_genres(genres, year=''):
+    """Search each genre concurrently, as {genre: tracks or the exception raised}.
+
+    Every sub-query goes through ``spotify.search_tracks`` on its own, so it
+    is cached and coalesced separately and overlapping requests share work.
+    """
+    if len(genres) == 1:
+        futures = {}
+    else:
+        futures = {genre: _fanout_pool.submit(spotify.search_tracks, genre=genre, year=year) for genre in genres}
+    results = {}
+    for genre in genres:
+        try:
+            if genre in futures:
+                results[genre] = futures[genre].result()
+            else:
+                results[genre] = spotify.search_tracks(genre=genre, year=year)
+        except Exception as e:
+            results[genre] = e
+    return results
+
+
+def merge_genre_results(genres, year, snapshots, results):
+    """(tracks, stale, errors) for a genre page from snapshots and search results.
+
+    Genres Spotify could not answer for fall back to their last known
+    tracks, which marks the page stale.
+    """
+    track_lists, stale, errors = [], False, []
+    for genre in genres:
+        if genre in snapshots:
+            track_lists.append(load_tracks(snapshots[genre].tracks))
+            continue
+        result = results[genre]
+        if isinstance(result, spotify.SpotifyUnavailable):
+            fallback = stale_genre_tracks(genre, year)
+            if fallback is None:
+                errors.append(result)
+            else:
+                track_lists.append(fallback)
+                stale = True
+        elif isinstance(result, Exception):
+            errors.append(result)
+        else:
+            track_lists.append(result)
+    return interleave(track_lists, settings.RECOMMENDATION_PAGE_SIZE), stale, errors
+
+
+def report_spotify_error(request, error):
+    if isinstance(error, spotify.SpotifyUnavailable):
+        messages.error(request, "Spotify is not responding right now. Please try again shortly.")
+    elif isinstance(error, spotify.SpotifyThrottled):
+        messages.warning(request, str(error))
+    elif isinstance(error, spotify.SpotifyAPIError):
+        messages.error(request, str(error))
+    else:
+        messages.error(request, f"Error connecting to Spotify: {str(error)}")
+
+
+def user_playlist_choices(user):
+    """The user's playlists for the add-to-playlist picker, evaluated once"""
+    from playlists.models import Playlist
+
+    return list(Playlist.objects.filter(owner=user).only('id', 'name').order_by('-updated_at'))
+
+
+def search_local_catalog(query, limit=20):
+    """Local catalog matches as Tracks, or None if Spotify should be asked.
+
+    Queries using Spotify field filters (``artist:...``) always go to Spotify.
+    """
+    if not query.strip() or ':' in query:
+        return None
+    songs = search_songs(query, limit=limit)
+    if len(songs) < settings.LOCAL_SEARCH_MIN_HITS:
+        return None
+    return [track_from_song(song) for song in songs]
+
+
+def similar_from_index(track_id, limit=20):
+    """(original, similar) Tracks from the audio-feature index.
+
+    Returns None when the track has no stored audio features, in which case
+    the caller falls back to asking Spotify.
+    """
+    from playlists.models import Song
+
+    neighbours = get_index().similar(track_id, k=limit, metric=settings.FEATURE_INDEX_METRIC)
+    if neighbours is None:
         return None
+    original = Song.objects.filter(spotify_id=track_id).first()
+    if original is None:
+        return None
+    songs = Song.objects.in_bulk([song_id for song_id, _ in neighbours])
+    similar = [track_from_song(songs[song_id]) for song_id, _ in neighbours if song_id in songs]
+    return track_from_song(original), similar
+
+
+def mode_recommendations_page(request, mode_name):
+    """Precomputed recommendations for an activity mode (?mode=workout), or
+    the personalized ones (?mode=for-you)"""
+    modes = list(RecommendationMode.objects.order_by('id'))
+    if mode_name == 'for-you':
+        mode = None
+        title = "For You"
+        description = "Picked from your playlists, reviews and favorite artist and genre"
+    else:
+        mode = next((m for m in modes if m.name == mode_name), None)
+        if mode is None:
+            messages.error(request, "Unknown recommendation mode.")
+            return redirect('recommendations')
+        title = mode.get_name_display()
+        description = mode.description
     
-    # Encode credentials
-    credentials = f"{client_id}:{client_secret}"
-    credentials_b64 = base64.b64encode(credentials.encode()).decode()
+    recommendations = mode_recommendations(request.user, mode)
+    for rec in recommendations:
+        rec.track = track_from_song(rec.song)
+    feedback_buffer.record_impressions([rec.id for rec in recommendations])
     
-    # Get token
-    url = "https://accounts.spotify.com/api/token"
-    headers = {
-        "Authorization": f"Basic {credentials_b64}",
-        "Content-Type": "application/x-www-form-urlencoded"
+    context = {
+        'mode_name': mode_name,
+        'title': title,
+        'description': description,
+        'modes': modes,
+        'recommendations': recommendations,
+        'user_playlists': user_playlist_choices(request.user),
     }
-    data = {"grant_type": "client_credentials"}
+    return render(request, 'recommendations/mode_recommendations.html', context)
+
+
+@login_required
+def recommendation_feedback_view(request, recommendation_id):
+    """Like or skip a recommendation; written in the next feedback flush"""
+    if request.method != 'POST':
+        return redirect('recommendations')
     
-    try:
-        response = requests.post(url, headers=headers, data=data, timeout=10)
-        if response.status_code == 200:
-            return response.json().get('access_token')
-    except:
-        pass
+    action = request.POST.get('action', '')
+    if action not in ACTIONS:
+        return JsonResponse({'error': 'Unknown action'}, status=400)
+    if not UserRecommendation.objects.filter(id=recommendation_id, user=request.user).exists():
+        return JsonResponse({'error': 'Not found'}, status=404)
     
-    return None
+    feedback_buffer.record_action(recommendation_id, action)
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'status': 'queued', 'action': action})
+    return redirect(request.POST.get('next') or 'recommendations')
 
 
 @login_required
 def spotify_recommendations_view(request):
-    """Get music recommendations from Spotify API using search"""
-    token = get_spotify_token()
-    
-    if not token:
-        messages.warning(request, "Spotify API not configured. Please set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET environment variables.")
-        return render(request, 'recommendations/recommendations.html', {'spotify_tracks': [], 'genre': 'pop'})
+    """Get music recommendations from Spotify API using search.
+
+    Several genres and a year range can be asked for at once
+    (``?genre=jazz,soul&year=2015-2020``). Each genre is searched
+    concurrently and the results are interleaved.
+    """
+    if request.GET.get('mode'):
+        return mode_recommendations_page(request, request.GET['mode'])
     
     # Popular genres to search for
-    valid_genres = [
-        'pop', 'rock', 'hip-hop', 'electronic', 'jazz', 'classical', 
-        'country', 'r&b', 'indie', 'metal', 'punk', 'blues', 'reggae',
-        'folk', 'soul', 'funk', 'disco', 'house', 'techno', 'trance',
-        'edm', 'ambient', 'latin', 'reggaeton', 'k-pop', 'afrobeat'
-    ]
+    valid_genres = spotify.VALID_GENRES
     
     # Get parameters
-    genre = request.GET.get('genre', 'pop').lower().strip()
-    
-    # Validate genre
-    if not genre or genre not in valid_genres:
-        genre = 'pop'
+    genres = parse_genres(request.GET)
+    genre = ','.join(genres)
     
-    # Use Search API to find songs by genre
-    url = "https://api.spotify.com/v1/search"
-    headers = {"Authorization": f"Bearer {token}"}
+    # Add year filter for newer music
+    year = parse_year(request.GET.get('year', ''))
     
-    # Build search query with genre
-    search_query = f"genre:{genre}"
+    user_playlists = user_playlist_choices(request.user)
     
-    # Add year filter for newer music
-    year = request.GET.get('year', '')
-    if year:
-        search_query += f" year:{year}"
-    
-    params = {
-        "q": search_query,
-        "type": "track",
-        "limit": 20,
-        "market": "US"
+    context = {
+        'spotify_tracks': [],
+        'genre': genre,
+        'genres': genres,
+        'year': year,
+        'valid_genres': valid_genres,
+        'user_playlists': user_playlists,
     }
     
-    from playlists.models import Playlist
-    user_playlists = Playlist.objects.filter(owner=request.user).order_by('-updated_at')
+    # Serve pages warmed by warm_genre_pages without waiting on Spotify
+    snapshots = get_genre_snapshots(genres, year)
+    if len(snapshots) == len(genres):
+        context['spotify_tracks'] = interleave(
+            [load_tracks(snapshots[g].tracks) for g in genres], settings.RECOMMENDATION_PAGE_SIZE
+        )
+        context['snapshot_fetched_at'] = min(snapshot.fetched_at for snapshot in snapshots.values())
+        return render(request, 'recommendations/recommendations.html', context)
     
-    try:
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            spotify_tracks = data.get('tracks', {}).get('items', [])
-            
-            context = {
-                'spotify_tracks': spotify_tracks,
-                'genre': genre,
-                'valid_genres': valid_genres,
-                'user_playlists': user_playlists,
-            }
-            return render(request, 'recommendations/recommendations.html', context)
-        else:
-            messages.error(request, f"Spotify API error: {response.status_code}")
-    except Exception as e:
-        messages.error(request, f"Error connecting to Spotify: {str(e)}")
+    token = get_spotify_token()
     
-    # Return empty page on error instead of redirect loop
-    return render(request, 'recommendations/recommendations.html', {
-        'spotify_tracks': [],
-        'genre': genre,
-        'user_playlists': user_playlists
-    })
+    if not token:
+        messages.warning(request, "Spotify API not configured. Please set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET environment variables.")
+        return render(request, 'recommendations/recommendations.html', {'spotify_tracks': [], 'genre': 'pop'})
+    
+    # Use Search API to find songs by genre, one search per genre at once
+    results = search_genres([g for g in genres if g not in snapshots], year)
+    tracks, stale, errors = merge_genre_results(genres, year, snapshots, results)
+    if errors:
+        report_spotify_error(request, errors[0])
+    context.update(spotify_tracks=tracks, stale=stale)
+    return render(request, 'recommendations/recommendations.html', context)
 
 
 @login_required
 def search_spotify_view(request):
     """Search for songs on Spotify"""
-    from playlists.models import Playlist
-    
     query = request.GET.get('q', '')
+    user_playlists = user_playlist_choices(request.user)
+    
+    # Answer from the local catalog when it has enough matches
+    local_results = search_local_catalog(query)
+    if local_results is not None:
+        return render(request, 'recommendations/spotify_search.html', {
+            'results': local_results,
+            'query': query,
+            'user_playlists': user_playlists,
+        })
+    
     token = get_spotify_token()
-    user_playlists = Playlist.objects.filter(owner=request.user).order_by('-updated_at')
     
     if not token:
         messages.warning(request, "Spotify API not configured.")
@@ -132,27 +317,32 @@ def search_spotify_view(request):
         })
     
     # Search Spotify
-    url = "https://api.spotify.com/v1/search"
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {
-        "q": query,
-        "type": "track",
-        "limit": 20,
-        "market": "US"
-    }
-    
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            tracks = data.get('tracks', {}).get('items', [])
-            
+        tracks = spotify.search_tracks(q=query)
+        
+        context = {
+            'results': tracks,
+            'query': query,
+            'user_playlists': user_playlists,
+        }
+        return render(request, 'recommendations/spotify_search.html', context)
+    except spotify.SpotifyUnavailable:
+        stale_tracks = spotify.cached_search(q=query)
+        if stale_tracks is None:
+            stale_tracks = [track_from_song(song) for song in search_songs(query)] or None
+        if stale_tracks is not None:
             context = {
-                'results': tracks,
+                'results': stale_tracks,
                 'query': query,
                 'user_playlists': user_playlists,
+                'stale': True,
             }
             return render(request, 'recommendations/spotify_search.html', context)
+        messages.error(request, "Spotify is not responding right now. Please try again shortly.")
+    except spotify.SpotifyThrottled as e:
+        messages.warning(request, str(e))
+    except spotify.SpotifyAPIError:
+        pass
     except Exception as e:
         messages.error(request, f"Error searching Spotify: {str(e)}")
     
@@ -168,6 +358,19 @@ def spotify_similar_view(request):
     track_id = request.GET.get('track_id', '')
     track_name = request.GET.get('track_name', '')
     
+    # Songs with stored audio features are answered locally by sound, not artist
+    from_index = similar_from_index(track_id) if track_id else None
+    if from_index:
+        original_track, similar_tracks = from_index
+        context = {
+            'original_track': original_track,
+            'similar_tracks': similar_tracks,
+            'track_name': track_name or original_track.name,
+            'user_playlists': user_playlist_choices(request.user),
+            'similar_source': 'features',
+        }
+        return render(request, 'recommendations/spotify_similar.html', context)
+    
     token = get_spotify_token()
     
     if not token:
@@ -180,43 +383,40 @@ def spotify_similar_view(request):
     
     similar_tracks = []
     original_track = None
+    stale = False
     
     try:
-        headers = {"Authorization": f"Bearer {token}"}
-        
         # First, get the original track info
-        track_url = f"https://api.spotify.com/v1/tracks/{track_id}"
-        track_response = requests.get(track_url, headers=headers, timeout=10)
+        try:
+            original_track = spotify.get_track(track_id)
+        except spotify.SpotifyUnavailable:
+            original_track = spotify.cached_track(track_id)
+            stale = True
+        except spotify.SpotifyAPIError:
+            original_track = None
         
-        if track_response.status_code == 200:
-            original_track = track_response.json()
-            artist_name = original_track['artists'][0]['name'] if original_track.get('artists') else ''
+        if original_track:
+            artist_name = original_track.first_artist
             
             # Search for more songs by the same artist
-            search_url = "https://api.spotify.com/v1/search"
-            search_params = {
-                "q": f"artist:{artist_name}",
-                "type": "track",
-                "limit": 20,
-                "market": "US"
-            }
-            
-            search_response = requests.get(search_url, headers=headers, params=search_params, timeout=10)
-            
-            if search_response.status_code == 200:
-                search_data = search_response.json()
-                all_tracks = search_data.get('tracks', {}).get('items', [])
-                # Filter out the original track
-                similar_tracks = [t for t in all_tracks if t['id'] != track_id]
+            try:
+                all_tracks = spotify.search_tracks(q=f"artist:{artist_name}")
+            except spotify.SpotifyUnavailable:
+                all_tracks = spotify.cached_search(q=f"artist:{artist_name}") or []
+                stale = True
+            except spotify.SpotifyAPIError:
+                all_tracks = []
+            # Filter out the original track
+            similar_tracks = [t for t in all_tracks if t.id != track_id]
         
-        from playlists.models import Playlist
-        user_playlists = Playlist.objects.filter(owner=request.user).order_by('-updated_at')
+        user_playlists = user_playlist_choices(request.user)
         
         context = {
             'original_track': original_track,
             'similar_tracks': similar_tracks,
-            'track_name': track_name or (original_track['name'] if original_track else 'Unknown'),
+            'track_name': track_name or (original_track.name if original_track else 'Unknown'),
             'user_playlists': user_playlists,
+            'stale': stale,
         }
         return render(request, 'recommendations/spotify_similar.html', context)
         
@@ -225,3 +425,19 @@ def spotify_similar_view(request):
     
     return redirect('spotify_search')
 
+
+@staff_member_required
+def spotify_status_view(request):
+    """Spotify client counters for this worker (staff only)"""
+    metrics = spotify.get_metrics()
+    snapshots = GenreSnapshot.objects.aggregate(
+        count=Count('id'), oldest=Min('fetched_at'), slowest_refresh_ms=Max('refresh_ms')
+    )
+    if snapshots['oldest']:
+        snapshots['oldest_age_seconds'] = int((timezone.now() - snapshots['oldest']).total_seconds())
+    metrics['snapshots'] = snapshots
+    metrics['async'] = dict(async_stats)
+    metrics['feature_index'] = feature_index.metrics()
+    metrics['feedback'] = feedback_buffer.metrics()
+    metrics['fragment_cache'] = fragment_cache.metrics()
+    return JsonResponse(metrics)
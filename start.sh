@@ -75,21 +75,41 @@ fi
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
+# Keep the genre pages warm in the background (WARM_GENRES_INTERVAL seconds between runs)
+if [ "${WARM_GENRES}" = "True" ]; then
+    echo "Starting genre page warmer..."
+    python manage.py warm_genre_pages --years "${WARM_GENRES_YEARS:-0}" --interval "${WARM_GENRES_INTERVAL:-1800}" &
+fi
+
+# Refresh personalized recommendations in the background (nightly by default)
+if [ "${PRECOMPUTE_RECOMMENDATIONS}" = "True" ]; then
+    echo "Starting recommendation precompute job..."
+    python manage.py precompute_recommendations --interval "${PRECOMPUTE_INTERVAL:-86400}" &
+fi
+
 # Calculate worker processes: 2 * CPU_COUNT + 1
 CPU_COUNT=$(nproc)
 WORKERS=$((2 * CPU_COUNT + 1))
 echo "CPU count: $CPU_COUNT, Gunicorn workers: $WORKERS"
 
+# ASGI=True runs uvicorn workers so the async Spotify views can overlap requests
+if [ "${ASGI}" = "True" ]; then
+    echo "Using ASGI (uvicorn) workers"
+    GUNICORN_APP="--worker-class uvicorn.workers.UvicornWorker musicmatch.asgi:application"
+else
+    GUNICORN_APP="musicmatch.wsgi:application"
+fi
+
 # If SKIP_NGINX=True (local dev only), run gunicorn only on 8000
 # Note: USE_SQLITE alone should NOT skip nginx - SQLite can run in production with nginx
 if [ "${SKIP_NGINX}" = "True" ] || [ "${SKIP_NGINX}" = "true" ]; then
     echo "Starting gunicorn only (dev mode - no nginx)..."
-    exec gunicorn --bind 0.0.0.0:8000 --workers $WORKERS musicmatch.wsgi:application
+    exec gunicorn --bind 0.0.0.0:8000 --workers $WORKERS $GUNICORN_APP
 fi
 
 # Otherwise, production: run gunicorn then nginx
 echo "Starting gunicorn with $WORKERS workers..."
-gunicorn --bind 0.0.0.0:8000 --workers $WORKERS musicmatch.wsgi:application &
+gunicorn --bind 0.0.0.0:8000 --workers $WORKERS $GUNICORN_APP &
 
 echo "Starting nginx..."
 echo "MusicMatch is ready!"